@@ -0,0 +1,329 @@
+"""
+Benchmark every stage of the report pipeline on synthetic reports.
+
+Reports are generated for each size, then each load_and_clean_* stage and
+each function in playwaze_reports is timed. The teams report is also loaded
+from csv and json. Results are saved as JSON so that
+runs can be compared.
+
+Usage:
+    python -m benchmarks.pipeline_benchmark --sizes 100 1000 10000 100000
+    python -m benchmarks.pipeline_benchmark --compare old.json new.json
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+import warnings
+from typing import Callable, Dict, List, Tuple
+
+import pandas as pd
+import yaml
+
+import playwaze_rowing_reports.aggregation as aggregation
+import playwaze_rowing_reports.incremental as incremental
+import playwaze_rowing_reports.pipeline as pipeline
+import playwaze_rowing_reports.playwaze_reports as pw
+import playwaze_rowing_reports.synthetic as synthetic
+
+DEFAULT_PW_CONFIG_PATH = os.path.join("config", "playwaze_config.yaml")
+DEFAULT_SIZES = [100, 1000, 10000, 100000]
+REPORT_FILE_TYPES = ("xlsx", "csv", "json")
+
+
+def time_stage(
+    func: Callable, setup: Callable[[], Tuple] = tuple, repeats: int = 3
+) -> Dict[str, float]:
+    """
+    Time func over a number of repeats. setup is called before each repeat,
+    outside of the timing, to make fresh arguments for func.
+    """
+
+    times = []
+    for _ in range(repeats):
+        args = setup()
+        start = time.perf_counter()
+        func(*args)
+        times.append(time.perf_counter() - start)
+
+    return {
+        "min": min(times),
+        "median": statistics.median(times),
+        "repeats": repeats,
+    }
+
+
+def get_stages(
+    paths: Dict[str, str], pw_config: Dict
+) -> List[Tuple[str, Callable, Callable[[], Tuple]]]:
+    """Get the name, function and argument setup of each stage to time."""
+
+    teams_columns = pw_config["teams report columns"]
+    team_members_columns = pw_config["team members report columns"]
+    community_members_columns = pw_config["community members report columns"]
+
+    teams_path = paths[f"{synthetic.TEAMS_REPORT}.xlsx"]
+    teams_path_csv = paths[f"{synthetic.TEAMS_REPORT}.csv"]
+    teams_path_json = paths[f"{synthetic.TEAMS_REPORT}.json"]
+    team_members_path = paths[f"{synthetic.TEAM_MEMBERS_REPORT}.xlsx"]
+    community_members_path = paths[
+        f"{synthetic.COMMUNITY_MEMBERS_REPORT}.xlsx"
+    ]
+
+    # cleaned frames used as the input to the report functions
+    df_teams = pipeline.load_and_clean_teams_report(teams_path, teams_columns)
+    df_team_members = pipeline.load_and_clean_team_members_report(
+        team_members_path, team_members_columns
+    )
+    df_community_members = pipeline.load_and_clean_community_members_report(
+        community_members_path, community_members_columns
+    )
+    df_all_members = pw.get_coxes(
+        df_teams, df_team_members, df_community_members
+    )
+    df_teams_no_cox = df_teams.drop(pw.COL_COX_NAME, axis=1)
+    df_raw_teams = pd.read_excel(teams_path)
+    booleans = [pw.COL_COX, pw.COL_VERIFIED, pw.COL_CAPTAIN]
+
+    return [
+        (
+            "pd.read_excel (teams)",
+            pd.read_excel,
+            lambda: (teams_path,),
+        ),
+        (
+            "load_and_clean_teams_report",
+            pipeline.load_and_clean_teams_report,
+            lambda: (teams_path, teams_columns),
+        ),
+        (
+            "load_and_clean_teams_report (csv)",
+            pipeline.load_and_clean_teams_report,
+            lambda: (teams_path_csv, teams_columns),
+        ),
+        (
+            "load_and_clean_teams_report (json)",
+            pipeline.load_and_clean_teams_report,
+            lambda: (teams_path_json, teams_columns),
+        ),
+        (
+            "load_and_clean_team_members_report",
+            pipeline.load_and_clean_team_members_report,
+            lambda: (team_members_path, team_members_columns),
+        ),
+        (
+            "load_and_clean_community_members_report",
+            pipeline.load_and_clean_community_members_report,
+            lambda: (community_members_path, community_members_columns),
+        ),
+        (
+            "cleanup_report_columns",
+            pw.cleanup_report_columns,
+            lambda: (
+                df_raw_teams,
+                list(teams_columns.values()),
+                list(teams_columns.keys()),
+            ),
+        ),
+        (
+            "clean_booleans",
+            pw.clean_booleans,
+            lambda: (
+                df_teams[booleans]
+                .astype(object)
+                .replace({True: "Y", False: "N"}),
+            ),
+        ),
+        (
+            "clean_composites",
+            pw.clean_composites,
+            lambda: (df_teams.copy(),),
+        ),
+        (
+            "assign_rower_position",
+            pw.assign_rower_position,
+            lambda: (df_team_members.copy(),),
+        ),
+        (
+            "get_coxes",
+            pw.get_coxes,
+            lambda: (df_teams, df_team_members, df_community_members),
+        ),
+        (
+            "get_coxes (no community members)",
+            pw.get_coxes,
+            lambda: (df_teams, df_team_members),
+        ),
+        (
+            "crew_digests",
+            incremental.crew_digests,
+            lambda: (df_teams, df_team_members),
+        ),
+        (
+            "get_unique_rowers",
+            pw.get_unique_rowers,
+            lambda: (df_all_members,),
+        ),
+        (
+            "count_num_entries",
+            pw.count_num_entries,
+            lambda: (df_teams_no_cox,),
+        ),
+        (
+            "count_num_seats",
+            pw.count_num_seats,
+            lambda: (df_teams_no_cox,),
+        ),
+        (
+            "count_unique_rowers",
+            pw.count_unique_rowers,
+            lambda: (df_all_members,),
+        ),
+        (
+            "get_pivoted_team_members_report",
+            pw.get_pivoted_team_members_report,
+            lambda: (df_all_members, df_teams_no_cox),
+        ),
+        (
+            "get_events_report",
+            aggregation.get_events_report,
+            lambda: (df_teams_no_cox, df_all_members),
+        ),
+        (
+            "get_clubs_report",
+            aggregation.get_clubs_report,
+            lambda: (df_teams_no_cox, df_all_members),
+        ),
+        (
+            "get_rowers_report",
+            pw.get_rowers_report,
+            lambda: (df_all_members,),
+        ),
+        (
+            "get_COFD_report",
+            pw.get_COFD_report,
+            lambda: (df_all_members,),
+        ),
+    ]
+
+
+def run_benchmarks(
+    sizes: List[int], pw_config: Dict, repeats: int = 3, seed: int = 0
+) -> List[Dict]:
+    """Time every stage at every size of community."""
+
+    results = []
+    for size in sizes:
+        # about two crews per three members, with members in several crews
+        reports = synthetic.generate_reports(
+            n_crews=max(size * 2 // 3, 1), n_members=size, seed=seed
+        )
+        rows = {name: len(rows) for name, rows in reports.items()}
+        with tempfile.TemporaryDirectory() as tmp:
+            paths = synthetic.write_reports(
+                reports, tmp, pw_config, REPORT_FILE_TYPES
+            )
+            for name, func, setup in get_stages(paths, pw_config):
+                result = {"members": size, "stage": name, "rows": rows}
+                try:
+                    result.update(time_stage(func, setup, repeats))
+                    time_text = f"{result['median'] * 1000:10.1f} ms"
+                except Exception as e:
+                    # record the failure, and carry on with the other stages
+                    result["error"] = f"{type(e).__name__}: {e}"
+                    time_text = f"failed ({result['error']})"
+                results.append(result)
+                print(f"{size:>7} members  {name:<42} {time_text}")
+
+    return results
+
+
+def get_metadata() -> Dict:
+
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "platform": platform.platform(),
+    }
+
+
+def compare(old_path: str, new_path: str) -> None:
+    """Print the change in median time of each stage between two runs."""
+
+    def load(path: str) -> Dict[Tuple[int, str], float]:
+        with open(path, "r") as f:
+            results = json.load(f)["results"]
+        return {
+            (r["members"], r["stage"]): r["median"]
+            for r in results
+            if "median" in r
+        }
+
+    old, new = load(old_path), load(new_path)
+    for key in sorted(old.keys() & new.keys()):
+        size, name = key
+        print(
+            f"{size:>7} members  {name:<42} "
+            f"{old[key] * 1000:10.1f} ms -> {new[key] * 1000:10.1f} ms "
+            f"({new[key] / old[key]:.2f}x)"
+        )
+
+
+def main(args: List[str] = None) -> None:
+
+    parser = argparse.ArgumentParser(
+        description="Benchmark the report pipeline on synthetic reports."
+    )
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-c", "--config", default=DEFAULT_PW_CONFIG_PATH)
+    parser.add_argument("-o", "--output", default="pipeline_benchmark.json")
+    parser.add_argument(
+        "--compare",
+        nargs=2,
+        metavar=("OLD", "NEW"),
+        help="compare two saved runs instead of benchmarking",
+    )
+    args = parser.parse_args(args)
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    with open(args.config, "r") as f:
+        pw_config = yaml.safe_load(f)
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")  # pandas deprecation warnings
+        results = run_benchmarks(
+            args.sizes, pw_config, args.repeats, args.seed
+        )
+
+    with open(args.output, "w") as f:
+        json.dump(
+            {"metadata": get_metadata(), "results": results}, f, indent=2
+        )
+    print(f"Results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""
+Benchmark the start up of the web app, and the overhead of each rerun.
+
+The app is run without a streamlit server ("bare"), from the root of the
+repository. A cold start is timed in a fresh interpreter, from starting
+python to the end of the first run of the script, which stops at the report
+uploaders (the first paint). Reruns are then timed in the same interpreter,
+both before and after synthetic reports have been uploaded (the reports are
+cached after the first of these runs), along with reloading the modules of
+the app as the development mode does on every run.
+
+Usage:
+    python -m benchmarks.startup_benchmark --repeats 5 -o startup.json
+"""
+
+import argparse
+import io
+import json
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+from typing import Callable, Dict, List
+from unittest import mock
+
+from benchmarks.pipeline_benchmark import get_metadata
+
+# run in a fresh interpreter: import the app and run it once
+COLD_START_SCRIPT = """
+import json, time, warnings
+warnings.simplefilter("ignore")
+start = time.perf_counter()
+import streamlit_app
+from streamlit.runtime.scriptrunner.script_runner import StopException
+imported = time.perf_counter()
+try:
+    streamlit_app.App().display()
+except StopException:
+    pass
+print(json.dumps({"import": imported - start,
+                  "first run": time.perf_counter() - imported}))
+"""
+
+
+def time_cold_starts(repeats: int) -> Dict[str, Dict[str, float]]:
+    """Time starting the app in a fresh interpreter, repeats times."""
+
+    timings = {"total": [], "import": [], "first run": []}
+    for _ in range(repeats):
+        start = time.perf_counter()
+        output = subprocess.run(
+            [sys.executable, "-c", COLD_START_SCRIPT],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+        timings["total"].append(time.perf_counter() - start)
+        for stage, seconds in json.loads(output.splitlines()[-1]).items():
+            timings[stage].append(seconds)
+
+    return {stage: summarise(times) for stage, times in timings.items()}
+
+
+def time_reruns(
+    repeats: int, n_crews: int, seed: int = 0
+) -> Dict[str, Dict[str, float]]:
+    """Time reruns of the app in this interpreter."""
+
+    import playwaze_rowing_reports.synthetic as synthetic
+    import streamlit as st
+    import streamlit_app
+    from playwaze_rowing_reports.config import load_config
+    from streamlit.runtime.scriptrunner.script_runner import StopException
+
+    def run() -> None:
+        try:
+            streamlit_app.App().display()
+        except StopException:
+            pass
+
+    pw_config = load_config(streamlit_app.DEFAULT_PW_CONFIG_PATH)
+    reports = synthetic.generate_reports(n_crews=n_crews, seed=seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = synthetic.write_reports(reports, tmp, pw_config)
+        uploads = {}
+        for name in reports:
+            with open(paths[f"{name}.xlsx"], "rb") as f:
+                uploads[name] = f.read()
+
+    def upload(label: str, **kwargs) -> io.BytesIO:
+        # the uploaders are labelled "Upload a <report name> report"
+        name = label[len("Upload a ") : -len(" report")]
+        return io.BytesIO(uploads[name])
+
+    run()  # the first run imports anything left to import
+    timings = {
+        "rerun (no reports)": time_runs(run, repeats),
+        "reload modules": time_runs(streamlit_app.reload_modules, repeats),
+    }
+    with mock.patch.object(st.sidebar, "file_uploader", side_effect=upload):
+        timings["first run with reports"] = time_runs(run, 1)
+        timings["rerun with reports"] = time_runs(run, repeats)
+
+    return timings
+
+
+def time_runs(func: Callable, repeats: int) -> Dict[str, float]:
+
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+
+    return summarise(times)
+
+
+def summarise(times: List[float]) -> Dict[str, float]:
+    return {
+        "min": min(times),
+        "median": statistics.median(times),
+        "repeats": len(times),
+    }
+
+
+def main(args: List[str] = None) -> None:
+
+    parser = argparse.ArgumentParser(
+        description="Benchmark the start up and reruns of the web app."
+    )
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument(
+        "--crews",
+        type=int,
+        default=1000,
+        help="crews in the reports uploaded for reruns (default: "
+        "%(default)s)",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", "--output", default="startup_benchmark.json")
+    args = parser.parse_args(args)
+
+    results = {"cold start": time_cold_starts(args.repeats)}
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")  # bare mode and pandas warnings
+        results.update(time_reruns(args.repeats, args.crews, args.seed))
+
+    for stage, result in results.items():
+        if "median" not in result:  # the stages of the cold start
+            for part, part_result in result.items():
+                print(
+                    f"cold start {part:<29} "
+                    f"{part_result['median'] * 1000:10.1f} ms"
+                )
+            continue
+        print(f"{stage:<40} {result['median'] * 1000:10.1f} ms")
+
+    with open(args.output, "w") as f:
+        json.dump(
+            {"metadata": get_metadata(), "results": results}, f, indent=2
+        )
+    print(f"Results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""
+Benchmark the string engines on synthetic reports.
+
+Reports are generated for each number of crews and read from csv, then the
+string cleaning of the pipeline (composite tagging, stripping the "teams/"
+prefix of crew IDs and splitting names) is timed with each engine, as is
+loading and cleaning the teams report as a whole. The results of the arrow
+engine are checked against the python engine's.
+
+Usage:
+    python -m benchmarks.strings_benchmark --crews 10000 100000 200000
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import warnings
+from typing import Callable, Dict, List, Tuple
+
+import pandas as pd
+import yaml
+
+import playwaze_rowing_reports.ingest as ingest
+import playwaze_rowing_reports.pipeline as pipeline
+import playwaze_rowing_reports.playwaze_reports as pw
+import playwaze_rowing_reports.strings as strings
+import playwaze_rowing_reports.synthetic as synthetic
+from benchmarks.pipeline_benchmark import get_metadata, time_stage
+
+DEFAULT_PW_CONFIG_PATH = os.path.join("config", "playwaze_config.yaml")
+DEFAULT_CREWS = [1000, 10000, 100000]
+
+
+def get_stages(
+    paths: Dict[str, str], pw_config: Dict
+) -> List[Tuple[str, Callable, Callable[[], Tuple]]]:
+    """Get the name, function and argument setup of each stage to time."""
+
+    teams_columns = pw_config["teams report columns"]
+    teams_path = paths[f"{synthetic.TEAMS_REPORT}.csv"]
+    df_teams = ingest.read_report(teams_path, teams_columns)
+    df_team_members = ingest.read_report(
+        paths[f"{synthetic.TEAM_MEMBERS_REPORT}.csv"],
+        pw_config["team members report columns"],
+    )
+
+    return [
+        (
+            "clean_composites (teams)",
+            pw.clean_composites,
+            lambda: (df_teams,),
+        ),
+        (
+            "clean_composites (team members)",
+            lambda df: pw.clean_composites(df, set_composite_flag=False),
+            lambda: (df_team_members,),
+        ),
+        (
+            "remove teams/ (crew id)",
+            strings.remove,
+            lambda: (df_teams[pw.COL_CREW_ID], "teams/"),
+        ),
+        (
+            "split_once (name)",
+            strings.split_once,
+            lambda: (df_team_members[pw.COL_NAME], " "),
+        ),
+        (
+            "load_and_clean_teams_report (csv)",
+            pipeline.load_and_clean_teams_report,
+            lambda: (teams_path, teams_columns),
+        ),
+    ]
+
+
+def same_results(python_result, arrow_result) -> bool:
+    """Whether the engines' results of a stage are the same."""
+
+    if isinstance(python_result, tuple):
+        return all(map(same_results, python_result, arrow_result))
+    if isinstance(python_result, pd.DataFrame):
+        return python_result.equals(arrow_result)
+    return python_result.astype(object).equals(arrow_result.astype(object))
+
+
+def run_benchmarks(
+    crews: List[int], pw_config: Dict, repeats: int = 3, seed: int = 0
+) -> List[Dict]:
+    """Time every stage with each engine at every number of crews."""
+
+    results = []
+    for n_crews in crews:
+        reports = synthetic.generate_reports(n_crews=n_crews, seed=seed)
+        rows = {name: len(rows) for name, rows in reports.items()}
+        with tempfile.TemporaryDirectory() as tmp:
+            paths = synthetic.write_reports(reports, tmp, pw_config, ("csv",))
+            for name, func, setup in get_stages(paths, pw_config):
+                outputs = {}
+                for engine in strings.ENGINES:
+                    strings.set_engine(engine)
+                    outputs[engine] = func(*setup())
+                    result = {
+                        "crews": n_crews,
+                        "stage": name,
+                        "engine": engine,
+                        "rows": rows,
+                    }
+                    result.update(time_stage(func, setup, repeats))
+                    results.append(result)
+                    print(
+                        f"{n_crews:>8} crews  {name:<36} {engine:<7}"
+                        f"{result['median'] * 1000:10.1f} ms"
+                    )
+                if not same_results(*outputs.values()):
+                    raise AssertionError(
+                        f"The engines' results of {name} differ"
+                    )
+
+    strings.set_engine(strings.PYTHON_ENGINE)
+    return results
+
+
+def main(args: List[str] = None) -> None:
+
+    parser = argparse.ArgumentParser(
+        description="Benchmark the string engines on synthetic reports."
+    )
+    parser.add_argument("--crews", type=int, nargs="+", default=DEFAULT_CREWS)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-c", "--config", default=DEFAULT_PW_CONFIG_PATH)
+    parser.add_argument("-o", "--output", default="strings_benchmark.json")
+    args = parser.parse_args(args)
+
+    with open(args.config, "r") as f:
+        pw_config = yaml.safe_load(f)
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")  # pandas deprecation warnings
+        results = run_benchmarks(
+            args.crews, pw_config, args.repeats, args.seed
+        )
+
+    with open(args.output, "w") as f:
+        json.dump(
+            {"metadata": get_metadata(), "results": results}, f, indent=2
+        )
+    print(f"Results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
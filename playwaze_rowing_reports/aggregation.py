@@ -0,0 +1,229 @@
+"""
+Summarise the crews of an event by group, e.g. by club or by event.
+
+Every statistic of a group is worked out in a single grouped pass over the
+teams report, and one over the team members report, however many statistics
+there are. The Clubs and Events reports are both laid out from a summary.
+"""
+
+from typing import Dict
+import numpy as np
+import pandas as pd
+import playwaze_rowing_reports.playwaze_reports as pw
+import playwaze_rowing_reports.boat_classes as boat_classes
+import playwaze_rowing_reports.incremental as incremental
+from playwaze_rowing_reports.instrumentation import timed
+
+# columns of the summaries
+COL_ENTRIES = "entries"
+COL_SEATS_FILLED = pw.COL_SEATS
+COL_SEATS_TOTAL = "total seats"
+COL_ROWERS = "rowers"
+COL_COMPOSITES = "composites"
+COL_COXES = "coxes"
+
+# statistics summed over the crews of each group, from the teams report
+TEAMS_COLUMNS = [
+    COL_ENTRIES,
+    COL_SEATS_FILLED,
+    COL_SEATS_TOTAL,
+    COL_COMPOSITES,
+    COL_COXES,
+]
+
+# the columns of the reports, in order, with the name of the entries column
+CLUBS_COLUMNS = {
+    COL_ENTRIES: pw.COL_CREW_ID,
+    COL_ROWERS: COL_ROWERS,
+    COL_SEATS_FILLED: COL_SEATS_FILLED,
+    COL_SEATS_TOTAL: COL_SEATS_TOTAL,
+    COL_COMPOSITES: COL_COMPOSITES,
+    COL_COXES: COL_COXES,
+}
+EVENTS_COLUMNS = {
+    COL_ENTRIES: "Entries",
+    COL_ROWERS: COL_ROWERS,
+    COL_SEATS_FILLED: COL_SEATS_FILLED,
+    COL_SEATS_TOTAL: COL_SEATS_TOTAL,
+    COL_COMPOSITES: COL_COMPOSITES,
+    COL_COXES: COL_COXES,
+}
+
+
+@timed
+def summarise_teams(
+    df_teams: pd.DataFrame, by: str, df_boat_classes: pd.DataFrame = None
+) -> pd.DataFrame:
+    """
+    Sum the statistics of the crews in each group. Every category of by is
+    a group, so groups without crews have a row of zeros.
+    """
+
+    df = pd.DataFrame(
+        {
+            COL_ENTRIES: df_teams[pw.COL_CREW_ID].notnull().astype("int64"),
+            COL_SEATS_FILLED: df_teams[pw.COL_SEATS],
+            COL_SEATS_TOTAL: boat_classes.lookup(
+                df_teams[pw.COL_BOAT_TYPE],
+                boat_classes.COL_BOAT_SEATS,
+                df_boat_classes,
+            ),
+            COL_COMPOSITES: df_teams[pw.COL_COMPOSITE].fillna(False),
+            COL_COXES: df_teams[pw.COL_COX].fillna(False),
+        }
+    )
+    df = df.astype({COL_COMPOSITES: "int64", COL_COXES: "int64"})
+
+    return df.groupby(df_teams[by].values).sum().rename_axis(by)
+
+
+def counted_members(df_team_members: pd.DataFrame) -> np.ndarray:
+    """
+    Whether each row is counted as a rower or cox: the first crew in the
+    event of everyone with an SR number.
+    """
+
+    # numbers hash faster as floats than as nullable integers
+    sr_numbers = df_team_members[pw.COL_SR_NUMBER]
+    first_crews = ~pd.Series(
+        sr_numbers.to_numpy("float64", na_value=np.nan)
+    ).duplicated()
+    return first_crews.values & sr_numbers.notnull().values
+
+
+def distinct_members(df_team_members: pd.DataFrame, by: str) -> np.ndarray:
+    """
+    Whether each row is counted as a rower or cox of its group: the first
+    crew in the group of everyone, told apart by SR number, or by name
+    without one.
+    """
+
+    sr_numbers = df_team_members[pw.COL_SR_NUMBER].to_numpy(
+        "float64", na_value=np.nan
+    )
+    names = df_team_members[pw.COL_NAME].to_numpy(object)
+    has_sr_number = ~np.isnan(sr_numbers)
+    people = pd.DataFrame(
+        {
+            by: df_team_members[by].to_numpy(object),
+            pw.COL_SR_NUMBER: sr_numbers,
+            pw.COL_NAME: np.where(has_sr_number, None, names),
+        }
+    )
+    return ~people.duplicated().values & (has_sr_number | pd.notna(names))
+
+
+@timed
+def summarise_members(
+    df_team_members: pd.DataFrame, by: str, per_group: bool = False
+) -> pd.Series:
+    """
+    Count the rowers and coxes in each group. Each is only counted once,
+    under the group of their first crew in the event (with an SR number),
+    or with per_group once in every group they have a crew in.
+    """
+
+    counted = (
+        distinct_members(df_team_members, by)
+        if per_group
+        else counted_members(df_team_members)
+    )
+    groups = df_team_members[by].astype("category")
+    codes = groups.cat.codes.values[counted]
+    counts = np.bincount(
+        codes[codes >= 0], minlength=len(groups.cat.categories)
+    )
+    return pd.Series(
+        counts, index=groups.cat.categories.rename(by), name=COL_ROWERS
+    )
+
+
+def combine(df_teams_summary: pd.DataFrame, rowers: pd.Series) -> pd.DataFrame:
+    """Add the rowers of each group to a summary of the teams report."""
+
+    rowers = rowers.reindex(df_teams_summary.index, fill_value=0)
+    return df_teams_summary.assign(**{COL_ROWERS: rowers.astype("int64")})
+
+
+def summarise(
+    df_teams: pd.DataFrame,
+    df_team_members: pd.DataFrame,
+    by: str,
+    df_boat_classes: pd.DataFrame = None,
+    per_group: bool = False,
+) -> pd.DataFrame:
+    """Every statistic of each group of crews, e.g. of each club. See
+    summarise_members for per_group."""
+
+    return combine(
+        summarise_teams(df_teams, by, df_boat_classes),
+        summarise_members(df_team_members, by, per_group),
+    )
+
+
+def update_summary(
+    previous: pd.DataFrame,
+    df_changes: pd.DataFrame,
+    df_teams: pd.DataFrame,
+    df_team_members: pd.DataFrame,
+    by: str,
+    df_boat_classes: pd.DataFrame = None,
+    per_group: bool = False,
+) -> pd.DataFrame:
+    """
+    Sum the statistics of the teams report again only for the groups with a
+    changed crew. Rowers may be counted under the group of their first
+    crew, so they are still counted for every group.
+    """
+
+    groups = incremental.changed_groups(df_changes, by)
+    recomputed = summarise_teams(
+        df_teams[df_teams[by].isin(groups)], by, df_boat_classes
+    )
+    df_teams_summary = incremental.splice_groups(
+        previous[TEAMS_COLUMNS], recomputed, groups
+    )
+
+    return combine(
+        df_teams_summary, summarise_members(df_team_members, by, per_group)
+    )
+
+
+def layout_summary(
+    df_summary: pd.DataFrame, columns: Dict[str, str]
+) -> pd.DataFrame:
+    """Select and name the columns of a summary for a report."""
+
+    return df_summary[list(columns)].rename(columns=columns)
+
+
+@timed
+def get_clubs_report(
+    df_teams: pd.DataFrame,
+    df_team_members: pd.DataFrame,
+    df_boat_classes: pd.DataFrame = None,
+) -> pd.DataFrame:
+
+    return layout_summary(
+        summarise(df_teams, df_team_members, pw.COL_CLUB, df_boat_classes),
+        CLUBS_COLUMNS,
+    )
+
+
+@timed
+def get_events_report(
+    df_teams: pd.DataFrame,
+    df_team_members: pd.DataFrame,
+    df_boat_classes: pd.DataFrame = None,
+) -> pd.DataFrame:
+
+    return layout_summary(
+        summarise(
+            df_teams,
+            df_team_members,
+            pw.COL_BOAT_TYPE,
+            df_boat_classes,
+            per_group=True,
+        ),
+        EVENTS_COLUMNS,
+    )
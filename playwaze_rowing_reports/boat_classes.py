@@ -0,0 +1,94 @@
+"""
+Boat classes (seats, coxed and discipline) parsed from boat types.
+
+Each distinct boat type, e.g. "J16 4x+", is parsed once into a table of boat
+classes indexed by boat type. Rows are then given their class through the
+codes of the categorical boat type column, rather than by parsing every row.
+Boat types that don't name a boat class are left with blank classes, so they
+can be flagged.
+"""
+
+import functools
+import re
+from typing import List, Tuple, Union
+import pandas as pd
+
+# columns of the boat classes
+COL_BOAT_SEATS = "boat seats"  # rowing seats, excluding the cox
+COL_COXED = "coxed"
+COL_DISCIPLINE = "discipline"
+
+BOAT_CLASS_COLUMNS = [COL_BOAT_SEATS, COL_COXED, COL_DISCIPLINE]
+BOAT_CLASS_DTYPES = {
+    COL_BOAT_SEATS: "Int64",
+    COL_COXED: "boolean",
+    COL_DISCIPLINE: "category",
+}
+
+SCULLING = "sculling"
+SWEEP = "sweep"
+
+# seats, then x for sculling, or - (coxless) or + (coxed) for sweep, then +
+# for a coxed sculling boat, e.g. 1x, 2-, 4+, 4x+, 8+
+BOAT_CLASS_PATTERN = re.compile(r"([1248])([x\-\+])(\+)?")
+
+
+@functools.lru_cache(maxsize=None)
+def parse_boat_type(
+    boat_type: str,
+) -> Tuple[Union[None, int], Union[None, bool], Union[None, str]]:
+    """The seats, whether coxed, and the discipline of a boat type. All None
+    if the boat type doesn't name a boat class."""
+
+    match = BOAT_CLASS_PATTERN.search(str(boat_type))
+    if match is None:
+        return None, None, None
+
+    seats, rig, coxed = match.groups()
+    return (
+        int(seats),
+        rig == "+" or coxed is not None,
+        SCULLING if rig == "x" else SWEEP,
+    )
+
+
+def get_boat_classes(boat_types: pd.Series) -> pd.DataFrame:
+    """The boat class of every distinct boat type, indexed by boat type."""
+
+    # boat types with no crews aren't parsed, or flagged
+    boat_types = boat_types.astype("category").cat.remove_unused_categories()
+    categories = boat_types.cat.categories
+    df = pd.DataFrame(
+        [parse_boat_type(boat_type) for boat_type in categories],
+        index=categories,
+        columns=BOAT_CLASS_COLUMNS,
+    )
+    return df.astype(BOAT_CLASS_DTYPES)
+
+
+def lookup(
+    boat_types: pd.Series, column: str, df_boat_classes: pd.DataFrame = None
+) -> pd.Series:
+    """
+    A column of the boat classes for each row, looked up by the codes of the
+    categorical boat types.
+    """
+
+    boat_types = boat_types.astype("category")
+    if df_boat_classes is None:
+        df_boat_classes = get_boat_classes(boat_types)
+
+    # line the classes up with the categories, so the codes index them
+    values = df_boat_classes[column].reindex(boat_types.cat.categories)
+    return pd.Series(
+        values.array.take(boat_types.cat.codes.values, allow_fill=True),
+        index=boat_types.index,
+        name=column,
+    )
+
+
+def unknown_boat_types(df_boat_classes: pd.DataFrame) -> List[str]:
+    """The boat types that don't name a boat class."""
+
+    unknown = df_boat_classes[COL_BOAT_SEATS].isna()
+    return list(df_boat_classes.index[unknown])
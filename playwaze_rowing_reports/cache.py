@@ -0,0 +1,296 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import (
+    Any,
+    BinaryIO,
+    Callable,
+    Dict,
+    Hashable,
+    List,
+    Tuple,
+    Union,
+)
+import pandas as pd
+
+DEFAULT_CACHE_SIZE = 8  # number of preprocessed events kept in memory
+DEFAULT_DISK_CACHE_MB = 500  # size cap of the on disk cache
+# bump when the cleaning of the reports changes, so older cached frames are
+# no longer used (they are evicted as the least recently used)
+DISK_CACHE_VERSION = 3
+
+
+class ReportCache:
+    """
+    A bounded, least recently used cache for preprocessed reports. Counts
+    hits and misses so the effectiveness of the cache can be reported.
+
+    The cache is shared by the script threads of every session, so it is
+    locked, and each key is computed by only one thread at a time.
+    """
+
+    def __init__(self, max_size: int = DEFAULT_CACHE_SIZE):
+
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._computing = {}  # a lock for each key being computed
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._entries
+
+    def _lookup(self, key: Hashable) -> Tuple[bool, Any]:
+        """Whether key is cached, and its value, marking it as most recently
+        used. Called with the lock held."""
+
+        if key not in self._entries:
+            return False, None
+
+        self.hits += 1
+        self._entries.move_to_end(key)  # mark as most recently used
+        return True, self._entries[key]
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+
+        with self._lock:
+            found, value = self._lookup(key)
+            if not found:
+                self.misses += 1
+                return default
+            return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)  # evict least recently used
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        """Return the cached value for key, computing and storing it on a
+        miss. Threads missing a key being computed wait for it."""
+
+        with self._lock:
+            found, value = self._lookup(key)
+            if found:
+                return value
+            key_lock = self._computing.setdefault(key, threading.Lock())
+
+        with key_lock:
+            with self._lock:
+                # computed by another thread while this one waited
+                found, value = self._lookup(key)
+                if found:
+                    return value
+                self.misses += 1
+            try:
+                value = compute()
+                self.put(key, value)
+            finally:
+                with self._lock:
+                    self._computing.pop(key, None)
+
+        return value
+
+    def values(self) -> List[Any]:
+        """The cached values, from the least to the most recently used."""
+
+        with self._lock:
+            return list(self._entries.values())
+
+    def evict(self, value: Any) -> List[Hashable]:
+        """Remove every entry of a value, e.g. to free its memory. Returns
+        the keys removed."""
+
+        with self._lock:
+            keys = [k for k, v in self._entries.items() if v is value]
+            for key in keys:
+                del self._entries[key]
+            return keys
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._entries),
+                "max size": self.max_size,
+            }
+
+
+class ParquetCache:
+    """
+    A persistent cache of preprocessed report frames, so that a restarted
+    server, or another organiser opening the same event, can skip reading and
+    cleaning the reports. Each entry is a directory of parquet files, one per
+    frame. The cache is capped in size on disk and the least recently used
+    entries are evicted first, using the modification time of each entry
+    directory as the time it was last used.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        max_mb: float = DEFAULT_DISK_CACHE_MB,
+        version: int = DISK_CACHE_VERSION,
+    ):
+
+        self.directory = directory
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.version = version
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _entry_path(self, key: str) -> str:
+        return os.path.join(self.directory, f"v{self.version}-{key}")
+
+    def _entries(self):
+        """Paths of every complete entry, of any version."""
+
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            # in progress writes are hidden directories
+            if not name.startswith(".") and os.path.isdir(path):
+                yield path
+
+    def __contains__(self, key: str) -> bool:
+        return os.path.isdir(self._entry_path(key))
+
+    def get(
+        self, key: str, default: Any = None
+    ) -> Union[Any, Dict[str, Union[None, pd.DataFrame]]]:
+
+        path = self._entry_path(key)
+        try:
+            with open(os.path.join(path, "frames.json"), "r") as f:
+                names = json.load(f)
+            frames = {
+                name: (
+                    None
+                    if not stored
+                    else pd.read_parquet(
+                        os.path.join(path, f"{name}.parquet"), memory_map=True
+                    )
+                )
+                for name, stored in names.items()
+            }
+        except (OSError, ValueError):
+            # missing, evicted by another process or unreadable
+            self.misses += 1
+            return default
+
+        os.utime(path)  # mark as most recently used
+        self.hits += 1
+        return frames
+
+    def put(
+        self, key: str, frames: Dict[str, Union[None, pd.DataFrame]]
+    ) -> None:
+        """Store a dictionary of frames, some of which may be None."""
+
+        # write to a hidden directory and move it into place, so readers never
+        # see a partly written entry
+        tmp_path = tempfile.mkdtemp(prefix=".", dir=self.directory)
+        try:
+            for name, df in frames.items():
+                if df is not None:
+                    df.to_parquet(os.path.join(tmp_path, f"{name}.parquet"))
+            with open(os.path.join(tmp_path, "frames.json"), "w") as f:
+                json.dump(
+                    {name: df is not None for name, df in frames.items()}, f
+                )
+            os.rename(tmp_path, self._entry_path(key))
+        except OSError:
+            # e.g. another process stored the same key first
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+        self.evict()
+
+    def get_or_compute(
+        self, key: str, compute: Callable[[], Dict[str, pd.DataFrame]]
+    ) -> Dict[str, pd.DataFrame]:
+        """Return the cached frames for key, computing and storing them on a
+        miss."""
+
+        frames = self.get(key)
+        if frames is None:
+            frames = compute()
+            self.put(key, frames)
+        return frames
+
+    def evict(self) -> None:
+        """Remove the least recently used entries until under the size
+        cap, always keeping the most recent entry."""
+
+        entries = []
+        for path in self._entries():
+            try:
+                size = sum(entry.stat().st_size for entry in os.scandir(path))
+                entries.append((os.path.getmtime(path), size, path))
+            except OSError:
+                pass  # removed by another process
+
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries[:-1]:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+    def clear(self) -> None:
+        for path in self._entries():
+            shutil.rmtree(path, ignore_errors=True)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(list(self._entries())),
+        }
+
+
+def read_bytes(report: Union[None, str, BinaryIO]) -> bytes:
+    """Get the contents of an uploaded report or a report file path."""
+
+    if report is None:
+        return b""
+    if isinstance(report, str):
+        with open(report, "rb") as f:
+            return f.read()
+    return report.getvalue()
+
+
+def hash_reports(
+    *reports: Union[None, str, BinaryIO], config: Dict = None
+) -> str:
+    """
+    Hash the contents of the uploaded reports or report files, and optionally
+    a config dictionary, into a single cache key. Missing (None) reports are
+    hashed as empty so the position of each report still matters.
+    """
+
+    h = hashlib.sha256()
+    for report in reports:
+        h.update(hashlib.sha256(read_bytes(report)).digest())
+    if config is not None:
+        h.update(json.dumps(config, sort_keys=True, default=str).encode())
+
+    return h.hexdigest()
@@ -0,0 +1,296 @@
+"""
+Convert the Playwaze reports for many events without the web app.
+
+Each event is a sub-directory of the input directory containing a teams
+report, a team members report and, optionally, a community members report.
+Report files are recognised by their name ending in "teams",
+"team members" or "community members" (spaces, hyphens or underscores).
+
+Usage:
+    python -m playwaze_rowing_reports.cli EVENTS_DIR -o OUTPUT_DIR -j 4
+    python -m playwaze_rowing_reports.cli EVENTS_DIR -o OUTPUT_DIR --zip
+"""
+
+import argparse
+import functools
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List, Tuple
+
+import playwaze_rowing_reports.playwaze_reports as pw
+import playwaze_rowing_reports.pipeline as pipeline
+import playwaze_rowing_reports.report_graph as rg
+import playwaze_rowing_reports.export as export
+import playwaze_rowing_reports.strings as strings
+from playwaze_rowing_reports.cache import DEFAULT_DISK_CACHE_MB, ParquetCache
+from playwaze_rowing_reports.season import SeasonStore, event_date
+from playwaze_rowing_reports.config import (
+    ConfigError,
+    load_config,
+    validate_pw_config,
+)
+
+DEFAULT_PW_CONFIG_PATH = os.path.join("config", "playwaze_config.yaml")
+DEFAULT_OARA_CONFIG_PATH = os.path.join("resources", "OaraConfig.csv")
+
+# report file names, in the order they are matched against
+TEAMS_REPORT = "teams"
+TEAM_MEMBERS_REPORT = "team members"
+COMMUNITY_MEMBERS_REPORT = "community members"
+REPORT_NAMES = (COMMUNITY_MEMBERS_REPORT, TEAM_MEMBERS_REPORT, TEAMS_REPORT)
+
+
+def find_event_reports(event_dir: str) -> Dict[str, str]:
+    """Find the report files for an event, keyed by report name."""
+
+    reports = {}
+    for filename in sorted(os.listdir(event_dir)):
+        stem, ext = os.path.splitext(filename)
+        if ext.lstrip(".").lower() not in pw.REPORT_FILE_TYPES:
+            continue
+        stem = stem.lower().replace("_", " ").replace("-", " ").strip()
+        for name in REPORT_NAMES:
+            if stem.endswith(name):
+                reports.setdefault(name, os.path.join(event_dir, filename))
+                break
+
+    return reports
+
+
+def find_events(events_dir: str) -> List[str]:
+    """Find the event directories that contain the required reports."""
+
+    events = []
+    for name in sorted(os.listdir(events_dir)):
+        event_dir = os.path.join(events_dir, name)
+        if not os.path.isdir(event_dir):
+            continue
+        reports = find_event_reports(event_dir)
+        if TEAMS_REPORT in reports and TEAM_MEMBERS_REPORT in reports:
+            events.append(event_dir)
+        else:
+            print(
+                f"Skipping {name}: teams and team members reports are "
+                "required.",
+                file=sys.stderr,
+            )
+
+    return events
+
+
+def process_event(
+    event_dir: str,
+    output_dir: str,
+    pw_config: Dict,
+    oara_config_path: str = DEFAULT_OARA_CONFIG_PATH,
+    cache_dir: str = None,
+    cache_mb: float = DEFAULT_DISK_CACHE_MB,
+    as_zip: bool = False,
+    season_dir: str = None,
+    string_engine: str = strings.PYTHON_ENGINE,
+) -> Tuple[str, Dict[str, float]]:
+    """
+    Clean the reports for one event and write every report to output_dir.
+    With a cache_dir, the cleaned reports are kept on disk and reused when
+    the same reports are converted again. With as_zip, the reports are
+    written to a zip archive for the event instead, exported concurrently.
+    With a season_dir, the cleaned reports are also added to the season.
+    The string columns are cleaned with string_engine, see strings.
+    Returns the event name and the time taken by each stage, in seconds.
+    """
+
+    # events are processed in worker processes, each with its own engine
+    strings.set_engine(string_engine)
+    event = os.path.basename(os.path.normpath(event_dir))
+    event_output_dir = os.path.join(output_dir, event)
+    os.makedirs(output_dir if as_zip else event_output_dir, exist_ok=True)
+    reports = find_event_reports(event_dir)
+    timings = {}
+
+    start = time.perf_counter()
+    disk_cache = ParquetCache(cache_dir, cache_mb) if cache_dir else None
+    processed = pipeline.preprocess_reports_cached(
+        reports[TEAMS_REPORT],
+        reports[TEAM_MEMBERS_REPORT],
+        reports.get(COMMUNITY_MEMBERS_REPORT),
+        pw_config,
+        disk_cache,
+    )
+    timings["preprocessing"] = time.perf_counter() - start
+
+    if season_dir:
+        season_start = time.perf_counter()
+        SeasonStore(season_dir).append(
+            event,
+            event_date(event_dir),
+            processed["df_teams"],
+            processed["df_team_members"],
+        )
+        timings["season"] = time.perf_counter() - season_start
+
+    graph = rg.ReportGraph(processed)
+    if as_zip:
+        export_start = time.perf_counter()
+        files = rg.report_files(graph)
+        if os.path.exists(oara_config_path):
+            files[os.path.basename(oara_config_path)] = functools.partial(
+                read_file, oara_config_path
+            )
+        with open(f"{event_output_dir}.zip", "wb") as f:
+            export.write_zip(files, f)
+        timings["zip"] = time.perf_counter() - export_start
+        timings["total"] = time.perf_counter() - start
+        return event, timings
+
+    for name in rg.REPORTS:
+        report_start = time.perf_counter()
+        df = rg.layout_report(name, graph.get(name))
+        df.to_csv(os.path.join(event_output_dir, f"{name}.csv"))
+        timings[name] = time.perf_counter() - report_start
+
+    if os.path.exists(oara_config_path):
+        shutil.copy(oara_config_path, event_output_dir)
+
+    timings["total"] = time.perf_counter() - start
+
+    return event, timings
+
+
+def read_file(path: str) -> bytes:
+
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def format_timings(event: str, timings: Dict[str, float]) -> str:
+    stages = ", ".join(
+        f"{stage} {seconds:.2f}s"
+        for stage, seconds in timings.items()
+        if stage != "total"
+    )
+    return f"{event}: {timings['total']:.2f}s ({stages})"
+
+
+def parse_args(args: List[str] = None) -> argparse.Namespace:
+
+    parser = argparse.ArgumentParser(
+        description="Convert Playwaze reports for many events in parallel."
+    )
+    parser.add_argument(
+        "events_dir",
+        help="directory with one sub-directory of reports per event",
+    )
+    parser.add_argument(
+        "-o",
+        "--output-dir",
+        default="output",
+        help="directory to write the reports to (default: %(default)s)",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=os.cpu_count(),
+        help="number of events to process at once (default: %(default)s)",
+    )
+    parser.add_argument(
+        "-c",
+        "--config",
+        default=DEFAULT_PW_CONFIG_PATH,
+        help="playwaze config file (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--oara-config",
+        default=DEFAULT_OARA_CONFIG_PATH,
+        help="regatta program config copied alongside the CofD report "
+        "(default: %(default)s)",
+    )
+    parser.add_argument(
+        "--zip",
+        action="store_true",
+        help="write the reports of each event to a zip archive, instead of "
+        "a directory",
+    )
+    parser.add_argument(
+        "--season-dir",
+        help="also add the cleaned reports of each event to the season "
+        "store in this directory, partitioned by event and date (see "
+        "playwaze_rowing_reports.season)",
+    )
+    parser.add_argument(
+        "--string-engine",
+        choices=strings.ENGINES,
+        default=strings.PYTHON_ENGINE,
+        help="engine used to clean the string columns, arrow for "
+        "vectorised kernels on large reports (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        help="keep the cleaned reports in this directory, to skip cleaning "
+        "reports that have not changed the next time they are converted",
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=float,
+        default=DEFAULT_DISK_CACHE_MB,
+        help="size cap of the cache directory in MB (default: %(default)s)",
+    )
+
+    return parser.parse_args(args)
+
+
+def main(args: List[str] = None) -> int:
+
+    args = parse_args(args)
+    try:
+        pw_config = load_config(args.config, validate_pw_config)
+    except ConfigError as e:
+        print(f"Invalid config. {e}", file=sys.stderr)
+        return 1
+
+    events = find_events(args.events_dir)
+    failed = 0
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        futures = {
+            executor.submit(
+                process_event,
+                event_dir,
+                args.output_dir,
+                pw_config,
+                args.oara_config,
+                args.cache_dir,
+                args.cache_size,
+                args.zip,
+                args.season_dir,
+                args.string_engine,
+            ): event_dir
+            for event_dir in events
+        }
+        for future in as_completed(futures):
+            try:
+                print(format_timings(*future.result()))
+            except Exception as e:
+                # report the failure, and carry on with the other events
+                failed += 1
+                event = os.path.basename(futures[future])
+                message = (
+                    e
+                    if isinstance(e, pipeline.ReportError)
+                    else f"{type(e).__name__}: {e}"
+                )
+                print(f"{event}: failed. {message}", file=sys.stderr)
+
+    print(
+        f"Processed {len(events) - failed} of {len(events)} events in "
+        f"{time.perf_counter() - start:.2f}s"
+    )
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
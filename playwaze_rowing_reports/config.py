@@ -0,0 +1,100 @@
+"""
+Load and validate the yaml config files.
+
+A config file is only parsed and validated again once it has been modified,
+so the app doesn't re-read its config on every rerun. Loaded configs are
+shared, and must not be modified.
+"""
+
+import functools
+import os
+from typing import Callable, Dict
+import yaml
+
+# settings the app can't start without
+APP_REQUIRED_SETTINGS = ("logo path", "layout", "site title")
+
+# the column numbers of each report, and whether the report is required
+REPORT_COLUMNS_SETTINGS = {
+    "teams report columns": True,
+    "team members report columns": True,
+    "community members report columns": False,
+}
+
+
+class ConfigError(Exception):
+    """Raised when a config file is missing settings, or has invalid ones."""
+
+
+def load_config(path: str, validate: Callable[[Dict], None] = None) -> Dict:
+    """Parse and validate a yaml config file, once for each time it is
+    modified."""
+
+    return _load_config(path, os.path.getmtime(path), validate)
+
+
+@functools.lru_cache(maxsize=16)
+def _load_config(
+    path: str, mtime: float, validate: Callable[[Dict], None]
+) -> Dict:
+
+    with open(path, "r") as f:
+        config = yaml.safe_load(f) or {}
+
+    if validate is not None:
+        try:
+            validate(config)
+        except ConfigError as e:
+            raise ConfigError(f"{path}: {e}")
+
+    return config
+
+
+def validate_app_config(config: Dict) -> None:
+
+    missing = [key for key in APP_REQUIRED_SETTINGS if key not in config]
+    if missing:
+        raise ConfigError(f"missing {', '.join(missing)}")
+
+
+def validate_pw_config(config: Dict) -> None:
+    """
+    Check that the column numbers of each report are whole numbers from 0,
+    and that any expected headers are for configured columns.
+    """
+
+    problems = []
+    for key, required in REPORT_COLUMNS_SETTINGS.items():
+        columns = config.get(key)
+        if columns is None:
+            if required:
+                problems.append(f"missing {key}")
+            continue
+
+        if not isinstance(columns, dict) or not columns:
+            problems.append(f"{key} should map column names to numbers")
+            continue
+        invalid = [
+            name
+            for name, number in columns.items()
+            if not isinstance(number, int) or number < 0
+        ]
+        if invalid:
+            problems.append(
+                f"{key} has invalid numbers for {', '.join(invalid)}"
+            )
+
+        headers_key = key.replace("columns", "headers")
+        unknown = [
+            name
+            for name in config.get(headers_key) or {}
+            if name not in columns
+        ]
+        if unknown:
+            problems.append(
+                f"{headers_key} has headers for unknown columns "
+                f"{', '.join(unknown)}"
+            )
+
+    if problems:
+        raise ConfigError("; ".join(problems))
@@ -0,0 +1,146 @@
+"""
+Find the rowers and coxes whose entries conflict.
+
+Each entry in the team members report is given hash codes for the person
+(their SR number, or member ID without one), their normalised name and date
+of birth, and the event (boat type) of their crew. Conflicts are then found
+by counting the entries in each group of codes, in time linear in the number
+of entries, rather than by comparing entries with each other:
+
+- the same person entered more than once in an event
+- a cox who is also rowing in the same event
+- the same person with more than one member ID, by SR number or by name and
+  date of birth
+"""
+
+import numpy as np
+import pandas as pd
+import playwaze_rowing_reports.playwaze_reports as pw
+from playwaze_rowing_reports.name_matching import normalise_names
+from playwaze_rowing_reports.instrumentation import timed
+
+COL_CONFLICT = "conflict"
+SORT_NAME = "sort name"  # the normalised name, only used to sort
+
+ENTERED_TWICE = "entered more than once in an event"
+COX_ALSO_ROWING = "cox also rowing in the event"
+SEVERAL_MEMBER_IDS = "more than one member ID"
+
+CONFLICTS = (ENTERED_TWICE, COX_ALSO_ROWING, SEVERAL_MEMBER_IDS)
+
+CONFLICT_COLUMNS = [
+    COL_CONFLICT,
+    pw.COL_NAME,
+    pw.COL_SR_NUMBER,
+    pw.COL_MEMBER_ID,
+    pw.COL_DOB,
+    pw.COL_BOAT_TYPE,
+    pw.COL_CREW_NAME,
+    pw.COL_CLUB,
+    pw.COL_POSITION,
+    pw.COL_CREW_ID,
+]
+
+
+def factorize(values: pd.Series) -> np.ndarray:
+    """Hash codes of the values, -1 for blank values."""
+
+    return pd.factorize(values)[0]
+
+
+def combine_codes(left: np.ndarray, right: np.ndarray) -> np.ndarray:
+    """One code for each pair of codes, -1 if either is -1."""
+
+    valid = (left >= 0) & (right >= 0)
+    pairs = left.astype(np.int64) * (int(right.max(initial=0)) + 1) + right
+    return np.where(valid, factorize(pd.Series(pairs)), -1)
+
+
+def per_row(counts: np.ndarray, codes: np.ndarray) -> np.ndarray:
+    """The count of the group of each row, 0 for rows outside a group."""
+
+    return np.where(codes >= 0, counts[np.maximum(codes, 0)], 0)
+
+
+def count_rows(codes: np.ndarray, weights: np.ndarray = None) -> np.ndarray:
+    """The number of rows (or sum of weights) in the group of each row."""
+
+    valid = codes >= 0
+    counts = np.bincount(
+        codes[valid],
+        None if weights is None else weights[valid],
+        minlength=int(codes.max(initial=0)) + 1,
+    )
+    return per_row(counts, codes)
+
+
+def count_distinct(groups: np.ndarray, values: np.ndarray) -> np.ndarray:
+    """The number of distinct values in the group of each row."""
+
+    pairs = combine_codes(groups, values)
+    first = (pairs >= 0) & ~pd.Series(pairs).duplicated().to_numpy()
+    counts = np.bincount(
+        groups[first], minlength=int(groups.max(initial=0)) + 1
+    )
+    return per_row(counts, groups)
+
+
+@timed
+def find_conflicts(df_team_members: pd.DataFrame) -> pd.DataFrame:
+    """
+    Every entry in a conflict, once for each conflict it is in, sorted so
+    the entries of each conflicting person are together.
+    """
+
+    df = df_team_members.reset_index(drop=True)
+    sr_numbers = factorize(df[pw.COL_SR_NUMBER])
+    member_ids = factorize(df[pw.COL_MEMBER_ID])
+    people = np.where(
+        sr_numbers >= 0,
+        sr_numbers,
+        np.where(
+            member_ids >= 0, sr_numbers.max(initial=-1) + 1 + member_ids, -1
+        ),
+    )
+
+    # entries of the same person in the same event, with and without a cox
+    person_events = combine_codes(people, factorize(df[pw.COL_BOAT_TYPE]))
+    entries = count_rows(person_events)
+    coxes = count_rows(
+        person_events,
+        (df[pw.COL_POSITION] == pw.COX_POSITION).to_numpy(
+            bool, na_value=False
+        ),
+    )
+    repeated = entries > 1
+    cox_also_rowing = repeated & (coxes > 0) & (coxes < entries)
+
+    # member IDs of the same SR number, or the same name and date of birth
+    names = normalise_names(df[pw.COL_NAME])
+    names_dobs = combine_codes(factorize(names), factorize(df[pw.COL_DOB]))
+    several_ids = (member_ids >= 0) & (
+        (count_distinct(sr_numbers, member_ids) > 1)
+        | (count_distinct(names_dobs, member_ids) > 1)
+    )
+
+    columns = [col for col in CONFLICT_COLUMNS[1:] if col in df.columns]
+    df = df[columns].assign(**{SORT_NAME: names})
+    df_conflicts = pd.concat(
+        [
+            df[mask].assign(**{COL_CONFLICT: conflict})
+            for conflict, mask in (
+                (ENTERED_TWICE, repeated & ~cox_also_rowing),
+                (COX_ALSO_ROWING, cox_also_rowing),
+                (SEVERAL_MEMBER_IDS, several_ids),
+            )
+        ]
+    )
+    df_conflicts = df_conflicts.astype(
+        {COL_CONFLICT: pd.CategoricalDtype(CONFLICTS)}
+    )
+
+    df_conflicts = df_conflicts.sort_values(
+        [COL_CONFLICT, SORT_NAME, pw.COL_SR_NUMBER, pw.COL_BOAT_TYPE],
+        kind="stable",
+    )
+    return df_conflicts[[COL_CONFLICT] + columns].reset_index(drop=True)
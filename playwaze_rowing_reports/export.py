@@ -0,0 +1,110 @@
+import collections
+import io
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO, Callable, Dict, Union
+import pandas as pd
+
+CSV_FORMAT = "CSV"
+PARQUET_FORMAT = "Parquet"
+EXCEL_FORMAT = "Excel"
+
+# export formats: name -> (file extension, mime type)
+EXPORT_FORMATS = {
+    CSV_FORMAT: ("csv", "text/csv"),
+    PARQUET_FORMAT: ("parquet", "application/vnd.apache.parquet"),
+    EXCEL_FORMAT: (
+        "xlsx",
+        "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    ),
+}
+
+MAX_SHEET_NAME_LENGTH = 31  # longest sheet name excel allows
+
+ZIP_MIME = "application/zip"
+DEFAULT_ZIP_WORKERS = 4  # files of a zip archive exported at once
+
+
+def to_csv_bytes(df: Union[pd.DataFrame, pd.Series]) -> bytes:
+
+    if isinstance(df, pd.DataFrame):
+        # categories are written as their values, but much more slowly
+        categories = df.select_dtypes("category").columns
+        df = df.astype(dict.fromkeys(categories, object))
+    return df.to_csv().encode()
+
+
+def to_parquet_bytes(df: Union[pd.DataFrame, pd.Series]) -> bytes:
+
+    if isinstance(df, pd.Series):
+        df = df.to_frame()
+    # parquet only allows string column names, pivoted reports have others
+    df = df.rename(columns=str)
+    buffer = io.BytesIO()
+    df.to_parquet(buffer)
+    return buffer.getvalue()
+
+
+def to_xlsx_bytes(sheets: Dict[str, Union[pd.DataFrame, pd.Series]]) -> bytes:
+    """Write each dataframe to its own sheet of an excel workbook."""
+
+    buffer = io.BytesIO()
+    with pd.ExcelWriter(buffer, engine="openpyxl") as writer:
+        for name, df in sheets.items():
+            df.to_excel(writer, sheet_name=name[:MAX_SHEET_NAME_LENGTH])
+    return buffer.getvalue()
+
+
+def export_bytes(
+    df: Union[pd.DataFrame, pd.Series], file_format: str, name: str = ""
+) -> bytes:
+    """Export a dataframe as a file in the given format."""
+
+    if file_format == CSV_FORMAT:
+        return to_csv_bytes(df)
+    if file_format == PARQUET_FORMAT:
+        return to_parquet_bytes(df)
+    if file_format == EXCEL_FORMAT:
+        return to_xlsx_bytes({name or "Sheet1": df})
+    raise ValueError(f"Unknown export format: {file_format}")
+
+
+def get_file_name(name: str, file_format: str) -> str:
+    extension, _ = EXPORT_FORMATS[file_format]
+    return f"{name.lower()}.{extension}"
+
+
+def write_zip(
+    files: Dict[str, Callable[[], bytes]],
+    fileobj: BinaryIO,
+    workers: int = DEFAULT_ZIP_WORKERS,
+) -> None:
+    """
+    Write a zip archive of files, given by name with a function that exports
+    the file. The files are exported concurrently in a thread pool, and each
+    is written to the archive and let go as soon as it is its turn, so only
+    about as many files as there are workers are held in memory at once.
+    """
+
+    with zipfile.ZipFile(
+        fileobj, "w", zipfile.ZIP_DEFLATED
+    ) as archive, ThreadPoolExecutor(workers) as executor:
+        # files being exported, in the order they are written
+        pending = collections.deque()
+        for name, export_file in files.items():
+            pending.append((name, executor.submit(export_file)))
+            if len(pending) > workers:
+                name, future = pending.popleft()
+                archive.writestr(name, future.result())
+        while pending:
+            name, future = pending.popleft()
+            archive.writestr(name, future.result())
+
+
+def to_zip_bytes(
+    files: Dict[str, Callable[[], bytes]], workers: int = DEFAULT_ZIP_WORKERS
+) -> bytes:
+
+    buffer = io.BytesIO()
+    write_zip(files, buffer, workers)
+    return buffer.getvalue()
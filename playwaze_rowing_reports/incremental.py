@@ -0,0 +1,261 @@
+"""
+Work out what has changed between two versions of the reports for an event,
+so that a newer version can be processed by only redoing the crews that have
+changed.
+
+Each crew is summarised by a digest of its row in the teams report and its
+rows in the team members report. Crews are compared by crew id, and the
+members of changed crews by member id.
+"""
+
+from typing import Any, Dict, Iterable, Union
+import numpy as np
+import pandas as pd
+import playwaze_rowing_reports.playwaze_reports as pw
+
+# kinds of change to a crew
+ADDED = "added"
+REMOVED = "removed"
+MODIFIED = "modified"
+
+# columns of the changes report
+COL_CHANGE = "change"
+COL_PREVIOUS_BOAT_TYPE = "previous boat type"
+COL_PREVIOUS_CLUB = "previous club"
+COL_MEMBERS_ADDED = "members added"
+COL_MEMBERS_REMOVED = "members removed"
+
+CHANGES_COLUMNS = [
+    pw.COL_CREW_ID,
+    COL_CHANGE,
+    pw.COL_BOAT_TYPE,
+    pw.COL_CLUB,
+    pw.COL_CREW_NAME,
+    COL_PREVIOUS_BOAT_TYPE,
+    COL_PREVIOUS_CLUB,
+    COL_MEMBERS_ADDED,
+    COL_MEMBERS_REMOVED,
+]
+
+# columns with where a modified crew was before
+PREVIOUS_COLUMNS = {
+    pw.COL_BOAT_TYPE: COL_PREVIOUS_BOAT_TYPE,
+    pw.COL_CLUB: COL_PREVIOUS_CLUB,
+}
+
+# columns of the crew digests
+COL_TEAMS_DIGEST = "teams"
+COL_MEMBERS_DIGEST_LOW = "members low"
+COL_MEMBERS_DIGEST_HIGH = "members high"
+
+
+def hash_rows(df: pd.DataFrame) -> np.ndarray:
+    """Hash the values of each row, as uint64."""
+
+    # nullable integers and booleans hash much faster as floats
+    df = df.astype(
+        {
+            col: "float64"
+            for col, dtype in df.dtypes.items()
+            if isinstance(dtype, (pd.BooleanDtype, pd.Int64Dtype))
+        }
+    )
+    return pd.util.hash_pandas_object(df, index=False).values
+
+
+def crew_digests(
+    df_teams: pd.DataFrame, df_team_members: pd.DataFrame
+) -> pd.DataFrame:
+    """
+    Summarise every crew by a digest of its row in the cleaned teams report
+    (including the cox name) and its rows in the cleaned team members report
+    (including positions, so reordered crews are changed crews).
+    """
+
+    teams_crews = pd.Index(df_teams[pw.COL_CREW_ID].astype(object))
+    codes, crews = pd.factorize(df_team_members[pw.COL_CREW_ID])
+    crews = pd.Index(np.asarray(crews, dtype=object))
+    crews_only_in_members = crews[~crews.isin(teams_crews)]
+    all_crews = teams_crews.append(crews_only_in_members)
+
+    teams_digests = np.zeros(len(all_crews), dtype="uint64")
+    teams_digests[: len(teams_crews)] = hash_rows(df_teams)
+    df_digests = pd.DataFrame(
+        {COL_TEAMS_DIGEST: teams_digests},
+        index=all_crews.rename(pw.COL_CREW_ID),
+    )
+
+    # the hashes of each crew's members are summed in two halves, which
+    # floats hold exactly
+    member_hashes = hash_rows(df_team_members)
+    in_crew = codes >= 0
+    positions = crews.get_indexer(all_crews)
+    for column, half in [
+        (COL_MEMBERS_DIGEST_LOW, member_hashes & 0xFFFFFFFF),
+        (COL_MEMBERS_DIGEST_HIGH, member_hashes >> 32),
+    ]:
+        sums = np.bincount(
+            codes[in_crew], weights=half[in_crew], minlength=len(crews)
+        ).astype("int64")
+        # crews without members have a sum of 0
+        df_digests[column] = np.where(positions >= 0, sums[positions], 0)
+
+    return df_digests
+
+
+def changed_crews(
+    df_old_digests: pd.DataFrame, df_new_digests: pd.DataFrame
+) -> pd.Index:
+    """Crew ids that have been added, removed or modified."""
+
+    common = df_old_digests.index.intersection(df_new_digests.index)
+    modified = (
+        df_old_digests.loc[common].values != df_new_digests.loc[common].values
+    ).any(axis=1)
+
+    return (
+        common[modified]
+        .union(df_new_digests.index.difference(common))
+        .union(df_old_digests.index.difference(common))
+    )
+
+
+def frames_differ(
+    df_old: Union[None, pd.DataFrame], df_new: Union[None, pd.DataFrame]
+) -> bool:
+    """Whether two versions of a report, either of which may be missing,
+    have different contents."""
+
+    if df_old is None or df_new is None:
+        return df_old is not df_new
+    return not df_old.equals(df_new)
+
+
+def member_rows(df_team_members: pd.DataFrame) -> pd.Series:
+    """Mask of the rows of a team members report that are not coxes."""
+
+    return df_team_members[pw.COL_POSITION] != pw.COX_POSITION
+
+
+def get_changes(previous: Any, inputs: Dict[str, Any]) -> pd.DataFrame:
+    """
+    List the crews that have been added, removed or modified between the
+    previous and new preprocessed reports, and for modified crews, which
+    members have been added or removed.
+    """
+
+    df_old_teams = previous["df_teams"].set_index(pw.COL_CREW_ID)
+    df_new_teams = inputs["df_teams"].set_index(pw.COL_CREW_ID)
+    crews = changed_crews(
+        previous["df_crew_digests"], inputs["df_crew_digests"]
+    )
+
+    # crews with members but no entry in the teams report aren't listed
+    crews = crews[
+        crews.isin(df_old_teams.index) | crews.isin(df_new_teams.index)
+    ]
+    in_old = crews.isin(df_old_teams.index)
+    in_new = crews.isin(df_new_teams.index)
+    change = np.select([~in_old, ~in_new], [ADDED, REMOVED], MODIFIED)
+
+    columns = [pw.COL_BOAT_TYPE, pw.COL_CLUB, pw.COL_CREW_NAME]
+    df_changes = pd.concat(
+        [
+            df_new_teams.loc[crews[in_new], columns].astype(object),
+            df_old_teams.loc[crews[~in_new], columns].astype(object),
+        ]
+    )
+    df_changes = df_changes.reindex(crews)
+    df_changes.insert(0, COL_CHANGE, change)
+
+    # where modified crews were before, if they have moved
+    modified = crews[change == MODIFIED]
+    for column, previous_column in PREVIOUS_COLUMNS.items():
+        previous_values = df_old_teams.loc[modified, column].astype(object)
+        df_changes[previous_column] = previous_values[
+            previous_values != df_changes.loc[modified, column]
+        ]
+
+    # members that have joined or left changed crews, by member id
+    df_old_members = changed_members(previous["df_team_members"], crews)
+    df_new_members = changed_members(inputs["df_team_members"], crews)
+    df_members = pd.merge(
+        df_old_members,
+        df_new_members,
+        on=[pw.COL_CREW_ID, pw.COL_MEMBER_ID, pw.COL_NAME],
+        how="outer",
+        indicator=True,
+    )
+    for column, side in [
+        (COL_MEMBERS_ADDED, "right_only"),
+        (COL_MEMBERS_REMOVED, "left_only"),
+    ]:
+        df_side = df_members[df_members["_merge"] == side]
+        df_changes[column] = (
+            df_side[pw.COL_NAME]
+            .fillna("")
+            .groupby(df_side[pw.COL_CREW_ID].values)
+            .agg(", ".join)
+        )
+
+    df_changes = df_changes.rename_axis(pw.COL_CREW_ID).reset_index()
+    return df_changes[CHANGES_COLUMNS].sort_values(
+        [COL_CHANGE, pw.COL_BOAT_TYPE, pw.COL_CLUB], ignore_index=True
+    )
+
+
+def changed_members(
+    df_team_members: pd.DataFrame, crews: pd.Index
+) -> pd.DataFrame:
+
+    df = df_team_members.loc[
+        member_rows(df_team_members)
+        & df_team_members[pw.COL_CREW_ID].isin(crews),
+        [pw.COL_CREW_ID, pw.COL_MEMBER_ID, pw.COL_NAME],
+    ]
+    return df.astype(object)
+
+
+def changed_groups(df_changes: pd.DataFrame, column: str) -> pd.Index:
+    """
+    The groups of a column (e.g. the clubs) with a crew that has changed,
+    either before or after the change.
+    """
+
+    previous_column = PREVIOUS_COLUMNS[column]
+    return pd.Index(
+        pd.concat([df_changes[column], df_changes[previous_column]]).dropna()
+    ).unique()
+
+
+def splice_groups(
+    previous: Union[pd.Series, pd.DataFrame],
+    recomputed: Union[pd.Series, pd.DataFrame],
+    groups: Iterable,
+    columns: Iterable[str] = None,
+) -> Union[pd.Series, pd.DataFrame]:
+    """
+    Update a report aggregated by group. recomputed must be correct for
+    groups, and have a row for every group of the new report (as a groupby
+    on a categorical column does). The rows of every other group are taken
+    from previous. columns limits the values taken from previous, for
+    columns that recomputed has correct for every group.
+    """
+
+    unchanged = ~recomputed.index.isin(groups) & recomputed.index.isin(
+        previous.index
+    )
+    unchanged_groups = recomputed.index[unchanged]
+
+    spliced = recomputed.copy()
+    if isinstance(recomputed, pd.Series):
+        spliced[unchanged] = previous.loc[unchanged_groups].values
+    else:
+        columns = list(columns or recomputed.columns)
+        positions = recomputed.columns.get_indexer(columns)
+        for column, position in zip(columns, positions):
+            spliced.iloc[unchanged, position] = previous.loc[
+                unchanged_groups, column
+            ].values
+
+    return spliced
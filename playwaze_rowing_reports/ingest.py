@@ -0,0 +1,467 @@
+import contextlib
+import csv
+import io
+import itertools
+import json
+import zipfile
+import pandas as pd
+from typing import (
+    Any,
+    BinaryIO,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Tuple,
+    Union,
+)
+import playwaze_rowing_reports.playwaze_reports as pw
+
+# formats a report may be in, detected from the start of the report
+XLSX = "xlsx"
+CSV = "csv"
+JSON = "json"
+
+# an xlsx workbook is a zip file
+ZIP_SIGNATURE = b"PK\x03\x04"
+UTF8_BOM = b"\xef\xbb\xbf"
+
+# dtypes set on columns as they are parsed. Columns not listed here have
+# their dtype inferred from the cell values.
+REPORT_DTYPES = {
+    pw.COL_SEATS: "Int64",
+    pw.COL_SR_NUMBER: "Int64",
+    pw.COL_ROW_POINTS: "float64",
+    pw.COL_SCULL_POINTS: "float64",
+}
+
+
+def load_workbook(report: BinaryIO):
+    """
+    Open an xlsx report to be read row by row. Raises a ValueError if the
+    report isn't an xlsx workbook.
+    """
+
+    # openpyxl is slow to import, and only needed once reports are uploaded
+    import openpyxl
+    from openpyxl.utils.exceptions import InvalidFileException
+
+    try:
+        return openpyxl.load_workbook(report, read_only=True, data_only=True)
+    except (InvalidFileException, zipfile.BadZipFile):
+        raise ValueError("It is not an xlsx workbook")
+
+
+@contextlib.contextmanager
+def open_binary(report: Union[str, BinaryIO]) -> Iterator[BinaryIO]:
+    """Open a report path, or use a report file object, rewinding it after."""
+
+    if not hasattr(report, "read"):
+        with open(report, "rb") as f:
+            yield f
+        return
+
+    try:
+        yield report
+    finally:
+        report.seek(0)
+
+
+@contextlib.contextmanager
+def open_text(report: Union[str, BinaryIO]) -> Iterator[io.TextIOBase]:
+    """Open a csv report as text, skipping any byte order mark."""
+
+    with open_binary(report) as f:
+        text = io.TextIOWrapper(f, encoding="utf-8-sig", newline="")
+        try:
+            yield text
+        finally:
+            text.detach()  # leave the report open
+
+
+def detect_format(report: Union[str, BinaryIO]) -> str:
+    """
+    Detect whether a report is an xlsx workbook, json or csv from its first
+    bytes, whatever the name of the file.
+    """
+
+    with open_binary(report) as f:
+        start = f.read(64)
+
+    if start.startswith(ZIP_SIGNATURE):
+        return XLSX
+    if start.lstrip(UTF8_BOM).lstrip()[:1] in (b"[", b"{"):
+        return JSON
+    return CSV
+
+
+def blank_to_none(cell: Any) -> Any:
+    """Blank cells of csv and json reports are None, as they are in xlsx."""
+
+    return None if cell == "" else cell
+
+
+def iter_csv_rows(text: io.TextIOBase) -> Iterator[Tuple]:
+
+    try:
+        for row in csv.reader(text):
+            yield tuple(blank_to_none(cell) for cell in row)
+    except (UnicodeDecodeError, csv.Error):
+        raise ValueError("It is not an xlsx, csv or json report")
+
+
+# characters of a json report read at a time
+JSON_CHUNK_SIZE = 1 << 16
+JSON_WHITESPACE = " \t\n\r"
+
+
+class JsonStream:
+    """
+    A json document read a chunk at a time, so the values of a long list
+    can be decoded one by one rather than loading the whole document.
+    """
+
+    def __init__(self, text: io.TextIOBase):
+
+        self.text = text
+        self.decoder = json.JSONDecoder()
+        self.buffer = ""
+        self.pos = 0
+
+    def _fill(self) -> bool:
+        """Read the next chunk into the buffer. False at the end."""
+
+        chunk = self.text.read(JSON_CHUNK_SIZE)
+        self.buffer = self.buffer[self.pos :] + chunk
+        self.pos = 0
+        return bool(chunk)
+
+    def peek(self) -> Union[str, None]:
+        """The next character that isn't whitespace, None at the end."""
+
+        while True:
+            buffer = self.buffer
+            while (
+                self.pos < len(buffer) and buffer[self.pos] in JSON_WHITESPACE
+            ):
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                return None
+
+    def expect(self, char: str) -> None:
+
+        if self.peek() != char:
+            raise ValueError("It is not a valid json report")
+        self.pos += 1
+
+    def decode(self) -> Any:
+        """Decode the next value, reading more chunks until it is whole."""
+
+        self.peek()
+        while True:
+            try:
+                value, self.pos = self.decoder.raw_decode(
+                    self.buffer, self.pos
+                )
+                return value
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+
+
+def iter_json_values(stream: JsonStream) -> Iterator[Any]:
+    """
+    The values of the list of a json report, one at a time. The list may be
+    the only value of an object.
+    """
+
+    wrapped = stream.peek() == "{"
+    if wrapped:
+        stream.expect("{")
+        if not isinstance(stream.decode(), str):
+            raise ValueError("It is not a valid json report")
+        stream.expect(":")
+    if stream.peek() != "[":
+        raise ValueError("It is not a list of rows or records")
+
+    stream.expect("[")
+    if stream.peek() == "]":
+        stream.expect("]")
+    else:
+        yield stream.decode()
+        while stream.peek() == ",":
+            stream.expect(",")
+            yield stream.decode()
+        stream.expect("]")
+
+    if wrapped:
+        if stream.peek() != "}":
+            raise ValueError("It is not a list of rows or records")
+        stream.expect("}")
+    if stream.peek() is not None:
+        raise ValueError("It is not a valid json report")
+
+
+def iter_json_rows(report: Union[str, BinaryIO]) -> Iterator[Tuple]:
+    """
+    The rows of a json report, header first. The report is a list of rows
+    (the first of which is the header), or a list of records with the
+    headers as keys, and the list may be the only value of an object. The
+    rows are decoded as they are read; the headers of records are the keys
+    of the first record, so later records can't have other keys.
+    """
+
+    with open_text(report) as text:
+        values = iter_json_values(JsonStream(text))
+        try:
+            try:
+                first = next(values)
+            except StopIteration:
+                return
+            if isinstance(first, dict):
+                header = list(first)
+                yield tuple(header)
+                for number, record in enumerate(
+                    itertools.chain([first], values), start=1
+                ):
+                    if not isinstance(record, dict):
+                        raise ValueError("It is not a list of records")
+                    if not record.keys() <= first.keys():
+                        raise ValueError(
+                            f"Record {number} has keys that the first "
+                            "record doesn't have"
+                        )
+                    yield tuple(
+                        blank_to_none(record.get(key)) for key in header
+                    )
+            else:
+                for row in itertools.chain([first], values):
+                    if not isinstance(row, list):
+                        raise ValueError("It is not a list of rows")
+                    yield tuple(blank_to_none(cell) for cell in row)
+        except (UnicodeDecodeError, json.JSONDecodeError):
+            raise ValueError("It is not a valid json report")
+
+
+@contextlib.contextmanager
+def open_rows(
+    report: Union[str, BinaryIO], max_col: int
+) -> Iterator[Iterator[Tuple]]:
+    """
+    Open a report of any format to be read row by row, header row first.
+    Each row is a tuple of the cell values up to column max_col (starting
+    from 1), and may be shorter. Blank cells are None.
+    """
+
+    report_format = detect_format(report)
+    if report_format == XLSX:
+        workbook = load_workbook(report)
+        try:
+            yield workbook.worksheets[0].iter_rows(
+                max_col=max_col, values_only=True
+            )
+        finally:
+            workbook.close()
+    elif report_format == JSON:
+        # the report is read as the rows are, so it is closed (and rewound)
+        # however many rows are read
+        rows = iter_json_rows(report)
+        try:
+            yield (row[:max_col] for row in rows)
+        finally:
+            rows.close()
+    else:
+        with open_text(report) as text:
+            yield (row[:max_col] for row in iter_csv_rows(text))
+
+
+# rows read after the header row to check the layout of a report
+SAMPLE_ROWS = 20
+
+# values a yes/no column may hold, before they are cleaned
+FLAG_VALUES = {"Y", "N", True, False}
+
+
+def is_flag(cell: Any) -> bool:
+    return cell in FLAG_VALUES
+
+
+def is_number(cell: Any) -> bool:
+    if isinstance(cell, bool):
+        return False
+    try:
+        float(cell)
+    except (TypeError, ValueError):
+        return False
+    return True
+
+
+def read_sample(
+    report: BinaryIO, max_col: int, rows: int = SAMPLE_ROWS
+) -> Tuple[Tuple, List[Tuple]]:
+    """
+    Read the header row and the first rows of a report (the first sheet of
+    an xlsx workbook), up to column max_col (starting from 1). A report that
+    is a file object is rewound, so it can be read in full afterwards.
+    """
+
+    try:
+        with open_rows(report, max_col) as report_rows:
+            sample = list(itertools.islice(report_rows, rows + 1))
+    finally:
+        if hasattr(report, "seek"):
+            report.seek(0)
+
+    if not sample:
+        return (), []
+    return sample[0], sample[1:]
+
+
+def check_layout(
+    header: Tuple,
+    rows: List[Tuple],
+    columns: Dict[str, int],
+    headers: Dict[str, str] = None,
+    checks: Dict[str, Callable[[Any], bool]] = None,
+) -> List[str]:
+    """
+    Check the header row and sample rows of a report against the column
+    numbers of the config, and return every problem found.
+
+    The header must reach the last configured column, and the headers given
+    in headers (by column name) must match, ignoring case and spacing. The
+    values of the sample in a column with a check must all pass it (blank
+    cells are not checked).
+    """
+
+    problems = []
+    width = max(
+        (i + 1 for i, cell in enumerate(header) if cell is not None),
+        default=0,
+    )
+    if width <= max(columns.values()):
+        return [
+            f"it has {width} columns, but {max(columns.values()) + 1} were "
+            "expected"
+        ]
+
+    for name, expected in (headers or {}).items():
+        found = header[columns[name]]
+        if normalise_header(found) != normalise_header(expected):
+            problems.append(
+                f"column {columns[name] + 1} is headed {found!r}, but "
+                f"{expected!r} was expected"
+            )
+
+    for name, check in (checks or {}).items():
+        number = columns[name]
+        bad = [
+            row[number]
+            for row in rows
+            if number < len(row)
+            and row[number] is not None
+            and not check(row[number])
+        ]
+        if bad:
+            problems.append(
+                f"{name.title()} (column {number + 1}) has unexpected values, "
+                f"e.g. {bad[0]!r}"
+            )
+
+    return problems
+
+
+def normalise_header(header: Any) -> str:
+
+    return " ".join(str(header or "").lower().split())
+
+
+def read_report(
+    report: Union[str, BinaryIO],
+    columns: Dict[str, int],
+    dtypes: Dict[str, str] = REPORT_DTYPES,
+) -> pd.DataFrame:
+    """
+    Read only the given columns from a report, in any format.
+
+    columns maps the column name to use in the dataframe to the column number
+    (starting from 0) in the report, as in the playwaze config. The header
+    row is skipped, as are blank rows, e.g. trailing formatted rows.
+    """
+
+    if detect_format(report) == CSV:
+        values = read_csv_columns(report, columns)
+    else:
+        values = read_row_columns(report, columns)
+
+    # each column's values are dropped once they are a series, so the raw
+    # values of only one column are held alongside the series
+    series = {}
+    for name in list(values):
+        column = values.pop(name)
+        try:
+            series[name] = pd.Series(column, dtype=dtypes.get(name), name=name)
+        except (TypeError, ValueError):
+            raise ValueError(
+                f"{name.title()} contains values that are not "
+                f"{dtypes[name]}"
+            )
+
+    return pd.DataFrame(series, columns=list(columns))
+
+
+def read_row_columns(
+    report: Union[str, BinaryIO], columns: Dict[str, int]
+) -> Dict[str, List]:
+    """
+    The values of the given columns of a report, read row by row. An xlsx
+    workbook is streamed in read-only mode.
+    """
+
+    names = list(columns.keys())
+    numbers = list(columns.values())
+    values = {name: [] for name in names}
+
+    with open_rows(report, max(numbers) + 1) as rows:
+        for row in itertools.islice(rows, 1, None):
+            cells = [row[i] if i < len(row) else None for i in numbers]
+            if all(cell is None for cell in cells):
+                continue
+            for name, cell in zip(names, cells):
+                values[name].append(cell)
+
+    return values
+
+
+def read_csv_columns(
+    report: Union[str, BinaryIO], columns: Dict[str, int]
+) -> Dict[str, pd.Series]:
+    """
+    The values of the given columns of a csv report, parsed by pandas' C
+    parser, which skips the other columns as it reads.
+    """
+
+    numbers = sorted(set(columns.values()))
+    try:
+        with open_binary(report) as f:
+            df = pd.read_csv(
+                f,
+                encoding="utf-8-sig",
+                usecols=numbers,
+                keep_default_na=False,  # only blank cells are missing
+                na_values=[""],
+            )
+    except (UnicodeDecodeError, pd.errors.ParserError):
+        raise ValueError("It is not a valid csv report")
+
+    df.columns = numbers  # label the columns by number, not header
+    df = df.dropna(how="all").reset_index(drop=True)
+
+    # blank columns hold None, as they do when read row by row, rather than
+    # the NaN of an empty float column
+    return {
+        name: df[number] if df[number].notna().any() else [None] * len(df)
+        for name, number in columns.items()
+    }
@@ -0,0 +1,341 @@
+"""
+Time the stages of the pipeline, the reports and the views.
+
+Functions decorated with timed, and blocks run in a timer, are counted and
+record their wall time and the number of rows of the dataframes going in and
+coming out. With memory accounting on, they also record the deep memory of
+the dataframes coming out and the peak memory traced (by tracemalloc, over the
+whole process) while they ran. Records are kept for the current run of the
+app (streamlit runs each session in its own thread, so runs are kept per
+thread) and totalled for the process. Each record is also logged as a line of
+JSON to the "playwaze_rowing_reports.instrumentation" logger, see log_json.
+"""
+
+import functools
+import json
+import logging
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, TextIO
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+# records are only logged once log_json is called (or the level is lowered),
+# whatever the level of the root logger, which streamlit sets to INFO
+logger.setLevel(logging.WARNING)
+
+# columns of the timings reports
+COL_STAGE = "stage"
+COL_CALLS = "calls"
+COL_TOTAL_MS = "total (ms)"
+COL_MEAN_MS = "mean (ms)"
+COL_MAX_MS = "max (ms)"
+COL_ROWS_IN = "rows in"
+COL_ROWS_OUT = "rows out"
+COL_MB_OUT = "MB out"
+COL_PEAK_MB = "peak (MB)"
+
+MB = 1024 * 1024
+# tracemalloc can only reset the peak from python 3.9. Before then the peaks
+# of stages aren't traced, as clearing the traces instead hides the freeing
+# of earlier blocks, and the peaks would grow with every run.
+TRACES_PEAKS = hasattr(tracemalloc, "reset_peak")
+
+TIMINGS_COLUMNS = [
+    COL_STAGE,
+    COL_CALLS,
+    COL_TOTAL_MS,
+    COL_MEAN_MS,
+    COL_MAX_MS,
+    COL_ROWS_IN,
+    COL_ROWS_OUT,
+    COL_MB_OUT,
+    COL_PEAK_MB,
+]
+
+_run = threading.local()
+_totals: Dict[str, Dict[str, float]] = {}
+_totals_lock = threading.Lock()
+_json_handler = None
+_accounting_memory = False
+
+
+def count_rows(value: Any) -> int:
+    """
+    Rows of a dataframe or series, or summed over a tuple or dict of them (as
+    passed to or returned by a function). None if there are none.
+    """
+
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return len(value)
+    if isinstance(value, (tuple, dict)):
+        values = value.values() if isinstance(value, dict) else value
+        counts = [
+            len(v) for v in values if isinstance(v, (pd.DataFrame, pd.Series))
+        ]
+        return sum(counts) if counts else None
+    return None
+
+
+def memory_usage(value: Any) -> int:
+    """
+    Deep memory in bytes of a dataframe, series or bytes, or summed over a
+    tuple or dict of them, as count_rows. Other values are not counted.
+    """
+
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, bytes):
+        return len(value)
+    if isinstance(value, (tuple, dict)):
+        values = value.values() if isinstance(value, dict) else value
+        return sum(memory_usage(v) for v in values)
+    return 0
+
+
+def start_memory_accounting() -> None:
+    """
+    Record the memory of the frames made by each stage, and the peak memory
+    traced while it runs. Tracing memory slows the app down.
+    """
+
+    global _accounting_memory
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+    _accounting_memory = True
+
+
+def stop_memory_accounting() -> None:
+
+    global _accounting_memory
+    _accounting_memory = False
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+def is_accounting_memory() -> bool:
+    return _accounting_memory
+
+
+def start_peak() -> None:
+    """
+    Start tracing the peak memory of a stage. The peak of each stage that is
+    running in this thread is kept on a stack, so a stage's peak includes
+    the peaks of the stages it runs.
+    """
+
+    peaks = _run.__dict__.setdefault("peaks", [])
+    if peaks:
+        peaks[-1] = max(peaks[-1], tracemalloc.get_traced_memory()[1])
+    tracemalloc.reset_peak()
+    peaks.append(0)
+
+
+def end_peak() -> int:
+    """The peak memory traced since the stage started, in bytes."""
+
+    peaks = _run.peaks
+    peak = max(peaks.pop(), tracemalloc.get_traced_memory()[1])
+    if peaks:
+        peaks[-1] = max(peaks[-1], peak)
+    return peak
+
+
+@contextmanager
+def timer(stage: str, rows_in: int = None) -> Iterator[Dict[str, Any]]:
+    """
+    Time a block of code as stage. The record is yielded, so that the block
+    can set its "rows out".
+    """
+
+    record = {"stage": stage, "rows in": rows_in, "rows out": None}
+    tracing_peak = _accounting_memory and TRACES_PEAKS
+    if tracing_peak:
+        start_peak()
+    start = time.perf_counter()
+    try:
+        yield record
+    except BaseException as e:
+        record["error"] = type(e).__name__
+        raise
+    finally:
+        record["seconds"] = time.perf_counter() - start
+        if tracing_peak:
+            record["peak bytes"] = end_peak()
+        add_record(record)
+
+
+def timed(func: Callable = None, *, stage: str = None) -> Callable:
+    """
+    Decorator timing every call of a function. The stage defaults to the
+    module and name of the function, e.g. "playwaze_reports.get_coxes".
+    """
+
+    def decorate(func: Callable) -> Callable:
+        module = func.__module__.rsplit(".", 1)[-1]
+        name = stage or f"{module}.{func.__qualname__}"
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            rows_in = count_rows(args + tuple(kwargs.values()))
+            with timer(name, rows_in) as record:
+                result = func(*args, **kwargs)
+                record["rows out"] = count_rows(result)
+                if _accounting_memory:
+                    record["bytes out"] = memory_usage(result)
+            return result
+
+        return wrapper
+
+    return decorate(func) if func is not None else decorate
+
+
+def add_record(record: Dict[str, Any]) -> None:
+
+    records = getattr(_run, "records", None)
+    if records is not None:
+        records.append(record)
+
+    with _totals_lock:
+        totals = _totals.setdefault(
+            record["stage"],
+            {"calls": 0, "seconds": 0.0, "max": 0.0, "peak bytes": None},
+        )
+        totals["calls"] += 1
+        totals["seconds"] += record["seconds"]
+        totals["max"] = max(totals["max"], record["seconds"])
+        totals["rows in"] = record["rows in"]
+        totals["rows out"] = record["rows out"]
+        totals["bytes out"] = record.get("bytes out")
+        if "peak bytes" in record:
+            totals["peak bytes"] = max(
+                totals["peak bytes"] or 0, record["peak bytes"]
+            )
+
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(json.dumps(record))
+
+
+def start_run() -> None:
+    """Start keeping the records of a new run in this thread."""
+
+    _run.records = []
+
+
+def get_run_records() -> List[Dict[str, Any]]:
+    """Records of the current run in this thread, in the order they ended."""
+
+    return list(getattr(_run, "records", None) or [])
+
+
+def get_run_peak() -> int:
+    """The highest peak memory of the stages of the current run in this
+    thread, in bytes. None without memory accounting, or before python 3.9
+    (see TRACES_PEAKS)."""
+
+    peaks = [
+        record["peak bytes"]
+        for record in get_run_records()
+        if "peak bytes" in record
+    ]
+    return max(peaks) if peaks else None
+
+
+def summarise_run(records: List[Dict[str, Any]] = None) -> pd.DataFrame:
+    """Timings of each stage of the current run (or the given records)."""
+
+    if records is None:
+        records = get_run_records()
+    df = pd.DataFrame(
+        records,
+        columns=[
+            "stage",
+            "seconds",
+            "rows in",
+            "rows out",
+            "bytes out",
+            "peak bytes",
+        ],
+    )
+    df_timings = df.groupby("stage", sort=False).agg(
+        **{
+            COL_CALLS: ("seconds", "size"),
+            COL_TOTAL_MS: ("seconds", "sum"),
+            COL_MEAN_MS: ("seconds", "mean"),
+            COL_MAX_MS: ("seconds", "max"),
+            COL_ROWS_IN: ("rows in", "last"),
+            COL_ROWS_OUT: ("rows out", "last"),
+            COL_MB_OUT: ("bytes out", "last"),
+            COL_PEAK_MB: ("peak bytes", "max"),
+        }
+    )
+    return to_timings_report(df_timings)
+
+
+def summarise_totals() -> pd.DataFrame:
+    """Timings of each stage, totalled over every run of the process."""
+
+    with _totals_lock:
+        df = pd.DataFrame.from_dict(_totals, orient="index")
+    if df.empty:
+        return pd.DataFrame(columns=TIMINGS_COLUMNS)
+
+    df_timings = pd.DataFrame(
+        {
+            COL_CALLS: df["calls"],
+            COL_TOTAL_MS: df["seconds"],
+            COL_MEAN_MS: df["seconds"] / df["calls"],
+            COL_MAX_MS: df["max"],
+            COL_ROWS_IN: df["rows in"],
+            COL_ROWS_OUT: df["rows out"],
+            COL_MB_OUT: df["bytes out"],
+            COL_PEAK_MB: df["peak bytes"],
+        }
+    )
+    return to_timings_report(df_timings)
+
+
+def to_timings_report(df_timings: pd.DataFrame) -> pd.DataFrame:
+
+    # seconds to milliseconds
+    for col in [COL_TOTAL_MS, COL_MEAN_MS, COL_MAX_MS]:
+        df_timings[col] = (df_timings[col] * 1000).round(1)
+    for col in [COL_ROWS_IN, COL_ROWS_OUT]:
+        df_timings[col] = df_timings[col].astype("Int64")
+    # bytes to MB
+    for col in [COL_MB_OUT, COL_PEAK_MB]:
+        df_timings[col] = (df_timings[col].astype("float64") / MB).round(1)
+
+    df_timings = df_timings.rename_axis(COL_STAGE).reset_index()
+    return df_timings.sort_values(
+        COL_TOTAL_MS, ascending=False, ignore_index=True
+    )[TIMINGS_COLUMNS]
+
+
+def reset_totals() -> None:
+
+    with _totals_lock:
+        _totals.clear()
+
+
+def log_json(stream: TextIO = sys.stderr) -> None:
+    """
+    Write every record to stream as a line of JSON. Only the first call adds
+    a handler, as the app calls this on every run.
+    """
+
+    global _json_handler
+    if _json_handler is not None:
+        return
+
+    _json_handler = logging.StreamHandler(stream)
+    _json_handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(_json_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
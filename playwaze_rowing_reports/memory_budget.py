@@ -0,0 +1,214 @@
+"""
+Keep the reports held in memory within a budget.
+
+The reports of every version in the report cache are counted, with their
+memoized exports and layouts. Once they exceed the budget, memory is freed in
+order of how little it costs to get back:
+
+- what can be derived again in the other versions (exports, layouts and
+  intermediate nodes, see ReportGraph.release)
+- the other versions themselves, least recently used first. Versions still
+  held elsewhere, shown in another session or published, are kept, as
+  evicting them would free nothing.
+
+The version being shown is never released, as the view is about to use what
+is memoized in it.
+
+While new reports are preprocessed, the budget is also checked between the
+stages of the pipeline (see PipelineBudget), counting the frames made so far.
+The other versions are then freed before the new frames are added to them,
+rather than after, and the uploads that have been parsed are closed.
+"""
+
+import io
+import sys
+import weakref
+from typing import Any, BinaryIO, Dict, List, Tuple
+import playwaze_rowing_reports.report_graph as rg
+import playwaze_rowing_reports.instrumentation as instrumentation
+from playwaze_rowing_reports.cache import ReportCache
+
+MB = instrumentation.MB
+
+
+def held_bytes(
+    cache: ReportCache, keep: Tuple[rg.ReportGraph, ...] = ()
+) -> int:
+    """Deep memory of the cached reports, and of the reports kept that
+    aren't cached."""
+
+    graphs = cache.values()
+    graphs += [graph for graph in keep if not any(graph is g for g in graphs)]
+    return sum(graph.memory_usage() for graph in graphs)
+
+
+def release(graph_ref: "weakref.ref[rg.ReportGraph]") -> int:
+    """Release what can be derived again in a version, unless it has been
+    freed, e.g. evicted by another session. Returns the bytes released."""
+
+    graph = graph_ref()
+    if graph is None:
+        return 0
+    return graph.release()
+
+
+def evict_if_freed(
+    cache: ReportCache, graph_ref: "weakref.ref[rg.ReportGraph]"
+) -> int:
+    """
+    Evict a version from the cache if that frees it, i.e. nothing else holds
+    it. Otherwise it is put back. Returns the bytes freed.
+    """
+
+    graph = graph_ref()
+    if graph is None:
+        return 0
+    size = graph.memory_usage()
+    keys = cache.evict(graph)
+    del graph  # so that only what holds it elsewhere keeps it alive
+
+    graph = graph_ref()
+    if graph is None:
+        return size
+    for key in keys:
+        cache.put(key, graph)
+    return 0
+
+
+def free_others(
+    cache: ReportCache,
+    keep: Tuple[rg.ReportGraph, ...],
+    budget: float,
+    held_besides: int = 0,
+) -> int:
+    """
+    Release, then evict, the cached versions other than those kept, until
+    the reports held (with held_besides bytes held besides them) are within
+    budget bytes, if they can be. Returns the bytes freed.
+    """
+
+    # only weak references to the other versions are kept here, so that
+    # evicting them can free them
+    others = [
+        weakref.ref(graph)
+        for graph in cache.values()
+        if not any(graph is kept for kept in keep)
+    ]
+    freed = sum(release(graph_ref) for graph_ref in others)
+
+    for graph_ref in others:  # least recently used first
+        if held_besides + held_bytes(cache, keep) <= budget:
+            break
+        freed += evict_if_freed(cache, graph_ref)
+
+    return freed
+
+
+def enforce_budget(
+    cache: ReportCache, current: rg.ReportGraph, budget_mb: float
+) -> Tuple[int, int]:
+    """
+    Free memory until the reports held are within budget_mb, if they can
+    be. Returns the bytes held before and after.
+    """
+
+    budget = budget_mb * MB
+    before = held_bytes(cache, (current,))
+    if before <= budget:
+        return before, before
+
+    free_others(cache, (current,), budget)
+    return before, held_bytes(cache, (current,))
+
+
+def close_upload(report: BinaryIO) -> int:
+    """
+    Close an upload that has been parsed, dropping its buffer. Returns the
+    bytes freed, which are none if the buffer is held elsewhere: streamlit
+    keeps the bytes of an upload for as long as it is in the uploader.
+    """
+
+    if not isinstance(report, io.BytesIO) or report.closed:
+        return 0
+
+    buffer = report.getvalue()  # the buffer itself, unless it was resized
+    size = len(buffer)
+    # referred to by the upload, by buffer and as the argument
+    shared = sys.getrefcount(buffer) > 3
+    del buffer
+    report.close()
+    return 0 if shared else size
+
+
+class PipelineBudget:
+    """
+    Checks the budget between the stages of the pipeline while new reports
+    are preprocessed, as the check_memory of pipeline.preprocess_reports.
+    The frames made so far are counted with the cached reports. Once they
+    exceed the budget, the uploads that have been parsed are closed and the
+    other versions are freed as by enforce_budget, except the versions kept,
+    e.g. the previous version the reports are updated from. The bytes freed
+    are counted.
+
+    Only weak references to the versions kept are held, so they can still be
+    freed once the reports have been preprocessed.
+    """
+
+    def __init__(
+        self,
+        cache: ReportCache,
+        budget_mb: float,
+        keep: Tuple[rg.ReportGraph, ...] = (),
+    ):
+
+        self.cache = cache
+        self.budget = budget_mb * MB
+        self.keep = [weakref.ref(graph) for graph in keep if graph is not None]
+        self.freed = 0
+
+    def __call__(self, frames: Dict[str, Any], parsed: List[BinaryIO]) -> None:
+
+        keep = tuple(graph_ref() for graph_ref in self.keep)
+        keep = tuple(graph for graph in keep if graph is not None)
+        held = instrumentation.memory_usage(frames)
+        if held + held_bytes(self.cache, keep) <= self.budget:
+            return
+
+        self.freed += sum(close_upload(report) for report in parsed)
+        self.freed += free_others(self.cache, keep, self.budget, held)
+
+
+def get_memory_stats(
+    cache: ReportCache,
+    current: rg.ReportGraph,
+    budget_mb: float = None,
+    pipeline_budget: PipelineBudget = None,
+) -> Dict[str, float]:
+    """
+    The memory held by the reports, after keeping them within budget_mb if
+    there is a budget, with what was freed while they were preprocessed, and
+    the peak memory traced in this run if memory is being accounted for.
+    Empty if neither.
+    """
+
+    stats = {}
+    if budget_mb:
+        before, held = enforce_budget(cache, current, budget_mb)
+        stats["Memory Budget (MB)"] = budget_mb
+        if pipeline_budget is not None and pipeline_budget.freed:
+            stats["Freed While Processing (MB)"] = round(
+                pipeline_budget.freed / MB, 1
+            )
+        if held < before:
+            stats["Released (MB)"] = round((before - held) / MB, 1)
+    elif instrumentation.is_accounting_memory():
+        held = held_bytes(cache, (current,))
+    else:
+        return stats
+
+    stats["Reports in Memory (MB)"] = round(held / MB, 1)
+    peak = instrumentation.get_run_peak()
+    if peak is not None:
+        stats["Peak Memory This Run (MB)"] = round(peak / MB, 1)
+
+    return stats
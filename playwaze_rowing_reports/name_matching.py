@@ -0,0 +1,342 @@
+"""
+Match names typed free-hand, e.g. "jon  smith", to the names of members, e.g.
+"Jonathan Smith".
+
+Names are normalised (case and spacing) and split into a first name and a
+surname. Rather than scoring every pair of names, each name is given blocking
+keys: first the whole surname, then the start of the surname, the sound of
+the surname (Soundex) and the club, each with the start of the first name.
+Only names that share a key are scored, so matching stays close to linear in
+the number of names.
+"""
+
+import difflib
+import functools
+from typing import Callable, List
+import numpy as np
+import pandas as pd
+
+# columns of the matches
+COL_PERSON = "person"  # position of the person matched
+COL_CONFIDENCE = "confidence"
+COL_CANDIDATES = "candidates"  # people within the margin of the best match
+
+# a match is only accepted with at least this confidence, and if no other
+# person is within the margin of it
+MIN_CONFIDENCE = 0.85
+AMBIGUITY_MARGIN = 0.05
+
+SURNAME_WEIGHT = 0.6  # of the surname in the similarity of two names
+SHORT_NAME_SIMILARITY = 0.95  # of a first name and its short form
+CLUB_MISMATCH_FACTOR = 0.9  # applied to people who aren't in the club
+ADDITIONAL_CLUBS_SEP = ","  # between the additional clubs of a member
+
+SURNAME_PREFIX = 4  # letters of the surname in its blocking key
+FIRST_NAME_PREFIX = 2  # letters of the first name in the club blocking key
+
+SOUNDEX_DIGITS = {
+    letter: digit
+    for letters, digit in (
+        ("bfpv", "1"),
+        ("cgjkqsxz", "2"),
+        ("dt", "3"),
+        ("l", "4"),
+        ("mn", "5"),
+        ("r", "6"),
+    )
+    for letter in letters
+}
+
+
+def normalise_names(names: pd.Series) -> pd.Series:
+    """
+    The names in lower case with single spaces, to match names however they
+    were typed. Each distinct name is only normalised once.
+    """
+
+    codes, uniques = pd.factorize(names)
+    normalised = pd.Index(uniques).astype(str).str.casefold().str.split()
+    normalised = normalised.str.join(" ").take(np.maximum(codes, 0))
+    return pd.Series(normalised, index=names.index).where(codes >= 0, None)
+
+
+@functools.lru_cache(maxsize=None)
+def soundex(word: str) -> str:
+    """The Soundex code of a word, e.g. S530 for both Smith and Smyth."""
+
+    letters = [letter for letter in word.lower() if letter.isalpha()]
+    if not letters:
+        return ""
+
+    code = letters[0].upper()
+    last = SOUNDEX_DIGITS.get(letters[0], "")
+    for letter in letters[1:]:
+        digit = SOUNDEX_DIGITS.get(letter, "")
+        if digit and digit != last:
+            code += digit
+        if letter not in "hw":  # h and w don't separate equal digits
+            last = digit
+
+    return (code + "000")[:4]
+
+
+@functools.lru_cache(maxsize=None)
+def similarity(a: str, b: str) -> float:
+    return difflib.SequenceMatcher(None, a, b).ratio()
+
+
+def first_name_similarity(a: str, b: str) -> float:
+    """As similarity, but a short form of a name, e.g. Jon for Jonathan, is
+    nearly the same name."""
+
+    if a == b:
+        return 1.0
+    if min(len(a), len(b)) >= 3 and (a.startswith(b) or b.startswith(a)):
+        return SHORT_NAME_SIMILARITY
+    return similarity(a, b)
+
+
+def name_similarity(
+    first_a: str, surname_a: str, first_b: str, surname_b: str
+) -> float:
+
+    return SURNAME_WEIGHT * similarity(surname_a, surname_b) + (
+        1 - SURNAME_WEIGHT
+    ) * first_name_similarity(first_a, first_b)
+
+
+def split_names(names: pd.Series) -> pd.DataFrame:
+    """
+    Split normalised names into a first name (the first word) and a surname
+    (the last word), with middle names left out.
+    """
+
+    words = names.str.split()
+    return pd.DataFrame(
+        {"first": words.str[0], "surname": words.str[-1]}, index=names.index
+    )
+
+
+def surname_keys(df_names: pd.DataFrame, clubs: pd.Series) -> List[pd.Series]:
+    """
+    Keys of the first tier of blocks: the whole surname with the first
+    initial, for short forms of first names (Jon for Jonathan) and names
+    typed in a different case or spacing.
+    """
+
+    return ["surname " + df_names["surname"] + " " + df_names["first"].str[:1]]
+
+
+def similar_keys(df_names: pd.DataFrame, clubs: pd.Series) -> List[pd.Series]:
+    """
+    Keys of the second tier of blocks, for misspelt surnames: the start of
+    the surname and its Soundex code, each with the first initial, and the
+    club with the start of the first name.
+    """
+
+    first = df_names["first"].str[:1]
+    surnames = df_names["surname"]
+    return [
+        "prefix " + surnames.str[:SURNAME_PREFIX] + " " + first,
+        "soundex " + surnames.map(soundex, na_action="ignore") + " " + first,
+        # names without a club have no club key
+        "club "
+        + pd.Series(clubs.to_numpy(object), index=df_names.index)
+        + " "
+        + df_names["first"].str[:FIRST_NAME_PREFIX],
+    ]
+
+
+# tiers of blocking, in order. Names are only compared in a tier if they
+# weren't matched in an earlier one, so the larger blocks of the later tiers
+# are only searched for the few names that need them.
+BLOCKINGS = (surname_keys, similar_keys)
+
+
+def blocking_keys(
+    df_names: pd.DataFrame,
+    clubs: pd.Series,
+    blocking: Callable[[pd.DataFrame, pd.Series], List[pd.Series]],
+) -> pd.Series:
+    """
+    The blocking keys of each name for a tier of blocking, indexed by the
+    position of the name. Names that share a key are candidates to match.
+    """
+
+    positions = np.arange(len(df_names))
+    return pd.concat(
+        [
+            pd.Series(key.to_numpy(), index=positions)
+            for key in blocking(df_names, clubs)
+        ]
+    ).dropna()
+
+
+def shares_keys(
+    names: pd.Series,
+    clubs: pd.Series,
+    other_names: pd.Series,
+    other_clubs: pd.Series,
+) -> np.ndarray:
+    """
+    Whether each name shares a blocking key with any of the other names, so
+    might be matched to one of them.
+    """
+
+    df_names = split_names(normalise_names(names))
+    df_other_names = split_names(normalise_names(other_names))
+    shared = np.zeros(len(names), dtype=bool)
+    for blocking in BLOCKINGS:
+        keys = blocking_keys(df_names, clubs, blocking)
+        other_keys = blocking_keys(df_other_names, other_clubs, blocking)
+        shared[keys.index[keys.isin(other_keys)]] = True
+
+    return shared
+
+
+class NameMatcher:
+    """
+    Matches names to the names of people, e.g. the members in a members
+    report, by blocked fuzzy comparison. The blocking keys of the people are
+    built once.
+    """
+
+    def __init__(
+        self,
+        names: pd.Series,
+        primary_clubs: pd.Series,
+        additional_clubs: pd.Series,
+    ):
+
+        self.df_names = split_names(normalise_names(names))
+        self.primary_clubs = primary_clubs.to_numpy(object)
+        self.additional_clubs = additional_clubs.to_numpy(object)
+        self.keys = [
+            blocking_keys(self.df_names, primary_clubs, blocking)
+            for blocking in BLOCKINGS
+        ]
+
+    def match(self, names: pd.Series, clubs: pd.Series) -> pd.DataFrame:
+        """
+        The best match of each name that scores at least MIN_CONFIDENCE with
+        somebody. Returns, indexed like names, the position of the person
+        matched, the confidence, and the number of people within the margin
+        of the best match. Matches with more than one such person are
+        ambiguous.
+        """
+
+        df_names = split_names(normalise_names(names))
+        clubs = pd.Series(clubs.to_numpy(object), index=names.index)
+
+        matches = []
+        remaining = np.arange(len(df_names))
+        for blocking, person_keys in zip(BLOCKINGS, self.keys):
+            keys = blocking_keys(
+                df_names.iloc[remaining], clubs.iloc[remaining], blocking
+            )
+            # hash join the blocks, for the pairs of names to compare
+            df_pairs = pd.merge(
+                keys.rename("key").rename_axis("query").reset_index(),
+                person_keys.rename("key")
+                .rename_axis(COL_PERSON)
+                .reset_index(),
+                on="key",
+            ).drop_duplicates(["query", COL_PERSON])
+
+            query = remaining[df_pairs["query"].to_numpy()]
+            person = df_pairs[COL_PERSON].to_numpy()
+            df_matches = self.best_matches(df_names, clubs, query, person)
+            matches.append(df_matches)
+            remaining = np.setdiff1d(remaining, df_matches.index)
+            if not len(remaining):
+                break
+
+        df_matches = pd.concat(matches)
+        df_matches.index = names.index[df_matches.index]
+        return df_matches
+
+    def best_matches(
+        self,
+        df_names: pd.DataFrame,
+        clubs: pd.Series,
+        query: np.ndarray,
+        person: np.ndarray,
+    ) -> pd.DataFrame:
+        """
+        Score pairs of names (positions in df_names and of the people), and
+        keep the best match of each name, indexed by its position.
+        """
+
+        surnames = df_names["surname"].to_numpy(object)[query]
+        person_surnames = self.df_names["surname"].to_numpy(object)[person]
+
+        # the surnames' lengths bound their similarity, so pairs that can't
+        # reach MIN_CONFIDENCE aren't compared
+        lengths = pd.Series(surnames).str.len().to_numpy()
+        person_lengths = pd.Series(person_surnames).str.len().to_numpy()
+        bound = SURNAME_WEIGHT * (
+            2
+            * np.minimum(lengths, person_lengths)
+            / (lengths + person_lengths)
+        ) + (1 - SURNAME_WEIGHT)
+        possible = bound >= MIN_CONFIDENCE
+        query, person = query[possible], person[possible]
+
+        scores = np.array(
+            [
+                name_similarity(*pair)
+                for pair in zip(
+                    df_names["first"].to_numpy(object)[query],
+                    surnames[possible],
+                    self.df_names["first"].to_numpy(object)[person],
+                    person_surnames[possible],
+                )
+            ],
+            dtype="float64",
+        )
+        in_club = is_in_club(
+            clubs.to_numpy(object)[query],
+            self.primary_clubs[person],
+            self.additional_clubs[person],
+        )
+        scores = np.where(in_club, scores, scores * CLUB_MISMATCH_FACTOR)
+
+        df_scores = pd.DataFrame(
+            {"query": query, COL_PERSON: person, COL_CONFIDENCE: scores}
+        )
+        df_scores = df_scores[df_scores[COL_CONFIDENCE] >= MIN_CONFIDENCE]
+        df_scores = df_scores.sort_values(
+            ["query", COL_CONFIDENCE], ascending=[True, False], kind="stable"
+        )
+        best = df_scores.groupby("query")[COL_CONFIDENCE].transform("first")
+        close = df_scores[COL_CONFIDENCE] >= best - AMBIGUITY_MARGIN
+
+        df_matches = df_scores.drop_duplicates("query").set_index("query")
+        df_matches[COL_CANDIDATES] = close.groupby(df_scores["query"]).sum()
+        return df_matches
+
+
+def is_in_club(
+    clubs: np.ndarray, primary_clubs: np.ndarray, additional_clubs: np.ndarray
+) -> List[bool]:
+    """Whether each person is a member of each club, as their primary club
+    or one of their additional clubs. Clubs are compared by their whole
+    name, so Clyde isn't taken for Clydesdale ARC."""
+
+    return [
+        club == primary or club in split_clubs(additional)
+        for club, primary, additional in zip(
+            clubs, primary_clubs, additional_clubs
+        )
+    ]
+
+
+@functools.lru_cache(maxsize=None)
+def split_clubs(additional_clubs) -> frozenset:
+    """The names of the clubs in a comma separated list of clubs."""
+
+    if not isinstance(additional_clubs, str):
+        return frozenset()
+    return frozenset(
+        club.strip() for club in additional_clubs.split(ADDITIONAL_CLUBS_SEP)
+    )
@@ -0,0 +1,110 @@
+"""
+Filter and page through a report without scanning it on every rerun.
+
+A group index maps each value of a filter column (e.g. each club) to the
+positions of its rows in the report. It is built once for each version of a
+report, and a filter is then answered by combining the positions of the
+selected values, from which only the rows of the page shown are taken.
+"""
+
+from typing import Any, Dict, List, Sequence, Union
+import numpy as np
+import pandas as pd
+import playwaze_rowing_reports.playwaze_reports as pw
+import playwaze_rowing_reports.conflicts as conflicts
+
+# filters, and the columns they filter on, in order of preference
+FILTERS = {
+    "Boat type": [pw.COL_BOAT_TYPE],
+    "Club": [pw.COL_CLUB],
+    "Crew": [pw.COL_CREW_NAME, pw.COL_CREW_ID],
+    "Conflict": [conflicts.COL_CONFLICT],
+}
+
+PAGE_SIZES = (25, 50, 100, 250, 1000)
+
+GroupIndex = Dict[str, Dict[Any, np.ndarray]]
+
+
+def get_values(
+    df: Union[pd.DataFrame, pd.Series], column: str
+) -> Union[None, np.ndarray]:
+    """
+    The values of a column of df, or of a level of its index. None if there
+    isn't one, or if it holds numbers, e.g. a count of crews by club.
+    """
+
+    if isinstance(df, pd.DataFrame) and column in df.columns:
+        values = df[column]
+    elif column in df.index.names:
+        values = df.index.get_level_values(column)
+    else:
+        return None
+
+    if pd.api.types.is_numeric_dtype(values.dtype):
+        return None
+    return np.asarray(values, dtype=object)
+
+
+def build_group_index(
+    df: Union[pd.DataFrame, pd.Series], filters: Dict[str, List[str]] = FILTERS
+) -> GroupIndex:
+    """
+    Map each value of the column of each filter to the positions of its
+    rows, for the filters with a column in df. Blank values are left out.
+    """
+
+    group_index = {}
+    for name, columns in filters.items():
+        for column in columns:
+            values = get_values(df, column)
+            if values is None:
+                continue
+            positions = pd.Series(np.arange(len(values)))
+            group_index[name] = positions.groupby(values).indices
+            break
+
+    return group_index
+
+
+def filter_positions(
+    group_index: GroupIndex, selections: Dict[str, Sequence], n_rows: int
+) -> np.ndarray:
+    """
+    The positions, in order, of the rows with one of the selected values of
+    every filter. Filters with nothing selected don't filter.
+    """
+
+    positions = None
+    for name, values in selections.items():
+        if not values:
+            continue
+        groups = group_index[name]
+        selected = np.sort(
+            np.concatenate(
+                [groups[value] for value in values if value in groups]
+                or [np.empty(0, dtype=np.intp)]
+            )
+        )
+        if positions is None:
+            positions = selected
+        else:
+            positions = np.intersect1d(positions, selected, assume_unique=True)
+
+    return np.arange(n_rows) if positions is None else positions
+
+
+def count_pages(n_rows: int, page_size: int) -> int:
+    return max(1, -(-n_rows // page_size))
+
+
+def get_page(
+    df: Union[pd.DataFrame, pd.Series],
+    positions: np.ndarray,
+    page: int,
+    page_size: int,
+) -> Union[pd.DataFrame, pd.Series]:
+    """The rows of a page (starting from 1) of the filtered rows of df."""
+
+    start = (page - 1) * page_size
+    return df.iloc[positions[start : start + page_size]]
@@ -0,0 +1,518 @@
+import numpy as np
+import pandas as pd
+from typing import Any, BinaryIO, Callable, Dict, List, Tuple, Union
+import playwaze_rowing_reports.playwaze_reports as pw
+import playwaze_rowing_reports.ingest as ingest
+import playwaze_rowing_reports.incremental as incremental
+import playwaze_rowing_reports.name_matching as name_matching
+import playwaze_rowing_reports.strings as strings
+from playwaze_rowing_reports.cache import ParquetCache, hash_reports
+from playwaze_rowing_reports.instrumentation import timed
+
+# columns in the teams report that must have a value in every row
+TEAMS_REQUIRED_COLUMNS = [
+    pw.COL_CREW_ID,
+    pw.COL_BOAT_TYPE,
+    pw.COL_CLUB,
+    pw.COL_CREW_NAME,
+    pw.COL_CREW_LETTER,
+    pw.COL_SEATS,
+    pw.COL_VERIFIED,
+    pw.COL_CAPTAIN,
+    pw.COL_COX,
+]
+
+
+# called between the stages of preprocessing with the frames made so far and
+# the reports that have been parsed, e.g. memory_budget.PipelineBudget
+CheckMemory = Callable[[Dict[str, Any], List[BinaryIO]], None]
+
+
+class ReportError(Exception):
+    """Raised when an uploaded Playwaze report cannot be processed."""
+
+
+@timed
+def load_and_clean_teams_report(
+    report: BinaryIO,
+    columns: Dict[str, int],
+    headers: Dict[str, str] = None,
+) -> pd.DataFrame:
+
+    df = read_report(report, columns, "teams", pw.TEAM_DTYPES, headers)
+    df = df[pw.TEAM_COLUMNS]  # make sure they are in order
+
+    # check that there are no nans in the required columns, all at once so
+    # every column missing values is reported
+    missing = df[TEAMS_REQUIRED_COLUMNS].isnull().sum()
+    missing = missing[missing > 0]
+    if not missing.empty:
+        columns_missing = ", ".join(
+            f"{col.title()} ({count} row{'s' if count > 1 else ''})"
+            for col, count in missing.items()
+        )
+        raise ReportError(
+            f"Values are missing from {columns_missing}. Please check the "
+            "teams report."
+        )
+
+    df = df.assign(
+        **clean_flags(
+            df, [pw.COL_COX, pw.COL_VERIFIED, pw.COL_CAPTAIN], "teams"
+        )
+    )
+    df = pw.clean_composites(df)
+    df = df.assign(
+        **{pw.COL_CREW_ID: strings.remove(df[pw.COL_CREW_ID], "teams/")}
+    )
+    # change the entry ids so the column name and values match the crew id
+    # from the members report
+
+    return pw.apply_schema(df, pw.TEAM_DTYPES)
+
+
+@timed
+def load_and_clean_team_members_report(
+    report: BinaryIO,
+    columns: Dict[str, int],
+    headers: Dict[str, str] = None,
+) -> pd.DataFrame:
+
+    df = read_report(
+        report, columns, "team members", pw.TEAM_MEMBER_DTYPES, headers
+    )
+    df = pw.clean_composites(df, set_composite_flag=False)
+    df = df[pw.TEAM_MEMBER_COLUMNS]  # make sure they are in order
+
+    df = df.assign(
+        **clean_flags(
+            df, [pw.COL_ROW_NOVICE, pw.COL_SCULL_NOVICE], "team members"
+        )
+    )
+    df = df.assign(**{pw.COL_POSITION: pw.assign_rower_position(df)})
+
+    return pw.apply_schema(df, pw.TEAM_MEMBER_DTYPES)
+
+
+@timed
+def load_and_clean_community_members_report(
+    report: BinaryIO,
+    columns: Dict[str, int],
+    headers: Dict[str, str] = None,
+) -> pd.DataFrame:
+
+    df = read_report(
+        report,
+        columns,
+        "community members",
+        pw.COMMUNITY_MEMBER_DTYPES,
+        headers,
+    )
+    df = df.assign(
+        **clean_flags(
+            df, [pw.COL_ROW_NOVICE, pw.COL_SCULL_NOVICE], "community members"
+        )
+    )
+
+    return pw.apply_schema(df, pw.COMMUNITY_MEMBER_DTYPES)
+
+
+@timed
+def read_report(
+    report: BinaryIO,
+    columns: Dict[str, int],
+    report_type: str,
+    dtypes: Dict[str, str] = None,
+    headers: Dict[str, str] = None,
+) -> pd.DataFrame:
+    """
+    Read only the configured columns of a report. The header row and the
+    first few rows are checked first, so that a report uploaded in the wrong
+    place, or with its columns moved, is rejected before it is read in full.
+    """
+
+    try:
+        header, rows = ingest.read_sample(report, max(columns.values()) + 1)
+    except ValueError as e:
+        raise ReportError(f"{e}. Please check the {report_type} report.")
+    problems = ingest.check_layout(
+        header, rows, columns, headers, layout_checks(columns, dtypes or {})
+    )
+    if problems:
+        raise ReportError(
+            f"The {report_type} report does not have the expected layout: "
+            f"{'; '.join(problems)}. Please check that it is a "
+            f"{report_type} report, uploaded in the right place."
+        )
+
+    try:
+        return ingest.read_report(report, columns)
+    except ValueError as e:
+        raise ReportError(f"{e}. Please check the {report_type} report.")
+
+
+def clean_flags(
+    df: pd.DataFrame, columns: List[str], report_type: str
+) -> pd.DataFrame:
+    """
+    The yes/no columns of a report as booleans. Only a sample of rows is
+    checked when the report is read, so every value is checked here to be Y,
+    N or blank first.
+    """
+
+    problems = []
+    for col in columns:
+        values = df[col]
+        invalid = values[values.notna() & ~values.isin(ingest.FLAG_VALUES)]
+        if not invalid.empty:
+            examples = ", ".join(
+                f'"{value}"' for value in invalid.unique()[:5]
+            )
+            problems.append(f"{col.title()} ({examples})")
+    if problems:
+        raise ReportError(
+            f"Only Y, N or blank are expected in {'; '.join(problems)}. "
+            f"Please check the {report_type} report."
+        )
+
+    return pw.clean_booleans(df[columns])
+
+
+def layout_checks(
+    columns: Dict[str, int], dtypes: Dict[str, str]
+) -> Dict[str, Callable[[Any], bool]]:
+    """Checks on the values of the yes/no and numeric columns of a report."""
+
+    checks = {}
+    for col in columns:
+        if dtypes.get(col) == pw.BOOLEAN:
+            checks[col] = ingest.is_flag
+        elif col in ingest.REPORT_DTYPES:
+            checks[col] = ingest.is_number
+
+    return checks
+
+
+@timed
+def load_and_clean_reports(
+    teams_report: BinaryIO,
+    team_members_report: BinaryIO,
+    community_members_report: Union[None, BinaryIO],
+    pw_config: Dict,
+    check_memory: CheckMemory = None,
+) -> Tuple[pd.DataFrame, pd.DataFrame, Union[None, pd.DataFrame]]:
+    """
+    Load and clean each report in turn, checking memory after each if
+    check_memory is given.
+    """
+
+    frames, parsed = {}, []
+
+    def loaded(name: str, df: pd.DataFrame, report: BinaryIO) -> pd.DataFrame:
+        frames[name] = df
+        parsed.append(report)
+        if check_memory is not None:
+            check_memory(frames, parsed)
+        return df
+
+    df_teams = loaded(
+        "df_teams",
+        load_and_clean_teams_report(
+            teams_report,
+            pw_config["teams report columns"],
+            pw_config.get("teams report headers"),
+        ),
+        teams_report,
+    )
+    df_team_members = loaded(
+        "df_team_members",
+        load_and_clean_team_members_report(
+            team_members_report,
+            pw_config["team members report columns"],
+            pw_config.get("team members report headers"),
+        ),
+        team_members_report,
+    )
+    df_community_members = None
+    if community_members_report is not None:
+        df_community_members = loaded(
+            "df_community_members",
+            load_and_clean_community_members_report(
+                community_members_report,
+                pw_config["community members report columns"],
+                pw_config.get("community members report headers"),
+            ),
+            community_members_report,
+        )
+
+    return df_teams, df_team_members, df_community_members
+
+
+@timed
+def preprocess_reports(
+    teams_report: BinaryIO,
+    team_members_report: BinaryIO,
+    community_members_report: Union[None, BinaryIO],
+    pw_config: Dict,
+    check_memory: CheckMemory = None,
+) -> Dict:
+    """
+    Load and clean the Playwaze reports and move coxes into the team members
+    report, along with any coxes that could not be matched to a member.
+
+    check_memory, if given, is called between the stages with the frames made
+    so far and the reports that have been parsed, which aren't read again, so
+    that memory can be freed before the next stage adds to it.
+    """
+
+    df_teams, df_team_members, df_community_members = load_and_clean_reports(
+        teams_report,
+        team_members_report,
+        community_members_report,
+        pw_config,
+        check_memory,
+    )
+    df_crew_digests = incremental.crew_digests(df_teams, df_team_members)
+    check_stage(
+        check_memory,
+        df_teams,
+        df_team_members,
+        df_community_members,
+        df_crew_digests,
+    )
+    df_team_members, df_cox_issues = pw.resolve_coxes(
+        df_teams, df_team_members, df_community_members
+    )
+    df_teams = df_teams.drop(pw.COL_COX_NAME, axis=1)
+    # remove coxes from the teams report now that they are in team_members
+
+    return {
+        "df_teams": df_teams,
+        "df_team_members": df_team_members,
+        "df_community_members": df_community_members,
+        "df_cox_issues": df_cox_issues,
+        "df_crew_digests": df_crew_digests,
+    }
+
+
+@timed
+def update_reports(
+    previous: Any,
+    teams_report: BinaryIO,
+    team_members_report: BinaryIO,
+    community_members_report: Union[None, BinaryIO],
+    pw_config: Dict,
+    check_memory: CheckMemory = None,
+) -> Dict:
+    """
+    As preprocess_reports, for newer versions of reports that have already
+    been preprocessed (previous, e.g. the ReportGraph of the older version).
+    Only the coxes of crews that have changed, or who might now match a
+    different member, are looked up again.
+    """
+
+    df_teams, df_team_members, df_community_members = load_and_clean_reports(
+        teams_report,
+        team_members_report,
+        community_members_report,
+        pw_config,
+        check_memory,
+    )
+    df_crew_digests = incremental.crew_digests(df_teams, df_team_members)
+    check_stage(
+        check_memory,
+        df_teams,
+        df_team_members,
+        df_community_members,
+        df_crew_digests,
+    )
+    crews = incremental.changed_crews(
+        previous["df_crew_digests"], df_crew_digests
+    )
+
+    df_previous_members = previous["df_team_members"]
+    df_previous_coxes = df_previous_members[
+        ~incremental.member_rows(df_previous_members)
+    ]
+    df_previous_issues = previous["df_cox_issues"]
+    df_coxes = pw.get_cox_entries(df_teams).reset_index(drop=True)
+
+    # coxes are matched on name to the community members, or if there isn't a
+    # community members report, the team members. Coxes in unchanged crews
+    # keep their details unless members with the same or a similar name have
+    # changed.
+    if incremental.frames_differ(
+        previous["df_community_members"], df_community_members
+    ):
+        redo = pd.Series(True, index=df_coxes.index)
+    else:
+        redo = df_coxes[pw.COL_CREW_ID].isin(crews) | ~df_coxes[
+            pw.COL_CREW_ID
+        ].isin(df_previous_coxes[pw.COL_CREW_ID])
+        # coxes that weren't found by name may now match a similar name
+        redo |= df_coxes[pw.COL_CREW_ID].isin(
+            df_previous_issues[pw.COL_CREW_ID]
+        )
+        if df_community_members is None:
+            df_changed = pd.concat(
+                [
+                    df.loc[
+                        incremental.changed_members(df, crews).index,
+                        [pw.COL_NAME, pw.COL_PRIMARY_CLUB],
+                    ].astype(object)
+                    for df in (df_previous_members, df_team_members)
+                ]
+            )
+            # members with the same or a similar name
+            redo |= name_matching.shares_keys(
+                df_coxes[pw.COL_NAME],
+                df_coxes[pw.COL_CLUB],
+                df_changed[pw.COL_NAME],
+                df_changed[pw.COL_PRIMARY_CLUB],
+            )
+
+    # look up the changed coxes, among all the members as they may match a
+    # similar name
+    df_members = (
+        df_team_members
+        if df_community_members is None
+        else df_community_members
+    )
+    df_resolved, df_issues = pw.CoxResolver(df_members).resolve(df_coxes[redo])
+    df_resolved.index = df_coxes.index[redo]
+
+    # the rest are as they were
+    kept = df_coxes.loc[~redo, pw.COL_CREW_ID]
+    df_kept = df_previous_coxes.set_index(
+        df_previous_coxes[pw.COL_CREW_ID].astype(object)
+    ).loc[kept]
+    df_kept.index = kept.index
+    # without the categories of the previous version, e.g. removed crews
+    df_kept = df_kept.assign(
+        **{
+            col: df_kept[col].cat.remove_unused_categories()
+            for col in df_kept.select_dtypes(pw.CATEGORY).columns
+        }
+    )
+    df_kept_issues = df_previous_issues[
+        df_previous_issues[pw.COL_CREW_ID].isin(kept)
+    ]
+
+    # add the coxes to the team members, in the order of the teams report as
+    # preprocess_reports does
+    n_members = len(df_team_members)
+    df_team_members = pw.concat_in_schema(
+        [df_team_members, df_resolved, df_kept], pw.TEAM_MEMBER_DTYPES
+    )
+    cox_order = np.argsort(
+        np.concatenate([df_resolved.index, df_kept.index]), kind="stable"
+    )
+    df_team_members = df_team_members.iloc[
+        np.concatenate([np.arange(n_members), n_members + cox_order])
+    ]
+
+    df_cox_issues = pd.concat([df_issues, df_kept_issues])
+    df_cox_issues = df_cox_issues.iloc[
+        np.argsort(
+            pd.Index(df_coxes[pw.COL_CREW_ID]).get_indexer(
+                df_cox_issues[pw.COL_CREW_ID]
+            ),
+            kind="stable",
+        )
+    ].reset_index(drop=True)
+
+    return {
+        "df_teams": df_teams.drop(pw.COL_COX_NAME, axis=1),
+        "df_team_members": df_team_members,
+        "df_community_members": df_community_members,
+        "df_cox_issues": df_cox_issues,
+        "df_crew_digests": df_crew_digests,
+    }
+
+
+def preprocess_reports_cached(
+    teams_report: BinaryIO,
+    team_members_report: BinaryIO,
+    community_members_report: Union[None, BinaryIO],
+    pw_config: Dict,
+    disk_cache: Union[None, ParquetCache] = None,
+    previous: Any = None,
+    check_memory: CheckMemory = None,
+) -> Dict:
+    """
+    Preprocess the reports, or load the frames from the disk cache if the
+    same reports have already been preprocessed with the same config. With
+    the preprocessed previous version of the reports, only what has changed
+    is processed again.
+    """
+
+    def preprocess() -> Dict:
+        if previous is not None:
+            return update_reports(
+                previous,
+                teams_report,
+                team_members_report,
+                community_members_report,
+                pw_config,
+                check_memory,
+            )
+        return preprocess_reports(
+            teams_report,
+            team_members_report,
+            community_members_report,
+            pw_config,
+            check_memory,
+        )
+
+    if disk_cache is None:
+        return preprocess()
+
+    key = hash_reports(
+        teams_report,
+        team_members_report,
+        community_members_report,
+        config=pw_config,
+    )
+    return disk_cache.get_or_compute(key, preprocess)
+
+
+def check_stage(
+    check_memory: Union[None, CheckMemory],
+    df_teams: pd.DataFrame,
+    df_team_members: pd.DataFrame,
+    df_community_members: Union[None, pd.DataFrame],
+    df_crew_digests: pd.DataFrame,
+) -> None:
+    """Check memory once the reports are loaded and their crews digested,
+    before the coxes are added to the team members."""
+
+    if check_memory is None:
+        return
+    check_memory(
+        {
+            "df_teams": df_teams,
+            "df_team_members": df_team_members,
+            "df_community_members": df_community_members,
+            "df_crew_digests": df_crew_digests,
+        },
+        [],
+    )
+
+
+def get_stats(
+    df_teams: pd.DataFrame,
+    df_team_members: pd.DataFrame,
+    df_boat_classes: pd.DataFrame = None,
+) -> Dict[str, int]:
+    """Gather the headline stats for an event."""
+
+    total_seats, filled_seats = pw.count_num_seats(df_teams, df_boat_classes)
+
+    return {
+        "Entries": pw.count_num_entries(df_teams),
+        "Total Seats (excludes coxes)": total_seats,
+        "Filled Seats (excludes coxes)": filled_seats,
+        "Unique Rowers (includes coxes)": pw.count_unique_rowers(
+            df_team_members
+        ),
+    }
@@ -1,7 +1,10 @@
 import pandas as pd
 import numpy as np
-from typing import List, Union
-import re
+from typing import Dict, List, Tuple, Union
+import playwaze_rowing_reports.boat_classes as boat_classes
+import playwaze_rowing_reports.name_matching as name_matching
+import playwaze_rowing_reports.strings as strings
+from playwaze_rowing_reports.instrumentation import timed
 
 # column names for reports for convenience in code. The strings should match
 # that in the playwaze config file.
@@ -91,11 +94,54 @@ COMMUNITY_MEMBER_COLUMNS = [
 COL_POSITION = "position"
 COL_COMPOSITE = "composite"
 
-REPORT_FILE_TYPE = "xlsx"  # file type of uploaded reports
+# dtypes of the cleaned reports. Columns that repeat a small set of values are
+# categorical, Y/N flags are nullable booleans and SR numbers are integers.
+CATEGORY = "category"
+BOOLEAN = "boolean"
+SR_NUMBER_DTYPE = "Int64"
+
+TEAM_DTYPES = {
+    COL_BOAT_TYPE: CATEGORY,
+    COL_CLUB: CATEGORY,
+    COL_CREW_LETTER: CATEGORY,
+    COL_SEATS: "Int64",
+    COL_VERIFIED: BOOLEAN,
+    COL_CAPTAIN: BOOLEAN,
+    COL_COX: BOOLEAN,
+    COL_COMPOSITE: BOOLEAN,
+}
+
+TEAM_MEMBER_DTYPES = {
+    COL_BOAT_TYPE: CATEGORY,
+    COL_CLUB: CATEGORY,
+    COL_CREW_ID: CATEGORY,
+    COL_CREW_LETTER: CATEGORY,
+    COL_CREW_NAME: CATEGORY,
+    COL_GENDER: CATEGORY,
+    COL_SR_NUMBER: SR_NUMBER_DTYPE,
+    COL_MEMBERSHIP_TYPE: CATEGORY,
+    COL_ROW_NOVICE: BOOLEAN,
+    COL_SCULL_NOVICE: BOOLEAN,
+    COL_PRIMARY_CLUB: CATEGORY,
+    COL_POSITION: CATEGORY,
+}
+
+COMMUNITY_MEMBER_DTYPES = {
+    COL_GENDER: CATEGORY,
+    COL_SR_NUMBER: SR_NUMBER_DTYPE,
+    COL_MEMBERSHIP_TYPE: CATEGORY,
+    COL_ROW_NOVICE: BOOLEAN,
+    COL_SCULL_NOVICE: BOOLEAN,
+    COL_PRIMARY_CLUB: CATEGORY,
+}
+
+# file types of uploaded reports, the format is detected from the contents
+REPORT_FILE_TYPES = ["xlsx", "csv", "json"]
 
 COMPOSITE_STRING = "(composite)"  # string used to indicate a composite crew
 
 
+@timed
 def cleanup_report_columns(
     df: pd.DataFrame, column_numbers: List[int], column_names: List[str]
 ) -> pd.DataFrame:
@@ -106,48 +152,280 @@ def cleanup_report_columns(
     return df
 
 
+@timed
+def apply_schema(df: pd.DataFrame, dtypes: Dict[str, str]) -> pd.DataFrame:
+    """Set the dtypes of the columns in the schema that are in df."""
+
+    changed = {
+        col: dtype
+        for col, dtype in dtypes.items()
+        if col in df.columns and df[col].dtype != dtype
+    }
+    return df.astype(changed) if changed else df
+
+
+@timed
+def concat_in_schema(
+    frames: List[pd.DataFrame], dtypes: Dict[str, str]
+) -> pd.DataFrame:
+    """
+    Concatenate frames in the schema. Categorical columns are given the same
+    categories first, so they stay categorical rather than becoming objects.
+    """
+
+    frames = [apply_schema(df, dtypes) for df in frames]
+    categories = {}
+    for col, dtype in dtypes.items():
+        if dtype != CATEGORY or not all(col in df.columns for df in frames):
+            continue
+        categories[col] = frames[0][col].cat.categories
+        for df in frames[1:]:
+            categories[col] = categories[col].union(df[col].cat.categories)
+
+    # set all the categories at once, so each frame is only copied once
+    frames = [
+        df.assign(
+            **{
+                col: df[col].cat.set_categories(col_categories)
+                for col, col_categories in categories.items()
+            }
+        )
+        for df in frames
+    ]
+
+    return pd.concat(frames)
+
+
+@timed
 def clean_booleans(df: pd.DataFrame) -> pd.DataFrame:
     """Replaces Y, N and nan with True/False"""
 
     df = df.replace({"Y": True, np.nan: False, "N": False})
-    return df.astype(bool)
+    return df.astype(BOOLEAN)
 
 
+@timed
 def clean_composites(
     df: pd.DataFrame, set_composite_flag: bool = True
 ) -> pd.DataFrame:
     """
     Removes the '(composite)' tag from the club name, optionally adds a
-    boolean composite column
+    boolean composite column. Returns a new dataframe.
     """
 
+    columns = {}
+
     # add a composite column, set to True if the crew is a composite
     if set_composite_flag:
-        df[COL_COMPOSITE] = False
-
-        bool_composite_crew = df[COL_CLUB].str.contains(
-            re.escape(COMPOSITE_STRING), regex=True
+        columns[COL_COMPOSITE] = strings.contains(
+            df[COL_CLUB], COMPOSITE_STRING
         )  # boolean array showing crews that are composites
 
-        df.loc[bool_composite_crew, COL_COMPOSITE] = True
-
     # remove the composite tag in the club name
-    df[COL_CLUB] = df[COL_CLUB].replace(
-        re.escape(f" {COMPOSITE_STRING}"), "", regex=True
-    )
+    columns[COL_CLUB] = strings.remove(df[COL_CLUB], f" {COMPOSITE_STRING}")
 
-    return df
+    return df.assign(**columns)
 
 
+@timed
 def assign_rower_position(df):
     """Assign a unique position (number) to rowers in each crew"""
 
-    df["position"] = df.groupby(COL_CREW_ID).cumcount()
-    df["position"] = df["position"] + 1  # index from 1
+    position = df.groupby(COL_CREW_ID).cumcount() + 1  # index from 1
+
+    return position.astype(str).rename(COL_POSITION)
+
+
+# member details looked up for each cox
+COX_DETAIL_COLUMNS = [
+    COL_SR_NUMBER,
+    COL_GENDER,
+    COL_DOB,
+    COL_MEMBERSHIP_TYPE,
+    COL_EXPIRY,
+    COL_PRIMARY_CLUB,
+    COL_ADDITIONAL_CLUBS,
+    COL_FIRST_LICENCE,
+    COL_COMPOSITE_CLUBS,
+    COL_ROW_NOVICE,
+    COL_SCULL_NOVICE,
+    COL_ROW_POINTS,
+    COL_SCULL_POINTS,
+]
+
+COX_POSITION = "C"  # position of coxes in the team members report
+
+# reasons a cox could not be resolved to a single member
+COX_UNNAMED = "no name"
+COX_UNMATCHED = "unmatched"
+COX_AMBIGUOUS = "ambiguous"
+COX_SIMILAR = "similar name"  # matched by a similar name, to be checked
+COL_ISSUE = "issue"
+COL_CANDIDATES = "candidates"
+# 1 for coxes matched by name, less for those matched by a similar name
+COL_MATCH_CONFIDENCE = "match confidence"
+COL_MATCHED_NAME = "matched name"
 
-    return df["position"].astype(str)
 
+class CoxResolver:
+    """
+    Resolves coxes named in a teams report to their member details.
+
+    An index of members keyed by name is built once from the member source.
+    Rows for the same person (same name and SR number) are collapsed, and
+    where a name is shared by several people, the one belonging to the cox's
+    club is chosen. Coxes whose name nobody has are matched to somebody with
+    a similar name (see name_matching), with the confidence of the match.
+    Coxes that still match several people, or nobody, are left without
+    details and reported instead, along with the similar name matches.
+    """
+
+    @timed
+    def __init__(self, df_members: pd.DataFrame):
+
+        # one row per person, worked out on the keys before taking any rows
+        people = np.flatnonzero(
+            df_members[COL_NAME].notnull()
+            & ~df_members.duplicated(subset=[COL_NAME, COL_SR_NUMBER])
+        )
+        shared = (
+            df_members[COL_NAME].iloc[people].duplicated(keep=False).values
+        )
+        columns = df_members.columns.get_indexer(
+            [COL_NAME] + COX_DETAIL_COLUMNS
+        )
+
+        # names that belong to a single person, looked up by hash
+        self.df_unique = df_members.iloc[people[~shared], columns]
+        self.df_unique = self.df_unique.reset_index(drop=True)
+        self.unique_names = pd.Index(self.df_unique[COL_NAME])
+        # names shared by several people, told apart by club
+        self.df_shared = df_members.iloc[people[shared], columns]
+        self.df_shared = self.df_shared.reset_index(drop=True)
+        self.matcher = None  # built the first time a name isn't found
+
+    def get_matcher(self) -> name_matching.NameMatcher:
+        """Get the fuzzy matcher of every person, building it if needed."""
+
+        if self.matcher is None:
+            self.df_people = pd.concat(
+                [self.df_unique, self.df_shared], ignore_index=True
+            )
+            self.matcher = name_matching.NameMatcher(
+                self.df_people[COL_NAME],
+                self.df_people[COL_PRIMARY_CLUB],
+                self.df_people[COL_ADDITIONAL_CLUBS],
+            )
+        return self.matcher
+
+    @timed
+    def resolve(
+        self, df_coxes: pd.DataFrame
+    ) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        """
+        Look up the details of every cox in one pass. Returns the coxes with
+        their details, and the coxes that could not be resolved with the
+        reason why.
+        """
+
+        df_coxes = df_coxes.reset_index(drop=True)
+        num_candidates = pd.Series(0, index=df_coxes.index)
+
+        # coxes whose name belongs to a single person
+        positions = self.unique_names.get_indexer(df_coxes[COL_NAME])
+        unique = positions >= 0
+        num_candidates[unique] = 1
+        df_details = self.df_unique.iloc[positions[unique]].set_index(
+            df_coxes.index[unique]
+        )
 
+        # coxes whose name is shared, by club
+        shared = df_coxes[COL_NAME].isin(self.df_shared[COL_NAME])
+        if shared.any():
+            df_candidates = pd.merge(
+                df_coxes.loc[shared, [COL_NAME, COL_CLUB]]
+                .rename_axis("cox")
+                .reset_index(),
+                self.df_shared,
+                on=COL_NAME,
+                how="inner",
+            )
+            club_match = name_matching.is_in_club(
+                df_candidates[COL_CLUB],
+                df_candidates[COL_PRIMARY_CLUB],
+                df_candidates[COL_ADDITIONAL_CLUBS],
+            )
+            num_club_matches = (
+                pd.Series(club_match).groupby(df_candidates["cox"]).sum()
+            )
+            num_candidates[num_club_matches.index] = num_club_matches.where(
+                num_club_matches > 0,
+                df_candidates.groupby("cox").size(),
+            )
+            df_matches = df_candidates[club_match]
+            df_matches = df_matches[
+                (num_candidates.loc[df_matches["cox"]] == 1).values
+            ]
+            df_details = pd.concat([df_details, df_matches.set_index("cox")])
+
+        confidence = pd.Series(
+            np.where(num_candidates == 1, 1.0, np.nan), index=df_coxes.index
+        )
+        matched_names = pd.Series(None, index=df_coxes.index, dtype=object)
+
+        # coxes whose name nobody has, by a similar name
+        unmatched = (num_candidates == 0) & df_coxes[COL_NAME].notnull()
+        if unmatched.any():
+            df_similar = self.get_matcher().match(
+                df_coxes.loc[unmatched, COL_NAME],
+                df_coxes.loc[unmatched, COL_CLUB],
+            )
+            num_candidates[df_similar.index] = df_similar[
+                name_matching.COL_CANDIDATES
+            ]
+            df_similar = df_similar[
+                df_similar[name_matching.COL_CANDIDATES] == 1
+            ]
+            df_people = self.df_people.iloc[
+                df_similar[name_matching.COL_PERSON]
+            ].set_index(df_similar.index)
+            df_details = pd.concat([df_details, df_people])
+            confidence[df_similar.index] = df_similar[
+                name_matching.COL_CONFIDENCE
+            ]
+            matched_names[df_similar.index] = df_people[COL_NAME]
+
+        # add the details of resolved coxes
+        df_resolved = df_coxes.join(df_details[COX_DETAIL_COLUMNS])
+
+        # names that only differ in case or spacing don't need checking
+        similar = matched_names.notnull() & (confidence < 1)
+        df_issues = df_coxes.assign(
+            **{
+                COL_CANDIDATES: num_candidates,
+                COL_MATCH_CONFIDENCE: confidence,
+                COL_MATCHED_NAME: matched_names,
+            }
+        )
+        df_issues = df_issues[(num_candidates != 1) | similar]
+        df_issues = df_issues.assign(
+            **{
+                COL_ISSUE: np.select(
+                    [
+                        df_issues[COL_NAME].isnull(),
+                        df_issues[COL_CANDIDATES] == 0,
+                        df_issues[COL_CANDIDATES] == 1,
+                    ],
+                    [COX_UNNAMED, COX_UNMATCHED, COX_SIMILAR],
+                    COX_AMBIGUOUS,
+                )
+            }
+        )
+
+        return df_resolved, df_issues.reset_index(drop=True)
+
+
+@timed
 def get_coxes(
     df_teams: pd.DataFrame,
     df_team_members: pd.DataFrame,
@@ -159,7 +437,14 @@ def get_coxes(
     members dataframe
     """
 
-    # extract all coxes from the teams report
+    df_team_members, _ = resolve_coxes(df_teams, df_team_members, df_members)
+    return df_team_members
+
+
+@timed
+def get_cox_entries(df_teams: pd.DataFrame) -> pd.DataFrame:
+    """Extract all coxes from the teams report, as team members rows."""
+
     df_coxes = df_teams.loc[
         df_teams[COL_COX] == True,  # noqa E712
         [
@@ -171,62 +456,43 @@ def get_coxes(
             COL_BOAT_TYPE,
         ],
     ]
-    df_coxes[COL_POSITION] = "C"
-    df_coxes = df_coxes.rename(
+    return df_coxes.assign(**{COL_POSITION: COX_POSITION}).rename(
         columns={COL_COX_NAME: COL_NAME}
     )  # rename the name column to match the members df
 
+
+@timed
+def resolve_coxes(
+    df_teams: pd.DataFrame,
+    df_team_members: pd.DataFrame,
+    df_members: Union[None, pd.DataFrame] = None,
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    As get_coxes, but also returns the coxes that could not be matched to a
+    single member.
+    """
+
+    df_coxes = get_cox_entries(df_teams)
+
     # try and find their membership number if they are entered as a rower in
     # another crew
-    # if a community members report is not included, get a list of rowers from
-    # the team members report
+    # if a community members report is not included, look them up in the team
+    # members report. The resolver only indexes each rower once.
     if df_members is None:
-        df_members = get_unique_rowers(df_team_members)
+        df_members = df_team_members
 
     # look up cox details from the members report
-    df_coxes = pd.merge(
-        df_coxes,
-        df_members[
-            [
-                COL_NAME,
-                COL_SR_NUMBER,
-                COL_GENDER,
-                COL_DOB,
-                COL_MEMBERSHIP_TYPE,
-                COL_EXPIRY,
-                COL_PRIMARY_CLUB,
-                COL_ADDITIONAL_CLUBS,
-                COL_FIRST_LICENCE,
-                COL_COMPOSITE_CLUBS,
-                COL_ROW_NOVICE,
-                COL_SCULL_NOVICE,
-                COL_ROW_POINTS,
-                COL_SCULL_POINTS,
-            ]
-        ],
-        left_on=[COL_NAME],
-        right_on=[COL_NAME],
-        how="left",
-    )
+    df_coxes, df_cox_issues = CoxResolver(df_members).resolve(df_coxes)
 
     # add coxes to the rowers dataframe
-    df_team_members = df_team_members.append(df_coxes)
-
-    # somewhere above, membership number gets turned to an interger
-    # convert back to string
-    df_team_members[COL_SR_NUMBER] = df_team_members[COL_SR_NUMBER].fillna(
-        0
-    )  # remove NANs so can convert to string
-    df_team_members[COL_SR_NUMBER] = (
-        df_team_members[COL_SR_NUMBER].astype(int).astype(str)
+    df_team_members = concat_in_schema(
+        [df_team_members, df_coxes], TEAM_MEMBER_DTYPES
     )
-    df_team_members.loc[
-        df_team_members[COL_SR_NUMBER] == "0", COL_SR_NUMBER
-    ] = np.nan  # convet back to nan
 
-    return df_team_members
+    return df_team_members, df_cox_issues
 
 
+@timed
 def get_unique_rowers(df_team_members: pd.DataFrame):
     """Get a unique list of rowers from a Playwaze team members report"""
 
@@ -236,24 +502,29 @@ def get_unique_rowers(df_team_members: pd.DataFrame):
     return df_unique_members
 
 
+@timed
 def count_num_entries(df_teams: pd.DataFrame) -> int:
     """Count the number of entries from a Playwaze teams report."""
     return df_teams[COL_CREW_ID].count()
 
 
-def count_num_seats(df_teams: pd.DataFrame) -> int:
+@timed
+def count_num_seats(
+    df_teams: pd.DataFrame, df_boat_classes: pd.DataFrame = None
+) -> int:
     """
     Count the number of seats (excluding coxes, total and filled) from a
-    Playwaze teams report.
+    Playwaze teams report. Crews whose boat type doesn't name a boat class
+    have no seats in the total.
     """
     filled_seats = df_teams[COL_SEATS].sum()
-    re_boat = r"([1248])[x\-\+][\+]?"
-    total_seats = (
-        df_teams[COL_BOAT_TYPE].str.extract(re_boat).astype(int)
-    ).sum()[0]
+    total_seats = boat_classes.lookup(
+        df_teams[COL_BOAT_TYPE], boat_classes.COL_BOAT_SEATS, df_boat_classes
+    ).sum()
     return total_seats, filled_seats
 
 
+@timed
 def count_unique_rowers(df_team_members: pd.DataFrame) -> int:
     """Count the number of unique rowers and coxes in the event."""
 
@@ -263,6 +534,7 @@ def count_unique_rowers(df_team_members: pd.DataFrame) -> int:
     ].count()
 
 
+@timed
 def get_pivoted_team_members_report(
     df_team_members: pd.DataFrame, df_teams: pd.DataFrame
 ) -> pd.DataFrame:
@@ -288,65 +560,15 @@ def get_pivoted_team_members_report(
     return df
 
 
-def get_events_report(df_teams: pd.DataFrame) -> pd.DataFrame:
-    return (df_teams.groupby(COL_BOAT_TYPE).count())[COL_CREW_ID].rename(
-        "Entries"
-    )
-
-
-def get_clubs_report(
-    df_teams: pd.DataFrame, df_team_members: pd.DataFrame
-) -> pd.DataFrame:
-
-    # count entries by club
-    df_entries_by_club_count = (df_teams.groupby(by=COL_CLUB))[
-        COL_CREW_ID
-    ].count()
-
-    # count rowers by club. squeeze: force into a series
-    df_rowers_by_club_count = (
-        (
-            df_team_members[
-                df_team_members.duplicated(subset=COL_SR_NUMBER) == False  # noqa E712
-            ].sort_values(by=COL_CLUB)
-        )[[COL_CLUB, COL_SR_NUMBER]]
-        .groupby(COL_CLUB)
-        .count()
-        .squeeze()
-        .rename("rowers")
-    )
-
-    # count seats by club
-    df_seats_by_club_count = (df_teams.groupby(by=COL_CLUB).sum())[
-        COL_SEATS
-    ].rename("seats")
-
-    # merge all the dataframes together
-    df = pd.merge(
-        df_entries_by_club_count,
-        df_rowers_by_club_count,
-        left_index=True,
-        right_index=True,
-        how="left",
-    )
-    df = pd.merge(
-        df,
-        df_seats_by_club_count,
-        left_index=True,
-        right_index=True,
-        how="left",
-    )
-
-    return df
-
-
+@timed
 def get_rowers_report(df_team_members: pd.DataFrame) -> pd.DataFrame:
 
     df = df_team_members[[COL_SR_NUMBER, COL_NAME, COL_CREW_NAME, COL_CLUB]]
-    df["idx"] = df.groupby(
-        COL_SR_NUMBER
-    ).cumcount()  # uniquely number each crew each rower is in
-    df["idx"] = df["idx"] + 1  # index from 1
+    # uniquely number each crew each rower is in, from 1. Rowers without an
+    # SR number are told apart by name
+    df = df.assign(
+        idx=df.groupby([COL_SR_NUMBER, COL_NAME], dropna=False).cumcount() + 1
+    )
     df = (
         df.pivot(
             index=[COL_SR_NUMBER, COL_NAME, COL_CLUB],
@@ -360,18 +582,18 @@ def get_rowers_report(df_team_members: pd.DataFrame) -> pd.DataFrame:
     return df
 
 
+@timed
 def get_COFD_report(df_team_members: pd.DataFrame) -> pd.DataFrame:
 
-    df = df_team_members
-    df[["first name", "surname"]] = df[COL_NAME].str.split(
-        " ", 1, expand=True
+    first_names, surnames = strings.split_once(
+        df_team_members[COL_NAME], " "
     )  # seperate first name and surname
-    df = df[
+    # select the columns before adding the names, so only they are copied,
+    # and the team members report, which may be cached, isn't modified
+    df = df_team_members[
         [
             COL_BOAT_TYPE,
             COL_CLUB,
-            "first name",
-            "surname",
             COL_PRIMARY_CLUB,
             COL_SR_NUMBER,
             COL_POSITION,
@@ -379,5 +601,7 @@ def get_COFD_report(df_team_members: pd.DataFrame) -> pd.DataFrame:
             COL_CREW_LETTER,
         ]
     ]
+    df.insert(2, "first name", first_names)
+    df.insert(3, "surname", surnames)
 
     return df.reset_index(drop=True)
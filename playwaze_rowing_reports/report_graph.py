@@ -0,0 +1,367 @@
+import functools
+import threading
+from typing import Any, Callable, Dict, Hashable, List, Tuple
+import pandas as pd
+import playwaze_rowing_reports.playwaze_reports as pw
+import playwaze_rowing_reports.pipeline as pipeline
+import playwaze_rowing_reports.incremental as incremental
+import playwaze_rowing_reports.boat_classes as boat_classes
+import playwaze_rowing_reports.aggregation as aggregation
+import playwaze_rowing_reports.conflicts as conflicts
+import playwaze_rowing_reports.export as export
+import playwaze_rowing_reports.instrumentation as instrumentation
+
+# inputs to the graph, as returned by pipeline.preprocess_reports
+DF_TEAMS = "df_teams"
+DF_TEAM_MEMBERS = "df_team_members"
+DF_COMMUNITY_MEMBERS = "df_community_members"
+DF_COX_ISSUES = "df_cox_issues"
+DF_CREW_DIGESTS = "df_crew_digests"
+# crews changed since the previous version, if the graph was given one
+DF_CHANGES = "df_changes"
+
+# the boat class of each boat type in the teams report
+BOAT_CLASSES = "boat classes"
+# every statistic of each event and each club, that summary reports are
+# laid out from
+EVENT_SUMMARY = "event summary"
+CLUB_SUMMARY = "club summary"
+
+# derived reports
+STATS = "stats"
+ENTRIES = "entries"
+CREW_LIST = "crew list"
+EVENTS = "events"
+CLUBS = "clubs"
+ROWERS = "rowers"
+COFD = "cofd"
+CONFLICTS = "conflicts"
+
+# nodes only used to derive other reports, that can be released to save
+# memory (the boat classes are kept, as they are shown on every run)
+INTERMEDIATES = (EVENT_SUMMARY, CLUB_SUMMARY)
+
+# every derived node: name -> (function, names of the nodes it depends on)
+NODES: Dict[str, Tuple[Callable, Tuple[str, ...]]] = {}
+# nodes that can be updated from the previous version of the reports:
+# name -> (function, names of the nodes it depends on). The function is given
+# the node's previous value and the changes, then the dependencies.
+UPDATERS: Dict[str, Tuple[Callable, Tuple[str, ...]]] = {}
+
+_MISSING = object()  # a value that hasn't been computed, or was released
+
+
+def node(name: str, *dependencies: str) -> Callable:
+    """Register a function as a node in the report graph."""
+
+    def register(func: Callable) -> Callable:
+        NODES[name] = (func, dependencies)
+        return func
+
+    return register
+
+
+def updater(name: str, *dependencies: str) -> Callable:
+    """Register a function that updates a node from its previous value."""
+
+    def register(func: Callable) -> Callable:
+        UPDATERS[name] = (func, dependencies)
+        return func
+
+    return register
+
+
+class ReportGraph:
+    """
+    Lazily computes the derived reports for one version of the cleaned
+    reports. Each node is only computed when it, or a node that depends on
+    it, is requested, and is then memoized for the life of the graph.
+
+    Given the graph of the previous version of the reports, the crews that
+    have changed are listed, and nodes with an updater that had been
+    computed for the previous version are updated rather than recomputed.
+    """
+
+    def __init__(self, inputs: Dict[str, Any], previous: "ReportGraph" = None):
+
+        self._results = dict(inputs)
+        self._memo = {}  # other values derived from this version, e.g. exports
+        self._sizes = {}  # deep memory of each value held, once measured
+        self._lock = threading.RLock()  # graphs are shared between sessions
+        # each node is computed under its own lock, so different nodes can
+        # be computed at once, e.g. by export.write_zip's workers. Nodes are
+        # locked in the order they depend on each other, so never deadlock.
+        self._node_locks = {}
+
+        # only the previous values are kept, not the previous graph, so that
+        # versions aren't chained together in memory
+        self._previous = {}
+        if previous is not None:
+            self._results[DF_CHANGES] = incremental.get_changes(
+                previous, inputs
+            )
+            self._previous = {
+                name: previous[name]
+                for name in UPDATERS
+                if previous.is_computed(name)
+            }
+
+    def __getitem__(self, name: str) -> Any:
+        return self.get(name)
+
+    def get(self, name: str) -> Any:
+
+        # looked up once, as another session may release the node between
+        # checking for it and taking it
+        value = self._results.get(name, _MISSING)
+        if value is not _MISSING:
+            return value
+
+        with self._lock:
+            node_lock = self._node_locks.setdefault(name, threading.Lock())
+
+        with node_lock:
+            value = self._results.get(name, _MISSING)
+            if value is _MISSING:  # may have been computed meanwhile
+                # popped at once, as release may clear the previous values
+                previous = self._previous.pop(name, _MISSING)
+                if previous is not _MISSING:
+                    func, dependencies = UPDATERS[name]
+                    args = (previous, self.get(DF_CHANGES))
+                else:
+                    func, dependencies = NODES[name]
+                    args = ()
+                value = self._results[name] = func(
+                    *args,
+                    *(self.get(dependency) for dependency in dependencies),
+                )
+
+        return value
+
+    def is_computed(self, name: str) -> bool:
+        return name in self._results
+
+    def memoize(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        """
+        Compute a value derived from this version of the reports once, such
+        as the bytes of an export, and keep it for the life of the graph.
+        """
+
+        value = self._memo.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+
+        with self._lock:
+            value = self._memo.get(key, _MISSING)
+            if value is _MISSING:
+                value = self._memo[key] = compute()
+
+        return value
+
+    def is_memoized(self, key: Hashable) -> bool:
+        return key in self._memo
+
+    def memory_usage(self) -> int:
+        """
+        Deep memory in bytes of the frames and exports held by the graph.
+        Values are never modified, so each is only measured once.
+        """
+
+        # copied before iterating, as other sessions may be adding to them
+        held = [
+            (("node", name), value)
+            for name, value in list(self._results.items())
+        ]
+        held += [
+            (("memo", key), value) for key, value in list(self._memo.items())
+        ]
+        held += [
+            (("previous", name), value)
+            for name, value in list(self._previous.items())
+        ]
+        total = 0
+        for key, value in held:
+            if key not in self._sizes:
+                self._sizes[key] = instrumentation.memory_usage(value)
+            total += self._sizes[key]
+
+        return total
+
+    def release(self) -> int:
+        """
+        Drop everything that can be derived again when it is next requested:
+        the memoized exports and layouts, the intermediate nodes, and previous
+        values that were never used to update a node. Returns the bytes
+        released.
+        """
+
+        with self._lock:
+            before = self.memory_usage()
+            self._memo.clear()
+            self._previous.clear()
+            for name in INTERMEDIATES:
+                self._results.pop(name, None)
+            self._sizes = {
+                key: size
+                for key, size in self._sizes.items()
+                if key[0] == "node" and key[1] in self._results
+            }
+            return before - self.memory_usage()
+
+
+@node(BOAT_CLASSES, DF_TEAMS)
+def get_boat_classes(df_teams: pd.DataFrame) -> pd.DataFrame:
+    return boat_classes.get_boat_classes(df_teams[pw.COL_BOAT_TYPE])
+
+
+@node(STATS, DF_TEAMS, DF_TEAM_MEMBERS, BOAT_CLASSES)
+def get_stats(
+    df_teams: pd.DataFrame,
+    df_team_members: pd.DataFrame,
+    df_boat_classes: pd.DataFrame,
+) -> Dict[str, int]:
+    return pipeline.get_stats(df_teams, df_team_members, df_boat_classes)
+
+
+@node(ENTRIES, DF_TEAMS)
+def get_entries(df_teams: pd.DataFrame) -> pd.DataFrame:
+    return df_teams
+
+
+@node(CREW_LIST, DF_TEAM_MEMBERS, DF_TEAMS)
+def get_crew_list(
+    df_team_members: pd.DataFrame, df_teams: pd.DataFrame
+) -> pd.DataFrame:
+    return pw.get_pivoted_team_members_report(df_team_members, df_teams)
+
+
+@node(EVENT_SUMMARY, DF_TEAMS, DF_TEAM_MEMBERS, BOAT_CLASSES)
+def get_event_summary(
+    df_teams: pd.DataFrame,
+    df_team_members: pd.DataFrame,
+    df_boat_classes: pd.DataFrame,
+) -> pd.DataFrame:
+    # rowers in several events are counted in each of them
+    return aggregation.summarise(
+        df_teams,
+        df_team_members,
+        pw.COL_BOAT_TYPE,
+        df_boat_classes,
+        per_group=True,
+    )
+
+
+@updater(EVENT_SUMMARY, DF_TEAMS, DF_TEAM_MEMBERS, BOAT_CLASSES)
+def update_event_summary(
+    previous: pd.DataFrame,
+    df_changes: pd.DataFrame,
+    df_teams: pd.DataFrame,
+    df_team_members: pd.DataFrame,
+    df_boat_classes: pd.DataFrame,
+) -> pd.DataFrame:
+    return aggregation.update_summary(
+        previous,
+        df_changes,
+        df_teams,
+        df_team_members,
+        pw.COL_BOAT_TYPE,
+        df_boat_classes,
+        per_group=True,
+    )
+
+
+@node(CLUB_SUMMARY, DF_TEAMS, DF_TEAM_MEMBERS, BOAT_CLASSES)
+def get_club_summary(
+    df_teams: pd.DataFrame,
+    df_team_members: pd.DataFrame,
+    df_boat_classes: pd.DataFrame,
+) -> pd.DataFrame:
+    return aggregation.summarise(
+        df_teams, df_team_members, pw.COL_CLUB, df_boat_classes
+    )
+
+
+@updater(CLUB_SUMMARY, DF_TEAMS, DF_TEAM_MEMBERS, BOAT_CLASSES)
+def update_club_summary(
+    previous: pd.DataFrame,
+    df_changes: pd.DataFrame,
+    df_teams: pd.DataFrame,
+    df_team_members: pd.DataFrame,
+    df_boat_classes: pd.DataFrame,
+) -> pd.DataFrame:
+    return aggregation.update_summary(
+        previous,
+        df_changes,
+        df_teams,
+        df_team_members,
+        pw.COL_CLUB,
+        df_boat_classes,
+    )
+
+
+@node(EVENTS, EVENT_SUMMARY)
+def get_events(df_event_summary: pd.DataFrame) -> pd.DataFrame:
+    return aggregation.layout_summary(
+        df_event_summary, aggregation.EVENTS_COLUMNS
+    )
+
+
+@node(CLUBS, CLUB_SUMMARY)
+def get_clubs(df_club_summary: pd.DataFrame) -> pd.DataFrame:
+    return aggregation.layout_summary(
+        df_club_summary, aggregation.CLUBS_COLUMNS
+    )
+
+
+@node(ROWERS, DF_TEAM_MEMBERS)
+def get_rowers(df_team_members: pd.DataFrame) -> pd.DataFrame:
+    return pw.get_rowers_report(df_team_members)
+
+
+@node(COFD, DF_TEAM_MEMBERS)
+def get_cofd(df_team_members: pd.DataFrame) -> pd.DataFrame:
+    return pw.get_COFD_report(df_team_members)
+
+
+@node(CONFLICTS, DF_TEAM_MEMBERS)
+def get_conflicts(df_team_members: pd.DataFrame) -> pd.DataFrame:
+    return conflicts.find_conflicts(df_team_members)
+
+
+# the reports that are shown as views and written as files
+REPORTS = (ENTRIES, CREW_LIST, EVENTS, CLUBS, ROWERS, COFD, CONFLICTS)
+
+# sort columns and index of reports as they are shown and downloaded
+REPORT_LAYOUTS: Dict[str, Tuple[List[str], str]] = {
+    ENTRIES: (
+        [pw.COL_BOAT_TYPE, pw.COL_CLUB, pw.COL_CREW_LETTER],
+        pw.COL_CREW_ID,
+    ),
+    CREW_LIST: ([pw.COL_BOAT_TYPE, pw.COL_CREW_NAME], pw.COL_CREW_ID),
+}
+
+
+def layout_report(name: str, df: pd.DataFrame) -> pd.DataFrame:
+    """Sort and index a report as it is downloaded from its view."""
+
+    if name not in REPORT_LAYOUTS:
+        return df
+    sort_columns, index = REPORT_LAYOUTS[name]
+    return df.sort_values(by=sort_columns).set_index(index)
+
+
+def report_files(
+    graph: ReportGraph, names: Tuple[str, ...] = REPORTS
+) -> Dict[str, Callable[[], bytes]]:
+    """
+    A function to compute and export each report as a csv file, by file
+    name, for export.write_zip, so the reports are computed by its workers
+    too. Reports already computed are only exported.
+    """
+
+    def export_report(name: str) -> bytes:
+        return export.to_csv_bytes(layout_report(name, graph.get(name)))
+
+    return {
+        f"{name}.csv": functools.partial(export_report, name) for name in names
+    }
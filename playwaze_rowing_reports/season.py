@@ -0,0 +1,415 @@
+"""
+Aggregate the entries of every event in a season.
+
+Each processed event's cleaned teams and team members reports are appended
+to a season store: a directory of parquet files partitioned by event and
+date, e.g. "event=Scottish Championships/date=2024-05-18/teams.parquet".
+Only the columns the season reports need are kept. The reports are worked
+out out of core, reading one event at a time and folding events into running
+totals that grow with the number of clubs, rowers and boat types rather than
+the number of events:
+
+- Season Clubs: the Clubs report summed over the season, with each rower
+  counted once for every club they have entered for
+- Season Rowers: how many events and crews each rower has entered
+- Season Boat Types: the entries of each boat type at each event, by date
+
+Usage:
+    python -m playwaze_rowing_reports.season SEASON_DIR -o OUTPUT_DIR
+"""
+
+import argparse
+import datetime
+import os
+import re
+import shutil
+import tempfile
+import urllib.parse
+from typing import Dict, Iterator, List, Tuple
+import pandas as pd
+import playwaze_rowing_reports.playwaze_reports as pw
+import playwaze_rowing_reports.aggregation as aggregation
+import playwaze_rowing_reports.boat_classes as boat_classes
+from playwaze_rowing_reports.instrumentation import timed
+
+TEAMS = "teams"
+TEAM_MEMBERS = "team_members"
+
+# only the columns the season reports need are stored and read
+TEAMS_COLUMNS = [
+    pw.COL_CREW_ID,
+    pw.COL_BOAT_TYPE,
+    pw.COL_CLUB,
+    pw.COL_SEATS,
+    pw.COL_COMPOSITE,
+    pw.COL_COX,
+]
+TEAM_MEMBERS_COLUMNS = [
+    pw.COL_CREW_ID,
+    pw.COL_SR_NUMBER,
+    pw.COL_NAME,
+    pw.COL_CLUB,
+]
+
+# columns of the season reports
+COL_EVENT = "event"
+COL_DATE = "date"
+COL_EVENTS = "events"
+COL_CREWS = "crews"
+# the name rowers without an SR number are told apart by
+COL_KEY_NAME = "key name"
+
+SEASON_CLUBS = "season clubs"
+SEASON_ROWERS = "season rowers"
+SEASON_BOAT_TYPES = "season boat types"
+
+# running totals of the season
+CLUBS = "clubs"
+CLUB_ROWERS = "club rowers"
+ROWERS = "rowers"
+# events whose results are added to the season's totals at once, so the
+# totals aren't rebuilt for every event
+FOLD_EVENTS = 32
+
+# an ISO date at the start of an event's directory name, e.g. "2024-05-18"
+DATE_PREFIX = re.compile(r"^(\d{4}-\d{2}-\d{2})")
+
+
+class SeasonStore:
+    """
+    The cleaned reports of every event in a season, one partition per event
+    and date. Appending an event again replaces it, even if its date has
+    changed, so an event is never counted twice.
+    """
+
+    def __init__(self, directory: str):
+
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _event_path(self, event: str) -> str:
+        return os.path.join(
+            self.directory, f"event={urllib.parse.quote(event, safe=' ')}"
+        )
+
+    def _partition_path(self, event: str, date: datetime.date) -> str:
+        return os.path.join(
+            self._event_path(event), f"date={date.isoformat()}"
+        )
+
+    def append(
+        self,
+        event: str,
+        date: datetime.date,
+        df_teams: pd.DataFrame,
+        df_team_members: pd.DataFrame,
+    ) -> None:
+
+        path = self._partition_path(event, date)
+        os.makedirs(self._event_path(event), exist_ok=True)
+        # write to a hidden directory and move it into place, so readers
+        # never see a partly written partition
+        tmp_path = tempfile.mkdtemp(prefix=".", dir=os.path.dirname(path))
+        try:
+            df_teams[TEAMS_COLUMNS].to_parquet(
+                os.path.join(tmp_path, f"{TEAMS}.parquet"), index=False
+            )
+            df_team_members[TEAM_MEMBERS_COLUMNS].to_parquet(
+                os.path.join(tmp_path, f"{TEAM_MEMBERS}.parquet"), index=False
+            )
+            for partition in self._event_partitions(event):
+                shutil.rmtree(partition, ignore_errors=True)
+            os.rename(tmp_path, path)
+        finally:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+    def _event_partitions(self, event: str) -> List[str]:
+        """The paths of every partition of an event, whatever its date."""
+
+        event_path = self._event_path(event)
+        if not os.path.isdir(event_path):
+            return []
+        return [
+            os.path.join(event_path, date_dir)
+            for date_dir in os.listdir(event_path)
+            if date_dir.startswith("date=")
+        ]
+
+    def partitions(self) -> List[Tuple[datetime.date, str]]:
+        """The date and event of every partition, in date order."""
+
+        partitions = []
+        for event_dir in os.listdir(self.directory):
+            if not event_dir.startswith("event="):
+                continue
+            event = urllib.parse.unquote(event_dir[len("event=") :])
+            for date_dir in os.listdir(
+                os.path.join(self.directory, event_dir)
+            ):
+                if date_dir.startswith("date="):
+                    date = datetime.date.fromisoformat(
+                        date_dir[len("date=") :]
+                    )
+                    partitions.append((date, event))
+
+        return sorted(partitions)
+
+    def read(
+        self,
+        event: str,
+        date: datetime.date,
+        table: str,
+        columns: List[str] = None,
+    ) -> pd.DataFrame:
+        """Read a report of one partition, optionally only some columns."""
+
+        return pd.read_parquet(
+            os.path.join(
+                self._partition_path(event, date), f"{table}.parquet"
+            ),
+            columns=columns,
+        )
+
+    def iter_partitions(
+        self,
+    ) -> Iterator[Tuple[datetime.date, str, pd.DataFrame, pd.DataFrame]]:
+        """The date, event, teams and team members of each partition in
+        turn, so only one partition is in memory at a time."""
+
+        for date, event in self.partitions():
+            yield (
+                date,
+                event,
+                self.read(event, date, TEAMS),
+                self.read(event, date, TEAM_MEMBERS),
+            )
+
+
+def event_date(event_dir: str) -> datetime.date:
+    """
+    The date of an event: an ISO date at the start of the name of its
+    directory, e.g. "2024-05-18 Scottish Championships", or the date its
+    reports were last modified.
+    """
+
+    name = os.path.basename(os.path.normpath(event_dir))
+    match = DATE_PREFIX.match(name)
+    if match:
+        return datetime.date.fromisoformat(match.group(1))
+
+    modified = max(
+        entry.stat().st_mtime
+        for entry in os.scandir(event_dir)
+        if entry.is_file()
+    )
+    return datetime.date.fromtimestamp(modified)
+
+
+def rower_keys(df_team_members: pd.DataFrame) -> pd.DataFrame:
+    """
+    The SR number and key name of each member, with their name and club.
+    Rowers are told apart by SR number, and only by name without one (their
+    key name), so a rower whose name or club is written differently at
+    another event is still counted once.
+    """
+
+    sr_numbers = df_team_members[pw.COL_SR_NUMBER].astype("Int64")
+    names = df_team_members[pw.COL_NAME].astype(object)
+    return pd.DataFrame(
+        {
+            pw.COL_SR_NUMBER: sr_numbers,
+            COL_KEY_NAME: names.where(sr_numbers.isna(), None),
+            pw.COL_NAME: names,
+            pw.COL_CLUB: df_team_members[pw.COL_CLUB].astype(object),
+        }
+    )
+
+
+@timed
+def get_season_reports(store: SeasonStore) -> Dict[str, pd.DataFrame]:
+    """
+    Work out every season report in a single pass over the events in the
+    store, one event at a time. The results of each event are folded into
+    the season's totals every FOLD_EVENTS events.
+    """
+
+    # the season's totals, and the results of each event not yet added
+    totals = {CLUBS: None, CLUB_ROWERS: None, ROWERS: None}
+    pending = {CLUBS: [], CLUB_ROWERS: [], ROWERS: []}
+    boat_type_entries = []
+
+    for date, event, df_teams, df_team_members in store.iter_partitions():
+        # the Clubs report's statistics of this event
+        df_event_clubs = aggregation.summarise_teams(
+            df_teams,
+            pw.COL_CLUB,
+            boat_classes.get_boat_classes(df_teams[pw.COL_BOAT_TYPE]),
+        )
+        df_event_clubs.index = df_event_clubs.index.astype(object)
+        pending[CLUBS].append(df_event_clubs)
+
+        # rowers are counted under the club of their first crew in each
+        # event, and once for every club over the season
+        df_keys = rower_keys(df_team_members)
+        pending[CLUB_ROWERS].append(
+            df_keys.loc[
+                aggregation.counted_members(df_team_members),
+                [pw.COL_CLUB, pw.COL_SR_NUMBER],
+            ]
+        )
+
+        # the crews of each rower in this event. Members with neither an SR
+        # number nor a name, e.g. unnamed coxes, can't be told apart.
+        df_known = df_keys[
+            df_keys[pw.COL_SR_NUMBER].notna() | df_keys[COL_KEY_NAME].notna()
+        ]
+        pending[ROWERS].append(
+            df_known.groupby([pw.COL_SR_NUMBER, COL_KEY_NAME], dropna=False)
+            .agg(
+                **{
+                    COL_CREWS: (pw.COL_CLUB, "size"),
+                    pw.COL_NAME: (pw.COL_NAME, "last"),
+                    pw.COL_CLUB: (pw.COL_CLUB, "last"),
+                }
+            )
+            .assign(**{COL_EVENTS: 1})
+        )
+
+        boat_type_entries.append(
+            df_teams[pw.COL_BOAT_TYPE].value_counts().rename((date, event))
+        )
+
+        if len(pending[ROWERS]) >= FOLD_EVENTS:
+            fold(totals, pending)
+
+    fold(totals, pending)
+    return {
+        SEASON_CLUBS: layout_season_clubs(totals[CLUBS], totals[CLUB_ROWERS]),
+        SEASON_ROWERS: layout_season_rowers(totals[ROWERS]),
+        SEASON_BOAT_TYPES: layout_season_boat_types(boat_type_entries),
+    }
+
+
+def fold(
+    totals: Dict[str, pd.DataFrame], pending: Dict[str, List[pd.DataFrame]]
+) -> None:
+    """
+    Add the pending results of events to the season's totals, and clear
+    them. The rowers keep the name and club of their latest event.
+    """
+
+    if not pending[ROWERS]:
+        return
+
+    totals[CLUBS] = (
+        pd.concat([totals[CLUBS], *pending[CLUBS]]).groupby(level=0).sum()
+    )
+    totals[CLUB_ROWERS] = pd.concat(
+        [totals[CLUB_ROWERS], *pending[CLUB_ROWERS]]
+    ).drop_duplicates()
+    df_rowers = pd.concat([totals[ROWERS], *pending[ROWERS]])
+    # rowers with neither an SR number nor a name aren't added up
+    known = df_rowers.index.get_level_values(0).notna() | (
+        df_rowers.index.get_level_values(1).notna()
+    )
+    totals[ROWERS] = (
+        df_rowers[known]
+        .groupby(level=[0, 1], dropna=False, sort=False)
+        .agg(
+            **{
+                COL_CREWS: (COL_CREWS, "sum"),
+                pw.COL_NAME: (pw.COL_NAME, "last"),
+                pw.COL_CLUB: (pw.COL_CLUB, "last"),
+                COL_EVENTS: (COL_EVENTS, "sum"),
+            }
+        )
+    )
+
+    for results in pending.values():
+        results.clear()
+
+
+def layout_season_clubs(
+    df_clubs: pd.DataFrame, df_club_rowers: pd.DataFrame
+) -> pd.DataFrame:
+    """Lay out the season's club statistics as the Clubs report."""
+
+    if df_clubs is None:
+        return pd.DataFrame(columns=list(aggregation.CLUBS_COLUMNS.values()))
+
+    rowers = df_club_rowers.groupby(pw.COL_CLUB).size()
+    df_summary = aggregation.combine(df_clubs.rename_axis(pw.COL_CLUB), rowers)
+    return aggregation.layout_summary(
+        df_summary, aggregation.CLUBS_COLUMNS
+    ).sort_index()
+
+
+def layout_season_rowers(df_rowers: pd.DataFrame) -> pd.DataFrame:
+    """Every rower with the number of events and crews they have entered,
+    the most frequent first."""
+
+    if df_rowers is None:
+        return pd.DataFrame(
+            columns=[pw.COL_NAME, pw.COL_CLUB, COL_EVENTS, COL_CREWS]
+        )
+
+    df = df_rowers.reset_index(COL_KEY_NAME, drop=True)
+    df = df[[pw.COL_NAME, pw.COL_CLUB, COL_EVENTS, COL_CREWS]]
+    return df.sort_values(
+        [COL_EVENTS, COL_CREWS, pw.COL_NAME],
+        ascending=[False, False, True],
+        kind="stable",
+    )
+
+
+def layout_season_boat_types(
+    boat_type_entries: List[pd.Series],
+) -> pd.DataFrame:
+    """The entries of each boat type (columns) at each event, by date."""
+
+    if not boat_type_entries:
+        return pd.DataFrame()
+
+    df = pd.DataFrame(boat_type_entries).fillna(0).astype("int64")
+    df.index = pd.MultiIndex.from_tuples(df.index, names=[COL_DATE, COL_EVENT])
+    return df[sorted(df.columns)].rename_axis(columns=pw.COL_BOAT_TYPE)
+
+
+def write_season_reports(store: SeasonStore, output_dir: str) -> List[str]:
+    """Write every season report to output_dir as a csv file. Returns the
+    paths written."""
+
+    os.makedirs(output_dir, exist_ok=True)
+    paths = []
+    for name, df in get_season_reports(store).items():
+        path = os.path.join(output_dir, f"{name}.csv")
+        df.to_csv(path)
+        paths.append(path)
+
+    return paths
+
+
+def main(args: List[str] = None) -> None:
+
+    parser = argparse.ArgumentParser(
+        description="Write the season reports of every event in a season "
+        "store."
+    )
+    parser.add_argument(
+        "season_dir", help="season store, see the cli's --season-dir"
+    )
+    parser.add_argument(
+        "-o",
+        "--output-dir",
+        default="season",
+        help="directory to write the reports to (default: %(default)s)",
+    )
+    args = parser.parse_args(args)
+
+    store = SeasonStore(args.season_dir)
+    for path in write_season_reports(store, args.output_dir):
+        print(f"Wrote {path}")
+
+
+if __name__ == "__main__":
+    main()
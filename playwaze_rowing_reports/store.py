@@ -0,0 +1,71 @@
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List, Union
+import playwaze_rowing_reports.report_graph as rg
+
+DEFAULT_MAX_EVENTS = 16  # number of published events kept in memory
+
+# every report computed when an event is published, so viewers never
+# compute anything
+PUBLISHED_REPORTS = (rg.STATS, rg.BOAT_CLASSES, rg.DF_COX_ISSUES) + rg.REPORTS
+
+
+class EventStore:
+    """
+    Events published by an organiser, shared by every session of the app.
+
+    An event is published once its reports have been processed, with every
+    report computed up front. Viewers then read the same ReportGraph, and
+    the same frames, as the organiser. Once the store is full, the event
+    published longest ago is dropped.
+    """
+
+    def __init__(self, max_events: int = DEFAULT_MAX_EVENTS):
+
+        self.max_events = max_events
+        self._events = OrderedDict()  # event name: (graph, published at)
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._events)
+
+    def __contains__(self, event: str) -> bool:
+        return event in self._events
+
+    def publish(self, event: str, graph: rg.ReportGraph) -> None:
+        """Compute every report of graph and publish it as event, replacing
+        any event of the same name."""
+
+        for name in PUBLISHED_REPORTS:
+            graph.get(name)
+
+        with self._lock:
+            self._events.pop(event, None)
+            self._events[event] = (graph, datetime.now())
+            while len(self._events) > self.max_events:
+                self._events.popitem(last=False)  # drop the oldest
+
+    def unpublish(self, event: str) -> None:
+
+        with self._lock:
+            self._events.pop(event, None)
+
+    def get(self, event: str) -> Union[None, rg.ReportGraph]:
+
+        entry = self._events.get(event)
+        return entry[0] if entry is not None else None
+
+    def published_at(self, event: str) -> Union[None, datetime]:
+
+        entry = self._events.get(event)
+        return entry[1] if entry is not None else None
+
+    def events(self) -> List[str]:
+        """The published events, most recently published first."""
+
+        with self._lock:
+            return list(reversed(self._events))
+
+    def stats(self) -> Dict[str, int]:
+        return {"size": len(self._events), "max size": self.max_events}
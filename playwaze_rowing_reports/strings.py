@@ -0,0 +1,116 @@
+"""
+String kernels for cleaning the reports, with a choice of engine.
+
+The python engine uses pandas' string methods on python objects, as the
+reports have always been cleaned. The arrow engine loads the column as an
+Arrow string array and runs pyarrow's vectorised kernels, matching literals
+rather than regular expressions, before handing the result back as python
+objects for the rest of the pipeline. Both engines give the same results;
+columns that aren't all strings are always handled by the python engine.
+
+The engine is chosen by the "string engine" of the app config, or the cli's
+--string-engine, see benchmarks/strings_benchmark.py for their timings.
+"""
+
+import re
+from typing import Optional, Tuple
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+PYTHON_ENGINE = "python"
+ARROW_ENGINE = "arrow"
+ENGINES = (PYTHON_ENGINE, ARROW_ENGINE)
+
+_engine = PYTHON_ENGINE
+
+
+def set_engine(engine: str) -> None:
+
+    global _engine
+    if engine not in ENGINES:
+        raise ValueError(
+            f"Unknown string engine {engine!r}, expected one of "
+            f"{', '.join(ENGINES)}"
+        )
+    _engine = engine
+
+
+def get_engine() -> str:
+    return _engine
+
+
+def to_arrow(values: pd.Series) -> Optional[pa.StringArray]:
+    """The values as an Arrow string array, or None if they aren't all
+    strings (or missing)."""
+
+    try:
+        return pa.array(
+            values.to_numpy(object), type=pa.string(), from_pandas=True
+        )
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        return None
+
+
+def from_arrow(array: pa.Array, values: pd.Series) -> pd.Series:
+    """An Arrow string array as python objects, indexed like the values it
+    was made from and keeping their missing values."""
+
+    result = pd.Series(
+        array.to_numpy(zero_copy_only=False),
+        index=values.index,
+        name=values.name,
+    )
+    return result.where(values.notna().to_numpy(), values)
+
+
+def contains(values: pd.Series, literal: str) -> pd.Series:
+    """Whether each value contains the literal, False if missing."""
+
+    array = to_arrow(values) if _engine == ARROW_ENGINE else None
+    if array is None:
+        return (
+            values.str.contains(re.escape(literal), regex=True)
+            .fillna(False)
+            .astype(bool)
+        )
+
+    found = pc.fill_null(pc.match_substring(array, literal), False)
+    return pd.Series(
+        found.to_numpy(zero_copy_only=False),
+        index=values.index,
+        name=values.name,
+    )
+
+
+def remove(values: pd.Series, literal: str) -> pd.Series:
+    """The values with every occurrence of the literal removed."""
+
+    array = to_arrow(values) if _engine == ARROW_ENGINE else None
+    if array is None:
+        return values.replace(re.escape(literal), "", regex=True)
+
+    return from_arrow(pc.replace_substring(array, literal, ""), values)
+
+
+def split_once(values: pd.Series, sep: str) -> Tuple[pd.Series, pd.Series]:
+    """
+    Split the values at the first sep, e.g. a first name and a surname.
+    Values without sep have no second part.
+    """
+
+    array = to_arrow(values) if _engine == ARROW_ENGINE else None
+    if array is None:
+        parts = values.str.split(sep, n=1, expand=True).reindex(columns=[0, 1])
+        return parts[0].rename(values.name), parts[1].rename(values.name)
+
+    parts = pc.split_pattern(array, pattern=sep, max_splits=1)
+    # the second part of each list of parts is the next value after the
+    # first, in the values of all the lists
+    lengths = pc.fill_null(pc.list_value_length(parts), 0).to_numpy()
+    starts = parts.offsets.to_numpy()[:-1]
+    rest = parts.values.take(pa.array(starts + 1, mask=lengths < 2))
+    return (
+        from_arrow(pc.list_element(parts, 0), values),
+        from_arrow(rest, values),
+    )
@@ -0,0 +1,336 @@
+"""
+Generate synthetic Playwaze reports for testing and benchmarking.
+
+The reports are laid out to match the column numbers in the playwaze config,
+so they can be loaded by the app, the batch converter or the benchmarks.
+
+Usage:
+    python -m playwaze_rowing_reports.synthetic OUTPUT_DIR --crews 500
+"""
+
+import argparse
+import csv
+import datetime
+import json
+import os
+import random
+from typing import Dict, Iterable, List
+
+import openpyxl
+import yaml
+
+import playwaze_rowing_reports.playwaze_reports as pw
+
+DEFAULT_PW_CONFIG_PATH = os.path.join("config", "playwaze_config.yaml")
+
+# report names, used as the file names of the generated reports
+TEAMS_REPORT = "teams"
+TEAM_MEMBERS_REPORT = "team members"
+COMMUNITY_MEMBERS_REPORT = "community members"
+
+BOAT_TYPES = ["1x", "2x", "2-", "4x", "4x+", "4-", "4+", "8x+", "8+"]
+CLUBS = [
+    "Aberdeen",
+    "Clydesdale",
+    "Dundee",
+    "Edinburgh",
+    "Glasgow",
+    "Inverness",
+    "Loch Lomond",
+    "Perth",
+    "St Andrews",
+    "Stirling",
+    "Strathclyde",
+    "Tay",
+]
+FIRST_NAMES = [
+    "Alex",
+    "Callum",
+    "Catriona",
+    "Eilidh",
+    "Fraser",
+    "Isla",
+    "Jamie",
+    "Jonathan",
+    "Kirsty",
+    "Mhairi",
+    "Niamh",
+    "Rory",
+    "Ruaridh",
+    "Skye",
+]
+SURNAMES = [
+    "Campbell",
+    "Cameron",
+    "Fraser",
+    "MacDonald",
+    "MacKenzie",
+    "MacLeod",
+    "Murray",
+    "Robertson",
+    "Ross",
+    "Smith",
+    "Stewart",
+    "Thomson",
+]
+CREW_LETTERS = "ABCD"
+MEMBERSHIP_TYPES = ["Full", "Junior", "Student", "Masters"]
+
+
+def seats_in_boat(boat_type: str) -> int:
+    return int(boat_type[0])
+
+
+def is_coxed(boat_type: str) -> bool:
+    return boat_type.endswith("+")
+
+
+def yes_no(value: bool) -> str:
+    return "Y" if value else "N"
+
+
+def generate_members(
+    n_members: int, duplicate_name_fraction: float, rng: random.Random
+) -> List[Dict]:
+    """
+    Generate a community of members. duplicate_name_fraction of them share
+    their name with another member.
+    """
+
+    members = []
+    for i in range(n_members):
+        if members and rng.random() < duplicate_name_fraction:
+            name = rng.choice(members)[pw.COL_NAME]
+        else:
+            # make names unique with a numeric suffix on the surname
+            name = (
+                f"{rng.choice(FIRST_NAMES)} {rng.choice(SURNAMES)}"
+                f"{'' if i < len(SURNAMES) else i}"
+            )
+        club = rng.choice(CLUBS)
+        members.append(
+            {
+                pw.COL_MEMBER_ID: f"members/{i + 1}",
+                pw.COL_NAME: name,
+                pw.COL_GENDER: rng.choice(["Male", "Female"]),
+                pw.COL_DOB: datetime.datetime(
+                    rng.randint(1950, 2010), rng.randint(1, 12), 1
+                ),
+                pw.COL_SR_NUMBER: 100000 + i,
+                pw.COL_MEMBERSHIP_TYPE: rng.choice(MEMBERSHIP_TYPES),
+                pw.COL_EXPIRY: datetime.datetime(2023, 3, 31),
+                pw.COL_ROW_POINTS: rng.randint(0, 20),
+                pw.COL_ROW_NOVICE: yes_no(rng.random() < 0.3),
+                pw.COL_SCULL_POINTS: rng.randint(0, 20),
+                pw.COL_SCULL_NOVICE: yes_no(rng.random() < 0.3),
+                pw.COL_PRIMARY_CLUB: club,
+                pw.COL_ADDITIONAL_CLUBS: None,
+                pw.COL_FIRST_LICENCE: datetime.datetime(
+                    rng.randint(2000, 2022), 4, 1
+                ),
+                pw.COL_COMPOSITE_CLUBS: None,
+            }
+        )
+
+    return members
+
+
+def generate_reports(
+    n_crews: int,
+    n_members: int = None,
+    composite_fraction: float = 0.05,
+    cox_fraction: float = 0.9,
+    duplicate_name_fraction: float = 0.01,
+    seed: int = 0,
+) -> Dict[str, List[Dict]]:
+    """
+    Generate the rows of a teams, team members and community members report.
+
+    n_members is the size of the community that crews are drawn from, by
+    default enough for every rower to be in about two crews. cox_fraction is
+    the fraction of coxed crews that have a cox named.
+    """
+
+    rng = random.Random(seed)
+    if n_members is None:
+        n_members = max(n_crews * 2, 1)
+    members = generate_members(n_members, duplicate_name_fraction, rng)
+    members_by_club = {club: [] for club in CLUBS}
+    for member in members:
+        members_by_club[member[pw.COL_PRIMARY_CLUB]].append(member)
+
+    teams, team_members = [], []
+    crew_letters = {}
+    for i in range(n_crews):
+        boat_type = rng.choice(BOAT_TYPES)
+        club = rng.choice(CLUBS)
+        composite = rng.random() < composite_fraction
+        letter_number = crew_letters.get((club, boat_type), 0)
+        crew_letters[(club, boat_type)] = letter_number + 1
+        crew_letter = CREW_LETTERS[letter_number % len(CREW_LETTERS)]
+        crew_id = f"T{i + 1}"
+        crew_name = f"{club} {boat_type} {crew_letter}"
+        club_name = f"{club} {pw.COMPOSITE_STRING}" if composite else club
+
+        # mostly full crews, some still waiting on rowers
+        n_seats = seats_in_boat(boat_type)
+        n_filled = n_seats if rng.random() < 0.9 else rng.randint(0, n_seats)
+        pool = members if composite else members_by_club[club] or members
+        rowers = rng.sample(pool, min(n_filled, len(pool)))
+
+        cox = is_coxed(boat_type)
+        cox_name = None
+        if cox and rng.random() < cox_fraction:
+            cox_name = rng.choice(pool)[pw.COL_NAME]
+
+        teams.append(
+            {
+                pw.COL_CREW_ID: f"teams/{crew_id}",
+                pw.COL_BOAT_TYPE: boat_type,
+                pw.COL_CLUB: club_name,
+                pw.COL_CREW_NAME: crew_name,
+                pw.COL_CREW_LETTER: crew_letter,
+                pw.COL_SEATS: len(rowers),
+                pw.COL_VERIFIED: yes_no(rng.random() < 0.8),
+                pw.COL_CAPTAIN: yes_no(rng.random() < 0.5),
+                pw.COL_COX: yes_no(cox),
+                pw.COL_CAPTAIN_NAME: rng.choice(pool)[pw.COL_NAME],
+                pw.COL_COX_NAME: cox_name,
+                "notes": None,
+            }
+        )
+        for rower in rowers:
+            team_members.append(
+                {
+                    **rower,
+                    pw.COL_BOAT_TYPE: boat_type,
+                    pw.COL_CLUB: club_name,
+                    pw.COL_CREW_ID: crew_id,
+                    pw.COL_CREW_LETTER: crew_letter,
+                    pw.COL_CREW_NAME: crew_name,
+                    pw.COL_COMPOSITE_CLUBS: club if composite else None,
+                }
+            )
+
+    return {
+        TEAMS_REPORT: teams,
+        TEAM_MEMBERS_REPORT: team_members,
+        COMMUNITY_MEMBERS_REPORT: members,
+    }
+
+
+def layout_rows(
+    rows: Iterable[Dict],
+    columns: Dict[str, int],
+    headers: Dict[str, str] = None,
+) -> Iterable[List]:
+    """
+    Place the values of each row at their column number in the report, after
+    a header row with the expected headers of the playwaze config.
+    """
+
+    width = max(columns.values()) + 1
+    header = [f"Column {i}" for i in range(width)]
+    for name, text in (headers or {}).items():
+        header[columns[name]] = text
+    yield header
+    for row in rows:
+        cells = [None] * width
+        for name, number in columns.items():
+            cells[number] = row.get(name)
+        yield cells
+
+
+def write_xlsx(path: str, rows: Iterable[List]) -> None:
+
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    for row in rows:
+        sheet.append(row)
+    workbook.save(path)
+
+
+def write_csv(path: str, rows: Iterable[List]) -> None:
+
+    with open(path, "w", newline="") as f:
+        csv.writer(f).writerows(rows)
+
+
+def write_json(path: str, rows: Iterable[List]) -> None:
+    """Write the rows as a list of records, keyed by the header row."""
+
+    rows = iter(rows)
+    header = next(rows)
+    with open(path, "w") as f:
+        json.dump([dict(zip(header, row)) for row in rows], f, default=str)
+
+
+def write_reports(
+    reports: Dict[str, List[Dict]],
+    output_dir: str,
+    pw_config: Dict,
+    file_types: Iterable[str] = ("xlsx",),
+) -> Dict[str, str]:
+    """
+    Write generated reports to output_dir, laid out and headed as in the
+    playwaze config. Returns the path of each report, keyed by "name.type".
+    """
+
+    writers = {"xlsx": write_xlsx, "csv": write_csv, "json": write_json}
+
+    os.makedirs(output_dir, exist_ok=True)
+    paths = {}
+    for name, rows in reports.items():
+        # each report's settings are under its name, e.g. "teams report
+        # columns"
+        columns = pw_config[f"{name} report columns"]
+        headers = pw_config.get(f"{name} report headers")
+        for file_type in file_types:
+            path = os.path.join(output_dir, f"{name}.{file_type}")
+            writers[file_type](path, layout_rows(rows, columns, headers))
+            paths[f"{name}.{file_type}"] = path
+
+    return paths
+
+
+def main(args: List[str] = None) -> None:
+
+    parser = argparse.ArgumentParser(
+        description="Generate synthetic Playwaze reports."
+    )
+    parser.add_argument("output_dir")
+    parser.add_argument("--crews", type=int, default=100)
+    parser.add_argument(
+        "--members",
+        type=int,
+        default=None,
+        help="size of the community (default: twice the number of crews)",
+    )
+    parser.add_argument("--composites", type=float, default=0.05)
+    parser.add_argument("--coxes", type=float, default=0.9)
+    parser.add_argument("--duplicate-names", type=float, default=0.01)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--types", nargs="+", default=["xlsx"], choices=["xlsx", "csv", "json"]
+    )
+    parser.add_argument("-c", "--config", default=DEFAULT_PW_CONFIG_PATH)
+    args = parser.parse_args(args)
+
+    with open(args.config, "r") as f:
+        pw_config = yaml.safe_load(f)
+
+    reports = generate_reports(
+        args.crews,
+        args.members,
+        composite_fraction=args.composites,
+        cox_fraction=args.coxes,
+        duplicate_name_fraction=args.duplicate_names,
+        seed=args.seed,
+    )
+    paths = write_reports(reports, args.output_dir, pw_config, args.types)
+    for path in paths.values():
+        print(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,15 @@
-from typing import List, Dict
+from typing import Any, List, Dict
 import pandas as pd
 import streamlit as st
 import playwaze_rowing_reports.playwaze_reports as pw
-import base64
+import playwaze_rowing_reports.report_graph as rg
+import playwaze_rowing_reports.export as export
+import playwaze_rowing_reports.incremental as incremental
+import playwaze_rowing_reports.instrumentation as instrumentation
+import playwaze_rowing_reports.paging as paging
+import playwaze_rowing_reports.boat_classes as boat_classes
+import playwaze_rowing_reports.conflicts as conflicts
+from playwaze_rowing_reports.store import EventStore
 
 ENTRIES_VIEW = "Entries"
 CREWS_VIEW = "Crew List"
@@ -10,6 +17,8 @@ EVENTS_VIEW = "Events"
 CLUBS_VIEW = "Clubs"
 ROWERS_VIEW = "Rowers"
 COFD_VIEW = "CofD"
+CONFLICTS_VIEW = "Conflicts"
+CHANGES_VIEW = "Changes"
 
 APP_VIEWS = (
     ENTRIES_VIEW,
@@ -18,8 +27,29 @@ APP_VIEWS = (
     CLUBS_VIEW,
     ROWERS_VIEW,
     COFD_VIEW,
+    CONFLICTS_VIEW,
+    CHANGES_VIEW,
 )
 
+# organisers process reports, and can publish them for viewers to read
+PROCESS_MODE = "Process reports"
+PUBLISHED_MODE = "View a published event"
+
+APP_MODES = (PROCESS_MODE, PUBLISHED_MODE)
+
+# the report in the report graph shown by each view
+VIEW_REPORTS = {
+    ENTRIES_VIEW: rg.ENTRIES,
+    CREWS_VIEW: rg.CREW_LIST,
+    EVENTS_VIEW: rg.EVENTS,
+    CLUBS_VIEW: rg.CLUBS,
+    ROWERS_VIEW: rg.ROWERS,
+    COFD_VIEW: rg.COFD,
+    CONFLICTS_VIEW: rg.CONFLICTS,
+}
+
+OARA_CONFIG_PATH = "resources/OaraConfig.csv"
+
 
 class View:
     def __init__(
@@ -29,59 +59,148 @@ class View:
         web_hidden_columns: List[str] = [],
         sort_columns: List[str] = [],
         index=None,
+        memo: Any = None,
     ):
 
         self.view_name = view_name
         self.df = df
         self.index = index
+        self.memo = memo  # keeps exports, e.g. the ReportGraph of the df
 
         self.web_hidden_columns = web_hidden_columns
         self.sort_columns = sort_columns
 
-        self.get_df()
+        with instrumentation.timer(
+            f"{self.view_name} view.get_df", instrumentation.count_rows(df)
+        ) as record:
+            self.get_df()
+            record["rows out"] = instrumentation.count_rows(self.df)
         self.display()
 
     def get_df(self):
+        """
+        Lay out the report, once for each version of the reports when there
+        is a memo. The frames are shared and never modified: the display
+        transformations are only applied to the rows shown.
+        """
+
+        if self.memo is None:
+            self.df = self.layout_df()
+        else:
+            self.df = self.memo.memoize(
+                ("layout", self.view_name), self.layout_df
+            )
+        self.df_download = self.df
+
+    def layout_df(self):
 
+        df = self.df
         if self.sort_columns:
-            self.df = self.df.sort_values(by=self.sort_columns)
+            df = df.sort_values(by=self.sort_columns)
             if self.index is None:
                 # if manual index not set,
                 # reset the auto-index to match the sorting
-                self.df = self.df.reset_index(drop=True)
+                df = df.reset_index(drop=True)
 
         if self.index:
-            self.df = self.df.set_index(self.index)
+            df = df.set_index(self.index)
 
-        self.df_download = self.df.copy()
-        # copy the dataframe, we don't want to make the below transformations
-        # on the downloadable version
+        return df
+
+    def format_df(self, df):
+        """Hide columns and blank out NAs, on the rows about to be shown."""
 
         if self.web_hidden_columns:
-            self.df = self.df.drop(self.web_hidden_columns, axis=1)
+            df = df.drop(self.web_hidden_columns, axis=1)
 
-        if isinstance(self.df, pd.DataFrame):
+        if isinstance(df, pd.DataFrame):
             # this only works on Dataframes, not series
-            string_columns = self.df.select_dtypes(include=["object"]).columns
-            self.df[string_columns] = self.df[string_columns].fillna(
-                ""
-            )  # replace "NA" with a blank string, looks nicer
+            string_columns = df.select_dtypes(
+                include=["object", "category"]
+            ).columns
+            # replace "NA" with a blank string, looks nicer
+            df = df.astype(dict.fromkeys(string_columns, object)).fillna(
+                dict.fromkeys(string_columns, "")
+            )
+
+        return df
 
     def display(self):
-        self.display_header()
-        self.display_header_text()
-        self.display_df()
-        self.display_downloader()
-        self.display_footer()
+        for step in [
+            self.display_header,
+            self.display_header_text,
+            self.display_df,
+            self.display_downloader,
+            self.display_footer,
+        ]:
+            stage = f"{self.view_name} view.{step.__name__}"
+            with instrumentation.timer(stage):
+                step()
 
     def display_header(self):
         st.header(self.view_name.title())
 
     def display_df(self):
-        st.write(self.df)
+
+        group_index = self.get_group_index()
+        selections = {}
+        if group_index:
+            filter_columns = st.columns(len(group_index))
+            for column, (name, groups) in zip(
+                filter_columns, group_index.items()
+            ):
+                selections[name] = column.multiselect(
+                    name,
+                    sorted(groups, key=str),
+                    key=f"{self.view_name} filter {name}",
+                )
+        positions = paging.filter_positions(
+            group_index, selections, len(self.df)
+        )
+
+        size_column, page_column = st.columns(2)
+        page_size = size_column.selectbox(
+            "Rows per page",
+            paging.PAGE_SIZES,
+            key=f"{self.view_name} page size",
+        )
+        pages = paging.count_pages(len(positions), page_size)
+        # keyed by the filtered rows, to go back to the first page whenever
+        # the filters change
+        page = page_column.number_input(
+            f"Page (of {pages})",
+            min_value=1,
+            max_value=pages,
+            key=f"{self.view_name} page {len(positions)} {page_size}",
+        )
+
+        # only the rows of the page are sent to the browser
+        page_df = paging.get_page(self.df, positions, page, page_size)
+        st.write(self.format_df(page_df))
+        first = min((page - 1) * page_size + 1, len(positions))
+        last = min(page * page_size, len(positions))
+        filtered = (
+            f" (filtered from {len(self.df)})"
+            if len(positions) < len(self.df)
+            else ""
+        )
+        st.caption(f"Rows {first} to {last} of {len(positions)}{filtered}")
+
+    def get_group_index(self) -> paging.GroupIndex:
+        """
+        The group index of the rows of the view, built once for each version
+        of the reports when there is a memo.
+        """
+
+        if self.memo is None:
+            return paging.build_group_index(self.df_download)
+        return self.memo.memoize(
+            ("group index", self.view_name),
+            lambda: paging.build_group_index(self.df_download),
+        )
 
     def display_downloader(self):
-        df_downloader(self.df_download, f"{self.view_name.lower()}.csv")
+        df_downloader(self.df_download, self.view_name, self.memo)
 
     def display_header_text(self):
         pass
@@ -91,10 +210,9 @@ class View:
 
 
 class CrewsListView(View):
-    def __init__(self, df: pd.DataFrame):
+    def __init__(self, df: pd.DataFrame, memo: Any = None):
 
-        index = pw.COL_CREW_ID
-        sort_columns = [pw.COL_BOAT_TYPE, pw.COL_CREW_NAME]
+        sort_columns, index = rg.REPORT_LAYOUTS[rg.CREW_LIST]
         web_hidden_columns = None
 
         super().__init__(
@@ -103,6 +221,7 @@ class CrewsListView(View):
             web_hidden_columns=web_hidden_columns,
             sort_columns=sort_columns,
             index=index,
+            memo=memo,
         )
 
     def display_header_text(self):
@@ -110,67 +229,300 @@ class CrewsListView(View):
 
 
 class EntriesView(View):
-    def __init__(self, df: pd.DataFrame, stats: Dict = None):
+    def __init__(
+        self,
+        df: pd.DataFrame,
+        stats: Dict = None,
+        memo: Any = None,
+        memory_stats: Dict = None,
+    ):
 
         self.stats = stats
-        index = pw.COL_CREW_ID
+        self.memory_stats = memory_stats
         web_hidden_columns = [
             pw.COL_CAPTAIN,
             pw.COL_CAPTAIN_NAME,
             pw.COL_COX,
             pw.COL_CREW_NAME,
         ]
-        sort_columns = [pw.COL_BOAT_TYPE, pw.COL_CLUB, pw.COL_CREW_LETTER]
+        sort_columns, index = rg.REPORT_LAYOUTS[rg.ENTRIES]
 
         super().__init__(
-            ENTRIES_VIEW, df, web_hidden_columns, sort_columns, index=index
+            ENTRIES_VIEW,
+            df,
+            web_hidden_columns,
+            sort_columns,
+            index=index,
+            memo=memo,
         )
 
     def display_header_text(self):
         for stat, val in self.stats.items():
             st.write(f"{stat}: {val}")
+        # with memory accounting or a memory budget
+        for stat, val in (self.memory_stats or {}).items():
+            st.caption(f"{stat}: {val}")
 
 
 class CofDView(View):
-    def __init__(self, df: pd.DataFrame):
+    def __init__(self, df: pd.DataFrame, memo: Any = None):
 
-        super().__init__("CofD", df)
+        super().__init__(COFD_VIEW, df, memo=memo)
 
     def display_footer(self):
 
-        with open("resources/OaraConfig.csv", "r") as f:
-            # load csv file as string
-            csvtext = f.readlines()
-        csvtext = "".join(csvtext)  # convert list to string
-        csv_downloader(
-            csvtext, "OaraConfig.csv", "Download Regatta Program Config"
+        st.download_button(
+            "Download Regatta Program Config",
+            load_oara_config(),
+            file_name="OaraConfig.csv",
+            mime="text/csv",
+        )
+
+
+class ConflictsView(View):
+    def __init__(self, df: pd.DataFrame, memo: Any = None):
+
+        super().__init__(CONFLICTS_VIEW, df, memo=memo)
+
+    def display_header_text(self):
+
+        if self.df.empty:
+            st.success("No conflicting entries were found.")
+            return
+
+        counts = self.df[conflicts.COL_CONFLICT].value_counts(sort=False)
+        for conflict, count in counts[counts > 0].items():
+            st.write(f"{conflict.capitalize()}: {count} entries")
+        st.caption(
+            "Events are told apart by boat type, so a cox rowing in a "
+            "different event that races at the same time is not flagged."
+        )
+
+
+class ChangesView(View):
+    def __init__(self, df: pd.DataFrame = None, memo: Any = None):
+
+        # df is None if there isn't a previous version of the reports
+        self.has_previous = df is not None
+        if df is None:
+            df = pd.DataFrame(columns=incremental.CHANGES_COLUMNS)
+
+        super().__init__(CHANGES_VIEW, df, memo=memo)
+
+    def display_header_text(self):
+
+        if not self.has_previous:
+            st.info(
+                "Upload a newer version of the reports to see the crews that "
+                "have changed."
+            )
+        else:
+            st.write(
+                f"{len(self.df)} crews have changed since the previous "
+                "version of the reports."
+            )
+
+
+@st.experimental_memo
+def load_oara_config(path: str = OARA_CONFIG_PATH) -> bytes:
+    """Load the regatta program config, read from disk only once."""
+
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def cox_issues_warning(df_cox_issues: pd.DataFrame) -> None:
+    """
+    Warns about coxes whose details could not be found, because nobody or
+    more than one person has their name, and coxes matched to somebody with
+    a similar name, whose details should be checked.
+    """
+
+    if df_cox_issues.empty:
+        return
+
+    similar = (df_cox_issues[pw.COL_ISSUE] == pw.COX_SIMILAR).sum()
+    missing = len(df_cox_issues) - similar
+    if missing:
+        st.warning(
+            f"Details could not be found for {missing} coxes, because they "
+            "have not been named, nobody with their name was found, or "
+            "several people share their name."
+        )
+    if similar:
+        st.info(
+            f"{similar} coxes were matched to a member with a similar name. "
+            "Please check the matched names."
+        )
+    with st.expander("Show coxes"):
+        st.write(
+            df_cox_issues[
+                [
+                    pw.COL_NAME,
+                    pw.COL_CREW_NAME,
+                    pw.COL_CLUB,
+                    pw.COL_ISSUE,
+                    pw.COL_CANDIDATES,
+                    pw.COL_MATCHED_NAME,
+                    pw.COL_MATCH_CONFIDENCE,
+                ]
+            ]
+        )
+
+
+def unknown_boat_types_warning(df_boat_classes: pd.DataFrame) -> None:
+    """Warns about boat types that don't name a boat class, whose seats
+    aren't counted."""
+
+    unknown = boat_classes.unknown_boat_types(df_boat_classes)
+    if unknown:
+        st.warning(
+            f"The boat class of {', '.join(map(str, unknown))} could not be "
+            "worked out, so their seats are not counted in the total."
         )
 
 
-def csv_downloader(
-    csvfile: str, filename: str, link_text: str = "Download as CSV"
+def df_downloader(
+    df: pd.DataFrame, name: str, memo: Any = None, sidebar: bool = False
 ) -> None:
     """
-    Creates a clickable link in streamlit to download the given csv string as
-    a file.
+    Creates a download button in streamlit for the dataframe, in a choice of
+    formats. The file is only exported once it has been asked for, and with a
+    memo (e.g. the ReportGraph of the df) the exported bytes are kept so later
+    reruns don't export them again.
+    """
+
+    container = st.sidebar if sidebar else st
+    file_format = container.selectbox(
+        "Download format", export.EXPORT_FORMATS, key=f"{name} download format"
+    )
+    key = ("export", name, file_format)
+    prepared = memo is not None and memo.is_memoized(key)
+    if not prepared and not container.button(
+        f"Prepare {file_format} download", key=f"{name} prepare download"
+    ):
+        return
+
+    def export_df() -> bytes:
+        return export.export_bytes(df, file_format, name)
+
+    data = export_df() if memo is None else memo.memoize(key, export_df)
+    _, mime = export.EXPORT_FORMATS[file_format]
+    container.download_button(
+        f"Download as {file_format}",
+        data,
+        file_name=export.get_file_name(name, file_format),
+        mime=mime,
+        key=f"{name} download",
+    )
+
+
+def reports_workbook_downloader(graph: rg.ReportGraph) -> None:
+    """
+    Creates a download button in the sidebar for an excel workbook with every
+    report on its own sheet.
+    """
+
+    st.sidebar.header("Download All Reports:")
+    key = ("export", "all reports", export.EXCEL_FORMAT)
+    if not graph.is_memoized(key) and not st.sidebar.button(
+        "Prepare Excel workbook"
+    ):
+        return
+
+    data = graph.memoize(
+        key,
+        lambda: export.to_xlsx_bytes(
+            {
+                view: rg.layout_report(report, graph.get(report))
+                for view, report in VIEW_REPORTS.items()
+            }
+        ),
+    )
+    st.sidebar.download_button(
+        "Download Excel workbook",
+        data,
+        file_name=export.get_file_name("reports", export.EXCEL_FORMAT),
+        mime=export.EXPORT_FORMATS[export.EXCEL_FORMAT][1],
+    )
+
+
+def reports_zip_downloader(graph: rg.ReportGraph) -> None:
+    """
+    Creates a download button in the sidebar for a zip archive of every
+    report as a csv file, with the regatta program config. The reports are
+    computed and exported concurrently. The archive is built again each time
+    it is prepared rather than memoized, as it holds every report.
     """
 
-    b64 = base64.b64encode(csvfile.encode()).decode()
-    href = (
-        f'<a href="data:file/csv;base64,{b64}" '
-        f'download="{filename}">{link_text}</a>'
+    if not st.sidebar.button("Prepare zip archive"):
+        return
+
+    files = rg.report_files(graph, tuple(VIEW_REPORTS.values()))
+    oara_config = load_oara_config()
+    files["OaraConfig.csv"] = lambda: oara_config
+    st.sidebar.download_button(
+        "Download zip archive",
+        export.to_zip_bytes(files),
+        file_name="reports.zip",
+        mime=export.ZIP_MIME,
     )
-    st.markdown(href, unsafe_allow_html=True)
 
 
-def df_downloader(df: pd.DataFrame, filename: str) -> None:
+def event_publisher(store: EventStore, graph: rg.ReportGraph) -> None:
     """
-    Creates a clickable link in streamlit to download the given dataframe as a
-    csv file.
+    Creates a form in the sidebar to publish the processed reports as an
+    event, for viewers to read without uploading the reports themselves.
     """
 
-    csvfile = df.to_csv()
-    csv_downloader(csvfile, filename)
+    st.sidebar.header("Publish Event:")
+    event = st.sidebar.text_input("Event name").strip()
+    if not st.sidebar.button("Publish", disabled=not event):
+        return
+
+    replaced = event in store
+    store.publish(event, graph)
+    st.sidebar.success(
+        f"{'Republished' if replaced else 'Published'} {event} for viewers."
+    )
+
+
+def published_event_selector(store: EventStore) -> rg.ReportGraph:
+    """
+    Creates a select box in the sidebar of the published events, and returns
+    the reports of the one selected.
+    """
+
+    events = store.events()
+    if not events:
+        st.info("No events have been published yet.")
+        st.stop()
+
+    st.sidebar.header("Select Event:")
+    event = st.sidebar.selectbox("Published events", events)
+    graph = store.get(event)
+    if graph is None:  # dropped from the store since the list was made
+        st.warning(f"{event} is no longer published.")
+        st.stop()
+
+    st.sidebar.caption(f"Published at {store.published_at(event):%H:%M}")
+    return graph
+
+
+def diagnostics_panel() -> None:
+    """
+    Shows in the sidebar how long each stage of the pipeline, the reports
+    and the view took in this run, and in total since the app started.
+    """
+
+    if not st.sidebar.checkbox("Show diagnostics"):
+        return
+
+    with st.sidebar.expander("Diagnostics", expanded=True):
+        st.caption("This run")
+        st.dataframe(instrumentation.summarise_run())
+        st.caption("Since the app started")
+        st.dataframe(instrumentation.summarise_totals())
 
 
 def report_uploader(
@@ -179,7 +531,7 @@ def report_uploader(
     """Create a file uploader in streamlit for playwaze reports."""
 
     uploaded_file = st.sidebar.file_uploader(
-        f"Upload a {report_type} report", type=[pw.REPORT_FILE_TYPE]
+        f"Upload a {report_type} report", type=pw.REPORT_FILE_TYPES
     )
 
     if uploaded_file is None:
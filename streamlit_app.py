@@ -1,19 +1,38 @@
+import functools
+import importlib
+import io
 import streamlit as st
-import yaml
-import pandas as pd
 import os
+import pandas as pd
+from PIL import Image
 from typing import Dict, List
 import playwaze_rowing_reports.playwaze_reports as pw
 import playwaze_rowing_reports.views as views
-
-import importlib
-
-importlib.reload(pw)
-importlib.reload(views)
+import playwaze_rowing_reports.pipeline as pipeline
+import playwaze_rowing_reports.incremental as incremental
+import playwaze_rowing_reports.report_graph as rg
+import playwaze_rowing_reports.instrumentation as instrumentation
+import playwaze_rowing_reports.memory_budget as memory_budget
+import playwaze_rowing_reports.strings as strings
+from playwaze_rowing_reports.cache import (
+    DEFAULT_CACHE_SIZE,
+    DEFAULT_DISK_CACHE_MB,
+    ParquetCache,
+    ReportCache,
+    hash_reports,
+)
+from playwaze_rowing_reports.store import DEFAULT_MAX_EVENTS, EventStore
+from playwaze_rowing_reports.config import (
+    ConfigError,
+    load_config,
+    validate_app_config,
+    validate_pw_config,
+)
 
 CONFIG_PATH = "config"
 DEFAULT_APP_CONFIG_PATH = os.path.join(CONFIG_PATH, "app_config.yaml")
 DEFAULT_PW_CONFIG_PATH = os.path.join(CONFIG_PATH, "playwaze_config.yaml")
+LOGO_WIDTH = 300
 
 
 class App:
@@ -30,28 +49,49 @@ class App:
         st.set_page_config(
             layout=self.app_config["layout"],
             page_title=self.app_config["site title"],
-            page_icon=self.app_config["logo path"],
+            page_icon=get_logo(self.app_config["logo path"]),
             initial_sidebar_state="expanded",
         )
 
     def load_config(self, app_config_path, pw_config_path) -> List[Dict]:
-        """Loads the app and playwaze configurations."""
-
-        app_config = load_from_yaml(app_config_path)
-        pw_config = load_from_yaml(pw_config_path)
+        """
+        Loads the app and playwaze configurations, which are only read again
+        once they have been modified.
+        """
+
+        try:
+            app_config = load_config(app_config_path, validate_app_config)
+            pw_config = load_config(pw_config_path, validate_pw_config)
+        except ConfigError as e:
+            st.error(f"The app is misconfigured. {e}")
+            st.stop()
 
         return app_config, pw_config
 
     def display(self):
 
+        instrumentation.start_run()
+        if self.app_config.get("diagnostics log"):
+            instrumentation.log_json()
+        if self.app_config.get("memory accounting"):
+            instrumentation.start_memory_accounting()
+        elif instrumentation.is_accounting_memory():
+            instrumentation.stop_memory_accounting()
+        strings.set_engine(
+            self.app_config.get("string engine") or strings.PYTHON_ENGINE
+        )
+
         self.header()
         self.sidebar()
         self.report_preprocessing()
         self.body()
 
+        if self.app_config.get("diagnostics panel"):
+            views.diagnostics_panel()
+
     def header(self):
 
-        st.image(self.app_config["logo path"], width=300)
+        st.image(get_logo(self.app_config["logo path"]), width=LOGO_WIDTH)
         st.title(self.app_config["site title"])
 
     def sidebar(self):
@@ -59,6 +99,11 @@ class App:
         st.sidebar.header("Select View:")
         self.view = st.sidebar.selectbox("", views.APP_VIEWS)
 
+        st.sidebar.header("Mode:")
+        self.mode = st.sidebar.radio("", views.APP_MODES)
+        if self.mode == views.PUBLISHED_MODE:
+            return  # viewers don't upload reports
+
         st.sidebar.header("Upload Playwaze Reports:")
         self.teams_report = views.report_uploader("teams")
         self.team_members_report = views.report_uploader("team members")
@@ -68,154 +113,234 @@ class App:
 
     def body(self):
 
+        views.cox_issues_warning(self.reports[rg.DF_COX_ISSUES])
+        views.unknown_boat_types_warning(self.reports[rg.BOAT_CLASSES])
+
         if self.view == views.ENTRIES_VIEW:
 
-            stats = {
-                "Entries": self.num_entries,
-                "Total Seats (excludes coxes)": self.total_seats,
-                "Filled Seats (excludes coxes)": self.filled_seats,
-                "Unique Rowers (includes coxes)": self.unique_rowers,
-            }
-            views.EntriesView(df=self.df_teams, stats=stats)
+            views.EntriesView(
+                df=self.reports[rg.ENTRIES],
+                stats=self.reports[rg.STATS],
+                memo=self.reports,
+                memory_stats=self.memory_stats,
+            )
 
         if self.view == views.CREWS_VIEW:
 
-            df_crew_list = pw.get_pivoted_team_members_report(
-                self.df_team_members, self.df_teams
-            )
-            views.CrewsListView(df_crew_list)
+            views.CrewsListView(self.reports[rg.CREW_LIST], memo=self.reports)
 
         if self.view == views.EVENTS_VIEW:
 
-            df_events = pw.get_events_report(self.df_teams)
-            views.View(self.view, df_events)
+            views.View(self.view, self.reports[rg.EVENTS], memo=self.reports)
 
         if self.view == views.CLUBS_VIEW:
-            df_clubs = pw.get_clubs_report(self.df_teams, self.df_team_members)
-            views.View(self.view, df_clubs)
+            views.View(self.view, self.reports[rg.CLUBS], memo=self.reports)
 
         if self.view == views.ROWERS_VIEW:
             st.warning(
                 "Rowers who are entered into composites may be associated "
                 "with the wrong club."
             )
-            df_rowers = pw.get_rowers_report(self.df_team_members)
-            views.View(self.view, df_rowers)
+            views.View(self.view, self.reports[rg.ROWERS], memo=self.reports)
+
+        if self.view == views.CONFLICTS_VIEW:
+            views.ConflictsView(self.reports[rg.CONFLICTS], memo=self.reports)
+
+        if self.view == views.CHANGES_VIEW:
+            # the changes are this session's, so aren't memoized in the
+            # reports shared with other sessions
+            views.ChangesView(self.df_changes)
 
         if self.view == views.COFD_VIEW:
-            df_CoFD = pw.get_COFD_report(self.df_team_members)
-            views.CofDView(df_CoFD)
+            views.CofDView(self.reports[rg.COFD], memo=self.reports)
+
+        views.reports_workbook_downloader(self.reports)
+        views.reports_zip_downloader(self.reports)
 
     def report_preprocessing(self) -> None:
 
-        df_teams = self.load_and_clean_teams_report()
-        df_team_members = self.load_and_clean_team_members_report()
-        if self.community_members_report is not None:
-            df_community_members = (
-                self.load_and_clean_community_members_report()
+        self.memory_stats = {}
+        self.df_changes = None
+        store = get_event_store(
+            self.app_config.get("published events limit", DEFAULT_MAX_EVENTS)
+        )
+        if self.mode == views.PUBLISHED_MODE:
+            self.reports = views.published_event_selector(store)
+            return
+
+        cache = get_report_cache(
+            self.app_config.get("report cache size", DEFAULT_CACHE_SIZE)
+        )
+        disk_cache = get_disk_cache(
+            self.app_config.get("report disk cache directory"),
+            self.app_config.get(
+                "report disk cache size (MB)", DEFAULT_DISK_CACHE_MB
+            ),
+        )
+        key = hash_reports(
+            self.teams_report,
+            self.team_members_report,
+            self.community_members_report,
+            config=self.pw_config,
+        )
+        # the version of the reports shown in this session before the
+        # current one, to only process what has changed since. The reports
+        # are the same whatever they were processed from, so they are cached
+        # by their own key, and the changes are kept for this session.
+        shown = st.session_state.get("shown reports")
+        if shown is not None and shown[0] != key:
+            st.session_state["previous reports"] = shown
+        previous_key, previous = st.session_state.get(
+            "previous reports", (None, None)
+        )
+        budget_mb = self.app_config.get("memory budget (MB)")
+        pipeline_budget = None
+        if budget_mb:
+            # the previous version is still needed to update the reports
+            pipeline_budget = memory_budget.PipelineBudget(
+                cache, budget_mb, keep=(previous,)
             )
-            df_team_members = pw.get_coxes(
-                df_teams, df_team_members, df_community_members
+        try:
+            self.reports = cache.get_or_compute(
+                key,
+                functools.partial(
+                    self.process_reports, disk_cache, previous, pipeline_budget
+                ),
             )
-        else:
-            df_team_members = pw.get_coxes(df_teams, df_team_members)
-        df_teams = df_teams.drop(pw.COL_COX_NAME, axis=1)
-        # remove coxes from the teams report now that they are in team_members
-
-        # assign dfs to self for access in rest of app
-        self.df_teams = df_teams
-        self.df_team_members = df_team_members
-        if self.community_members_report is not None:
-            self.df_community_members = df_community_members
-
-        # gather some stats
-        self.num_entries = pw.count_num_entries(df_teams)
-        self.total_seats, self.filled_seats = pw.count_num_seats(df_teams)
-        self.unique_rowers = pw.count_unique_rowers(df_team_members)
-
-    def load_and_clean_teams_report(self) -> pd.DataFrame:
-
-        df = pd.read_excel(self.teams_report)  # load teams report
-        df = pw.cleanup_report_columns(
-            df,
-            list(self.pw_config["teams report columns"].values()),
-            list(self.pw_config["teams report columns"].keys()),
+        except pipeline.ReportError as e:
+            st.error(str(e))
+            st.stop()
+        st.session_state["shown reports"] = (key, self.reports)
+        self.df_changes = get_session_changes(
+            key, self.reports, previous_key, previous
         )
-        df = df[pw.TEAM_COLUMNS]  # make sure they are in order
-
-        # check that all of the columns in each row are not empty
-        required_columns = [
-            pw.COL_CREW_ID,
-            pw.COL_BOAT_TYPE,
-            pw.COL_CLUB,
-            pw.COL_CREW_NAME,
-            pw.COL_CREW_LETTER,
-            pw.COL_SEATS,
-            pw.COL_VERIFIED,
-            pw.COL_CAPTAIN,
-            pw.COL_COX,
-        ]
-        # check that there are no nans in the required columns
-        for col in required_columns:
-            if df[col].isnull().sum() > 0:
-                st.error(
-                    f"{col.title()} is missing values. Please check the teams \
-                        report."
-                )
-                st.stop()
-
-        df[[pw.COL_COX, pw.COL_VERIFIED, pw.COL_CAPTAIN]] = pw.clean_booleans(
-            df[[pw.COL_COX, pw.COL_VERIFIED, pw.COL_CAPTAIN]]
+        # once its changes are listed, the previous version isn't held by
+        # the session (or this run), so the memory budget can free it
+        if previous is not None:
+            st.session_state["previous reports"] = (previous_key, None)
+        del shown, previous
+        views.event_publisher(store, self.reports)
+        self.memory_stats = memory_budget.get_memory_stats(
+            cache, self.reports, budget_mb, pipeline_budget
         )
-        df = pw.clean_composites(df)
-        df[pw.COL_CREW_ID] = df[pw.COL_CREW_ID].str.replace(
-            "teams/", "", regex=True
+
+        st.sidebar.caption(
+            f"Report cache: {cache.hits} hits, {cache.misses} misses"
+        )
+        if disk_cache is not None:
+            st.sidebar.caption(
+                f"Disk cache: {disk_cache.hits} hits, "
+                f"{disk_cache.misses} misses"
+            )
+
+    def process_reports(
+        self,
+        disk_cache: ParquetCache = None,
+        previous: rg.ReportGraph = None,
+        check_memory: pipeline.CheckMemory = None,
+    ) -> rg.ReportGraph:
+        """Preprocess the uploaded reports, only processing what has changed
+        since the previous version of them if there is one."""
+
+        return rg.ReportGraph(
+            pipeline.preprocess_reports_cached(
+                self.teams_report,
+                self.team_members_report,
+                self.community_members_report,
+                self.pw_config,
+                disk_cache,
+                previous,
+                check_memory,
+            ),
+            previous,
         )
-        # change the entry ids so the column name and values match the crew id
-        # from the members report
 
-        return df
 
-    def load_and_clean_team_members_report(self) -> pd.DataFrame:
+def get_session_changes(
+    key: str,
+    reports: rg.ReportGraph,
+    previous_key: str = None,
+    previous: rg.ReportGraph = None,
+) -> pd.DataFrame:
+    """
+    The crews changed since the previous version of the reports shown in this
+    session, listed once for each pair of versions. None if there isn't a
+    previous version.
+    """
 
-        df = pd.read_excel(
-            self.team_members_report
-        )  # load team members report
-        df = pw.cleanup_report_columns(
-            df,
-            list(self.pw_config["team members report columns"].values()),
-            list(self.pw_config["team members report columns"].keys()),
-        )
-        df = pw.clean_composites(df, set_composite_flag=False)
-        df = df[pw.TEAM_MEMBER_COLUMNS]  # make sure they are in order
+    changes = st.session_state.get("changes")
+    if changes is not None and changes[0] == (key, previous_key):
+        return changes[1]
+    if previous is None:
+        return None
 
-        df[[pw.COL_ROW_NOVICE, pw.COL_SCULL_NOVICE]] = pw.clean_booleans(
-            df[[pw.COL_ROW_NOVICE, pw.COL_SCULL_NOVICE]]
-        )
-        df[pw.COL_POSITION] = pw.assign_rower_position(df)
+    changes = (
+        (key, previous_key),
+        incremental.get_changes(previous, reports),
+    )
+    st.session_state["changes"] = changes
+    return changes[1]
 
-        return df
 
-    def load_and_clean_community_members_report(self) -> pd.DataFrame:
+@st.experimental_singleton
+def get_report_cache(max_size: int = DEFAULT_CACHE_SIZE) -> ReportCache:
+    """Get the report cache shared by every session of the app."""
 
-        df = pd.read_excel(self.community_members_report)
-        df = pw.cleanup_report_columns(
-            df,
-            list(self.pw_config["community members report columns"].values()),
-            list(self.pw_config["community members report columns"].keys()),
-        )
+    return ReportCache(max_size)
 
-        return df
 
+@st.experimental_singleton
+def get_event_store(max_events: int = DEFAULT_MAX_EVENTS) -> EventStore:
+    """Get the store of published events, shared by every session."""
 
-def load_from_yaml(config_path: str) -> Dict:
-    """Parses a yaml file and returns a dictionary."""
+    return EventStore(max_events)
 
-    with open(config_path, "r") as f:
-        return yaml.safe_load(f)
+
+@st.experimental_singleton
+def get_disk_cache(
+    directory: str = None, max_mb: float = DEFAULT_DISK_CACHE_MB
+) -> ParquetCache:
+    """
+    Get the on disk cache of preprocessed reports, which outlives the app.
+    None if no cache directory is configured.
+    """
+
+    if not directory:
+        return None
+    return ParquetCache(directory, max_mb)
+
+
+@st.experimental_singleton
+def get_logo(path: str, width: int = LOGO_WIDTH) -> bytes:
+    """
+    Get the logo as a png no wider than width, so it isn't decoded and
+    resized from full size on every rerun.
+    """
+
+    image = Image.open(path)
+    if image.width > width:
+        height = int(image.height * width / image.width)
+        image = image.resize((width, height), resample=Image.BILINEAR)
+
+    data = io.BytesIO()
+    image.save(data, format="PNG")
+    return data.getvalue()
+
+
+def reload_modules() -> None:
+    """
+    Reload the modules of the app, so code changes are picked up without
+    restarting the server. Only for development, as it slows every rerun.
+    """
+
+    for module in (pw, views, pipeline, rg):
+        importlib.reload(module)
 
 
 if __name__ == "__main__":
 
+    if load_config(DEFAULT_APP_CONFIG_PATH).get("reload modules"):
+        reload_modules()
+
     app = App()
     app.display()
@@ -0,0 +1,103 @@
+"""
+Tests of the layout checks made on the header row and a sample of rows,
+before a report is read in full.
+
+Run with:
+    python -m unittest discover tests
+"""
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import yaml
+
+import playwaze_rowing_reports.ingest as ingest
+import playwaze_rowing_reports.pipeline as pipeline
+import playwaze_rowing_reports.playwaze_reports as pw
+import playwaze_rowing_reports.synthetic as synthetic
+
+PW_CONFIG_PATH = os.path.join(
+    os.path.dirname(__file__), "..", "config", "playwaze_config.yaml"
+)
+
+# the dtypes each slot reads its report with
+SLOT_DTYPES = {
+    synthetic.TEAMS_REPORT: pw.TEAM_DTYPES,
+    synthetic.TEAM_MEMBERS_REPORT: pw.TEAM_MEMBER_DTYPES,
+    synthetic.COMMUNITY_MEMBERS_REPORT: pw.COMMUNITY_MEMBER_DTYPES,
+}
+FILE_TYPES = ("xlsx", "csv", "json")
+
+
+class LayoutChecksTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+
+        with open(PW_CONFIG_PATH, "r") as f:
+            cls.pw_config = yaml.safe_load(f)
+        cls.tmp = tempfile.TemporaryDirectory()
+        reports = synthetic.generate_reports(n_crews=20, seed=0)
+        cls.paths = synthetic.write_reports(
+            reports, cls.tmp.name, cls.pw_config, FILE_TYPES
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp.cleanup()
+
+    def read_into_slot(self, slot: str, report: str, file_type: str):
+        """Read a report as if it was uploaded into slot."""
+
+        return pipeline.read_report(
+            self.paths[f"{report}.{file_type}"],
+            self.pw_config[f"{slot} report columns"],
+            slot,
+            SLOT_DTYPES[slot],
+            self.pw_config[f"{slot} report headers"],
+        )
+
+    def test_every_slot_has_expected_headers(self):
+
+        for slot in SLOT_DTYPES:
+            with self.subTest(slot=slot):
+                self.assertTrue(self.pw_config[f"{slot} report headers"])
+
+    def test_reports_in_their_slots_are_read(self):
+
+        for slot in SLOT_DTYPES:
+            for file_type in FILE_TYPES:
+                with self.subTest(slot=slot, file_type=file_type):
+                    df = self.read_into_slot(slot, slot, file_type)
+                    self.assertGreater(len(df), 0)
+
+    def test_swapped_reports_are_rejected_from_the_sample(self):
+
+        for slot in SLOT_DTYPES:
+            for report in SLOT_DTYPES:
+                if report == slot:
+                    continue
+                for file_type in FILE_TYPES:
+                    with self.subTest(
+                        slot=slot, report=report, file_type=file_type
+                    ), mock.patch.object(ingest, "read_report") as read:
+                        with self.assertRaises(pipeline.ReportError) as cm:
+                            self.read_into_slot(slot, report, file_type)
+                        self.assertIn(
+                            "does not have the expected layout",
+                            str(cm.exception),
+                        )
+                        read.assert_not_called()  # never read in full
+
+    def test_team_members_report_in_teams_slot_is_rejected_by_header(self):
+
+        with self.assertRaises(pipeline.ReportError) as cm:
+            self.read_into_slot(
+                synthetic.TEAMS_REPORT, synthetic.TEAM_MEMBERS_REPORT, "xlsx"
+            )
+        self.assertIn("but 'Id' was expected", str(cm.exception))
+
+
+if __name__ == "__main__":
+    unittest.main()